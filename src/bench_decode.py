@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON 解码后端微基准：对同一批样本行分别用各可用后端（msgspec / orjson / json）解码，
+输出每秒行数。
+
+用法：
+    python bench_decode.py                                  # 默认 data/google_sql_with_pyv_pkg.json 前 20 万行
+    python bench_decode.py --path xxx.jsonl --schema repo --rows 50000 --repeat 5
+"""
+
+import argparse
+import time
+from itertools import islice
+from pathlib import Path
+
+from etl_common import JSON_SCHEMAS, available_json_backends, json_decoder
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_DIR = PROJECT_ROOT / "data"
+
+
+def bench(lines, schema: str, backend: str, repeat: int) -> float:
+    """返回最佳一轮的 行/秒。"""
+    decode = json_decoder(schema, backend)
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for line in lines:
+            decode(line)
+        best = min(best, time.perf_counter() - t0)
+    return len(lines) / best if best > 0 else float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ETL JSON 解码后端微基准")
+    parser.add_argument("--path", type=Path, default=DATA_DIR / "google_sql_with_pyv_pkg.json")
+    parser.add_argument("--schema", choices=[k for k in JSON_SCHEMAS if k != "top_packages"], default="pypi")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with args.path.open("r", encoding="utf-8") as f:
+        lines = [line for line in (l.strip() for l in islice(f, args.rows)) if line]
+    print(f"样本：{args.path.name} 前 {len(lines)} 行，schema={args.schema}")
+
+    baseline = None
+    for backend in reversed(available_json_backends()):  # json 先跑，作为基线
+        rate = bench(lines, args.schema, backend, args.repeat)
+        baseline = baseline or rate
+        print(f"  {backend:<8} {rate:>12,.0f} 行/秒  ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ETL 基准：用 synth_data.py 生成（或复用）指定规模的合成数据，在独立子进程中分别运行 etl.py 与 flash/etl_flash.py，
+记录总耗时、dump 行数/秒、各阶段耗时与行数（Pipeline 的阶段报告）以及峰值 RSS（主进程与解析子进程分别统计），
+结果写成 JSON（带提交号），可用 compare 在不同提交之间对比。
+
+基准目录默认在系统临时目录下（BENCH_DIR，可用 --bench-dir 指定，不要放在源码树里）：
+合成数据缓存在 <基准目录>/data-<行数>-s<seed>/，各次运行的输出与日志在 <基准目录>/run-<入口>-<行数>/。
+
+用法：
+    python bench_etl.py run                                      # 1 万行，两个入口，结果写到 <基准目录>/results-<提交>.json
+    python bench_etl.py run --rows 10000,1000000 --target etl --workers 4 --repeat 3 --bench-dir /data/bench
+    python bench_etl.py compare /data/bench/results-aaa.json /data/bench/results-bbb.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from etl_common import peak_rss_mb
+from synth_data import generate, load_meta
+
+SRC_DIR = Path(__file__).resolve().parent
+BENCH_DIR = Path(tempfile.gettempdir()) / "pyharmonykg-bench"
+TARGETS = {"etl": SRC_DIR / "etl.py", "flash": SRC_DIR / "flash" / "etl_flash.py"}
+
+
+# ----------- 子进程 ----------- #
+
+def run_child(target: str, data_dir: Path, out_dir: Path, workers: int, result_path: Path):
+    """在本进程运行一个入口（由 run_target 以子进程方式调用），把耗时、阶段报告与峰值 RSS 写到 result_path。"""
+    sys.path.insert(0, str(TARGETS[target].parent))
+    module = __import__(TARGETS[target].stem)
+    module.DATA_DIR, module.OUT_DIR, module.PARSE_WORKERS = data_dir, out_dir, workers
+    t0 = time.perf_counter()
+    stages = module.main([])
+    seconds = time.perf_counter() - t0
+    result = {
+        "seconds": seconds,
+        "stages": stages,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_workers_mb": peak_rss_mb(children=True),
+    }
+    with result_path.open("w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+
+def run_target(target: str, data_dir: Path, workers: int, bench_dir: Path) -> Dict:
+    """以独立子进程运行一个入口（峰值 RSS 与解析缓存互不干扰），返回 run_child 写出的结果。"""
+    run_dir = bench_dir / f"run-{target}-{data_dir.name}"
+    shutil.rmtree(run_dir, ignore_errors=True)
+    out_dir = run_dir / "out"
+    out_dir.mkdir(parents=True)
+    result_path = run_dir / "result.json"
+    cmd = [sys.executable, str(Path(__file__).resolve()), "_child", target, str(data_dir), str(out_dir), str(workers),
+           str(result_path)]
+    with (run_dir / "log.txt").open("w", encoding="utf-8") as log:
+        proc = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT)
+    if proc.returncode != 0:
+        raise SystemExit(f"{target} 运行失败（退出码 {proc.returncode}），日志：{run_dir / 'log.txt'}")
+    with result_path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ----------- 数据与结果 ----------- #
+
+def ensure_data(rows: int, seed: int, bench_dir: Path) -> Tuple[Path, Dict]:
+    """返回 (数据目录, 元数据)；缓存的数据与参数不一致时重新生成。"""
+    data_dir = bench_dir / f"data-{rows}-s{seed}"
+    meta = load_meta(data_dir)
+    if meta is None or meta["rows"] != rows or meta["seed"] != seed:
+        print(f"生成 {rows} 行合成数据：{data_dir}")
+        meta = generate(data_dir, rows, seed)
+    return data_dir, meta
+
+
+def git_commit() -> Optional[str]:
+    """当前提交号（有未提交改动时加 -dirty）；不在 git 仓库中时返回 None。"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--", "."], cwd=SRC_DIR, capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty.stdout.strip() else "")
+
+
+def _best(runs: List[Dict]) -> Dict[Tuple, Dict]:
+    """(入口, 行数, 进程数) -> 耗时最短的一次运行。"""
+    best: Dict[Tuple, Dict] = {}
+    for run in runs:
+        key = (run["target"], run["rows"], run["workers"])
+        if key not in best or run["seconds"] < best[key]["seconds"]:
+            best[key] = run
+    return best
+
+
+def format_run(run: Dict) -> str:
+    rss = run["peak_rss_mb"]
+    workers_rss = run["peak_rss_workers_mb"]
+    return (
+        f"{run['target']:<6} {run['rows']:>10} 行  workers={run['workers']:<3} {run['seconds']:8.2f}s  "
+        f"{run['rows_per_sec']:>10,.0f} 行/s  峰值 RSS {rss or 0:.0f} MB（子进程 {workers_rss or 0:.0f} MB）"
+    )
+
+
+def bench(rows_list: List[int], targets: List[str], workers: int, repeat: int, seed: int, bench_dir: Path) -> Dict:
+    runs = []
+    for rows in rows_list:
+        data_dir, meta = ensure_data(rows, seed, bench_dir)
+        for target in targets:
+            for i in range(repeat):
+                result = run_target(target, data_dir, workers, bench_dir)
+                run = dict(
+                    result,
+                    target=target,
+                    rows=rows,
+                    dump_bytes=meta["dump_bytes"],
+                    workers=workers,
+                    repeat=i,
+                    rows_per_sec=rows / result["seconds"] if result["seconds"] else None,
+                )
+                runs.append(run)
+                print(f"  {format_run(run)}")
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": seed,
+        "runs": runs,
+    }
+
+
+def compare(old_path: Path, new_path: Path):
+    """按 (入口, 行数, 进程数) 对齐两份结果，各取最快一次，打印总耗时、吞吐、峰值 RSS 与各阶段耗时的比值。"""
+    with old_path.open("r", encoding="utf-8") as f:
+        old = json.load(f)
+    with new_path.open("r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old.get('commit')} -> {new.get('commit')}（比值 = 新 / 旧）")
+    old_best, new_best = _best(old["runs"]), _best(new["runs"])
+    for key in sorted(old_best.keys() & new_best.keys()):
+        a, b = old_best[key], new_best[key]
+        rss = f"{b['peak_rss_mb'] / a['peak_rss_mb']:.2f}x" if a["peak_rss_mb"] and b["peak_rss_mb"] else "-"
+        print(
+            f"{key[0]:<6} {key[1]:>10} 行  workers={key[2]:<3} 耗时 {a['seconds']:.2f}s -> {b['seconds']:.2f}s "
+            f"({b['seconds'] / a['seconds']:.2f}x)  峰值 RSS {rss}"
+        )
+        old_stages = {s["stage"]: s["seconds"] for s in a["stages"]}
+        for stage in b["stages"]:
+            before = old_stages.get(stage["stage"])
+            ratio = f"{stage['seconds'] / before:.2f}x" if before else "新阶段"
+            print(f"    {stage['stage']:<24} {before or 0:8.2f}s -> {stage['seconds']:8.2f}s  {ratio}")
+    for key in sorted(old_best.keys() ^ new_best.keys()):
+        print(f"{key[0]:<6} {key[1]:>10} 行  workers={key[2]:<3} 只在一份结果中出现")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ETL 基准（合成数据）")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("run", help="生成/复用合成数据并运行基准")
+    run.add_argument("--rows", default="10000", help="逗号分隔的 dump 行数，如 10000,1000000")
+    run.add_argument("--target", default="etl,flash", help="逗号分隔：etl、flash")
+    run.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="解析进程数（PARSE_WORKERS）")
+    run.add_argument("--repeat", type=int, default=1)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--bench-dir", type=Path, default=BENCH_DIR, help=f"合成数据、运行输出与结果的目录，默认 {BENCH_DIR}")
+    run.add_argument("--json", type=Path, help="结果文件，默认 <基准目录>/results-<提交>.json")
+    cmp_ = sub.add_parser("compare", help="对比两份结果")
+    cmp_.add_argument("old", type=Path)
+    cmp_.add_argument("new", type=Path)
+    child = sub.add_parser("_child")  # 内部使用：在子进程中运行一个入口
+    child.add_argument("target", choices=sorted(TARGETS))
+    child.add_argument("data_dir", type=Path)
+    child.add_argument("out_dir", type=Path)
+    child.add_argument("workers", type=int)
+    child.add_argument("result", type=Path)
+    args = parser.parse_args()
+
+    if args.cmd == "_child":
+        run_child(args.target, args.data_dir, args.out_dir, args.workers, args.result)
+    elif args.cmd == "compare":
+        compare(args.old, args.new)
+    else:
+        targets = args.target.split(",")
+        unknown = set(targets) - set(TARGETS)
+        if unknown:
+            raise SystemExit(f"未知入口：{sorted(unknown)}")
+        results = bench(
+            [int(r) for r in args.rows.split(",")], targets, args.workers, args.repeat, args.seed, args.bench_dir
+        )
+        path = args.json or args.bench_dir / f"results-{results['commit'] or 'nogit'}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {path}")
+
+
+if __name__ == "__main__":
+    main()
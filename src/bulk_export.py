@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+把 ETL 输出的七个 CSV 转成 neo4j-admin database import 可直接使用的文件（写入 <out>/bulk/），
+用于离线全量建库，替代逐批 UNWIND ... MERGE 上传。
+
+- 节点文件：Package / PackageVersion / Repo / Topic，按 ID 去重（以首次出现为准）；
+- 关系文件：HAS_VERSION / REQUIRES / DEPENDS_ON / TAGGED_AS；
+- 每个文件配一个 *_header.csv，写明 :ID(...)、:START_ID(...)/:END_ID(...) 与属性类型；
+- 生成 import.sh，给出对应的 neo4j-admin 命令。
+
+去重规则与导入脚本的 MERGE 语义一致：同一 name_version 多次出现时只保留首次出现的版本行及其依赖边，
+同一 (起点, 终点) 的 REQUIRES/DEPENDS_ON 只保留一条（属性取最后一行，同 MERGE 后 SET 的效果）；
+终点不在 Package 节点中的 REQUIRES 与导入脚本的 MATCH 一样被丢弃。
+
+用法：
+    python bulk_export.py                        # 转换 src/out/
+    python bulk_export.py --out flash/out        # 转换精简版输出
+    python bulk_export.py --check                # 转换后核对节点/关系数
+"""
+
+import argparse
+import csv
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from etl_common import CsvStreamWriter
+
+OUT_DIR = Path(__file__).resolve().parent / "out"
+
+# 文件名 -> (neo4j-admin 表头, 标签或关系类型)
+NODE_FILES: Dict[str, Tuple[List[str], str]] = {
+    "packages": (
+        ["name:ID(Package)", "downloads:long", "rank:long", "is_top:boolean", "noise:boolean", "latest_ordinal:long"],
+        "Package",
+    ),
+    "package_versions": (
+        [
+            "name_version:ID(PackageVersion)", "version", "requires_python", "is_top_pkg:boolean", "version_key",
+            "version_ordinal:long", "python_mask:long",
+        ],
+        "PackageVersion",
+    ),
+    "repos": (["full_name:ID(Repo)", "stars:long", "about"], "Repo"),
+    "topics": (["name:ID(Topic)"], "Topic"),
+}
+RELATIONSHIP_FILES: Dict[str, Tuple[List[str], str]] = {
+    "has_version": ([":START_ID(Package)", ":END_ID(PackageVersion)"], "HAS_VERSION"),
+    "requires": (
+        [":START_ID(PackageVersion)", ":END_ID(Package)", "spec", "marker", "spec_intervals", "env_mask:long"],
+        "REQUIRES",
+    ),
+    "depends_on": (
+        [":START_ID(Repo)", ":END_ID(Package)", "spec", "marker", "spec_intervals", "env_mask:long"],
+        "DEPENDS_ON",
+    ),
+    "tagged_as": ([":START_ID(Repo)", ":END_ID(Topic)"], "TAGGED_AS"),
+}
+
+
+def _read_rows(path: Path) -> Iterator[Dict[str, str]]:
+    with path.open("r", encoding="utf-8", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def _bool(value: str) -> str:
+    return "true" if value in ("True", "true") else "false"
+
+
+class _BulkWriter:
+    """无表头数据文件 + 单独的 *_header.csv；列名只用于 DictWriter 取值。"""
+
+    def __init__(self, bulk_dir: Path, name: str, header: List[str]):
+        with (bulk_dir / f"{name}_header.csv").open("w", encoding="utf-8", newline="") as f:
+            csv.writer(f).writerow(header)
+        self.out = CsvStreamWriter(bulk_dir / f"{name}.csv", header, header=False)
+        self.header = header
+
+    def write(self, *values):
+        self.out.write(dict(zip(self.header, values)))
+
+    @property
+    def count(self) -> int:
+        return self.out.count
+
+    def close(self):
+        self.out.close()
+
+
+def write_bulk_import(out_dir: Path = OUT_DIR, bulk_dir: Optional[Path] = None) -> Dict[str, int]:
+    """转换 out_dir 下的 CSV，写入 bulk_dir（默认 out_dir/bulk），返回 文件名 -> 行数。"""
+    bulk_dir = bulk_dir or out_dir / "bulk"
+    bulk_dir.mkdir(parents=True, exist_ok=True)
+    counts: Dict[str, int] = {}
+
+    def writer(name: str, extra: Tuple[str, ...] = ()) -> _BulkWriter:
+        header = (NODE_FILES.get(name) or RELATIONSHIP_FILES[name])[0]
+        return _BulkWriter(bulk_dir, name, header + list(extra))
+
+    # Package
+    package_ids: Set[str] = set()
+    out = writer("packages")
+    for row in _read_rows(out_dir / "packages.csv"):
+        if row["name"] in package_ids:
+            continue
+        package_ids.add(row["name"])
+        out.write(
+            row["name"], row["downloads"], row["rank"], _bool(row["is_top"]), _bool(row["noise"]), row["latest_ordinal"]
+        )
+    out.close()
+    counts["packages"] = out.count
+
+    # PackageVersion + HAS_VERSION；精简版多一列 upload_time
+    version_path = out_dir / "package_versions.csv"
+    with version_path.open("r", encoding="utf-8", newline="") as f:
+        has_upload_time = "upload_time" in next(csv.reader(f), [])
+    version_ids: Set[str] = set()
+    out = writer("package_versions", ("upload_time:double",) if has_upload_time else ())
+    has_version = writer("has_version")
+    for row in _read_rows(version_path):
+        name_version = row["name_version"]
+        if name_version in version_ids:
+            continue
+        version_ids.add(name_version)
+        values = [
+            name_version, row["version"], row["requires_python"], _bool(row["is_top_pkg"]), row["version_key"],
+            row["version_ordinal"], row["python_mask"],
+        ]
+        if has_upload_time:
+            values.append(row["upload_time"])
+        out.write(*values)
+        has_version.write(row["name"], name_version)
+    out.close()
+    has_version.close()
+    counts["package_versions"], counts["has_version"] = out.count, has_version.count
+
+    # REQUIRES：同一版本的依赖边在 CSV 中连续；重复出现的版本整组跳过，组内按终点去重
+    out = writer("requires")
+    done: Set[str] = set()
+    current: Optional[str] = None
+    group: Dict[str, Tuple[str, ...]] = {}
+
+    def flush_group():
+        for dest, props in group.items():
+            out.write(current, dest, *props)
+        group.clear()
+
+    for row in _read_rows(out_dir / "package_version_requires.csv"):
+        src = row["src"]
+        if src != current:
+            flush_group()
+            if current is not None:
+                done.add(current)
+            current = src
+        if src in done or src not in version_ids or row["dest"] not in package_ids:
+            continue
+        group[row["dest"]] = (row["spec"], row["marker"], row["spec_intervals"], row["env_mask"])
+    flush_group()
+    out.close()
+    counts["requires"] = out.count
+
+    # Repo
+    repo_ids: Set[str] = set()
+    out = writer("repos")
+    for row in _read_rows(out_dir / "repos.csv"):
+        if row["full_name"] in repo_ids:
+            continue
+        repo_ids.add(row["full_name"])
+        out.write(row["full_name"], row["stars"], row["about"])
+    out.close()
+    counts["repos"] = out.count
+
+    # DEPENDS_ON：仓库规模小，整体按 (repo, pkg) 去重
+    depends: Dict[Tuple[str, str], Tuple[str, ...]] = {}
+    for row in _read_rows(out_dir / "repo_depends.csv"):
+        if row["repo"] in repo_ids and row["pkg"] in package_ids:
+            depends[(row["repo"], row["pkg"])] = (row["spec"], row["marker"], row["spec_intervals"], row["env_mask"])
+    out = writer("depends_on")
+    for (repo, pkg), props in depends.items():
+        out.write(repo, pkg, *props)
+    out.close()
+    counts["depends_on"] = out.count
+
+    # Topic 与 TAGGED_AS 都由 repo_topics 去重得到（topics.csv 每个 repo-topic 对一行）
+    topic_ids: Dict[str, None] = {}
+    tagged: Dict[Tuple[str, str], None] = {}
+    for row in _read_rows(out_dir / "repo_topics.csv"):
+        topic_ids.setdefault(row["topic"])
+        if row["repo"] in repo_ids:
+            tagged.setdefault((row["repo"], row["topic"]))
+    for row in _read_rows(out_dir / "topics.csv"):
+        topic_ids.setdefault(row["name"])
+    out = writer("topics")
+    for topic in topic_ids:
+        out.write(topic)
+    out.close()
+    counts["topics"] = out.count
+    out = writer("tagged_as")
+    for repo, topic in tagged:
+        out.write(repo, topic)
+    out.close()
+    counts["tagged_as"] = out.count
+
+    _write_import_script(bulk_dir)
+    return counts
+
+
+def _write_import_script(bulk_dir: Path):
+    args = [f"--nodes={label}=$DIR/{name}_header.csv,$DIR/{name}.csv" for name, (_, label) in NODE_FILES.items()]
+    args += [
+        f"--relationships={rel_type}=$DIR/{name}_header.csv,$DIR/{name}.csv"
+        for name, (_, rel_type) in RELATIONSHIP_FILES.items()
+    ]
+    lines = [
+        "#!/bin/sh",
+        "# 离线全量导入（目标库需为空或不存在，导入前先停库）：sh import.sh [数据库名]",
+        'DIR="$(cd "$(dirname "$0")" && pwd)"',
+        "neo4j-admin database import full \\",
+        *[f"  {arg} \\" for arg in args],
+        "  --multiline-fields=true \\",
+        '  --overwrite-destination=true "${1:-neo4j}"',
+        "",
+    ]
+    (bulk_dir / "import.sh").write_text("\n".join(lines), encoding="utf-8")
+
+
+# ----------- 核对 ----------- #
+
+def count_rows(bulk_dir: Path) -> Dict[str, int]:
+    """统计 bulk_dir 下各数据文件的记录数（按 CSV 解析，字段内换行不重复计数）。"""
+    result = {}
+    for name in list(NODE_FILES) + list(RELATIONSHIP_FILES):
+        with (bulk_dir / f"{name}.csv").open("r", encoding="utf-8", newline="") as f:
+            result[name] = sum(1 for _ in csv.reader(f))
+    return result
+
+
+def expected_counts(out_dir: Path) -> Dict[str, int]:
+    """不经转换逻辑，直接从 ETL CSV 按 MERGE 语义算出应有的节点/关系数。"""
+    packages = {row["name"] for row in _read_rows(out_dir / "packages.csv")}
+    versions: Dict[str, str] = {}
+    for row in _read_rows(out_dir / "package_versions.csv"):
+        versions.setdefault(row["name_version"], row["name"])
+    # 重复出现的版本只计首次出现那一组依赖边
+    requires: Set[Tuple[str, str]] = set()
+    seen_groups: Set[str] = set()
+    previous = None
+    for row in _read_rows(out_dir / "package_version_requires.csv"):
+        if row["src"] != previous:
+            skip = row["src"] in seen_groups
+            seen_groups.add(row["src"])
+            previous = row["src"]
+        if not skip and row["src"] in versions and row["dest"] in packages:
+            requires.add((row["src"], row["dest"]))
+    repos = {row["full_name"] for row in _read_rows(out_dir / "repos.csv")}
+    depends = {
+        (row["repo"], row["pkg"])
+        for row in _read_rows(out_dir / "repo_depends.csv")
+        if row["repo"] in repos and row["pkg"] in packages
+    }
+    repo_topics = list(_read_rows(out_dir / "repo_topics.csv"))
+    topics = {row["topic"] for row in repo_topics} | {row["name"] for row in _read_rows(out_dir / "topics.csv")}
+    tagged = {(row["repo"], row["topic"]) for row in repo_topics if row["repo"] in repos}
+    return {
+        "packages": len(packages),
+        "package_versions": len(versions),
+        "repos": len(repos),
+        "topics": len(topics),
+        "has_version": len(versions),
+        "requires": len(requires),
+        "depends_on": len(depends),
+        "tagged_as": len(tagged),
+    }
+
+
+def check_bulk(out_dir: Path, bulk_dir: Optional[Path] = None) -> bool:
+    bulk_dir = bulk_dir or out_dir / "bulk"
+    expected, actual = expected_counts(out_dir), count_rows(bulk_dir)
+    ok = True
+    for name, want in expected.items():
+        flag = "OK" if actual[name] == want else "不一致"
+        ok = ok and actual[name] == want
+        print(f"  {name:<18} 期望 {want:>10}  实际 {actual[name]:>10}  {flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成 neo4j-admin database import 文件")
+    parser.add_argument("--out", type=Path, default=OUT_DIR, help="ETL 输出目录（含七个 CSV）")
+    parser.add_argument("--check", action="store_true", help="转换后核对节点/关系数")
+    args = parser.parse_args()
+
+    counts = write_bulk_import(args.out)
+    for name, n in counts.items():
+        print(f"  {name:<18} {n}")
+    print(f"已写出 {args.out / 'bulk'}，运行其中的 import.sh 导入")
+    if args.check and not check_bulk(args.out):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
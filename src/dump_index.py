@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PyPI dump 的字节偏移索引：package -> [(字节偏移, 长度)]，按包随机读取原始行，无需整文件扫描。
+
+索引文件默认放在 dump 旁边（文件名加 .idx），marshal 编码的 dict：
+- source：dump 的 (字节数, mtime_ns)，与当前文件不一致即视为过期；
+- names：排序后的规范化包名；
+- starts：array('Q')，第 i 个包的条目下标范围为 [starts[i], starts[i+1])；
+- offsets / lengths：array('Q') / array('I')，每行的起始偏移与长度（不含换行），同一包内按文件顺序。
+
+读取时 mmap 整个 dump，查包名二分、取行切片，单个包的查询在微秒级。
+
+用法：
+    python dump_index.py build                   # 为 data/google_sql_with_pyv_pkg.json 建索引
+    python dump_index.py show requests           # 打印某个包在 dump 中的原始行
+    python dump_index.py show requests --path data/google_sql_with_time_pkg.json
+"""
+
+import argparse
+import functools
+import marshal
+import mmap
+import os
+import re
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from etl_common import (
+    CHECKPOINT_BYTES,
+    SHARDS_PER_WORKER,
+    input_compression,
+    json_decoder,
+    map_ordered,
+    normalize_name,
+    record_input,
+    split_line_ranges,
+)
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_DIR = PROJECT_ROOT / "data"
+
+BUILD_WORKERS = os.cpu_count() or 1  # 建索引的进程数；1 为串行
+
+decode_pypi_row = json_decoder("pypi")
+
+# 与 etl_common 的预过滤同一规则，直接作用于字节行；含转义或截取不到时回退到完整解码
+_PACKAGE_RE = re.compile(rb'"package"\s*:\s*"([^"\\]*)"')
+_normalize_raw = functools.lru_cache(maxsize=1 << 16)(normalize_name)
+
+
+def index_path_for(path: Path) -> Path:
+    return path.with_name(path.name + ".idx")
+
+
+def _source_of(path: Path) -> Tuple[int, int]:
+    stat = path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+# ----------- 建索引 ----------- #
+
+def _line_package(line: bytes) -> str:
+    m = _PACKAGE_RE.search(line)
+    if m is not None:
+        return _normalize_raw(m.group(1).decode("utf-8"))
+    return normalize_name(decode_pypi_row(line.decode("utf-8")).get("package", ""))
+
+
+def _index_shard(path: Path, start: int, end: int) -> Tuple[List[str], array, array, array]:
+    """扫描 [start, end) 字节区间，返回 (本分片包名表, 每行包名下标, 每行偏移, 每行长度)。"""
+    names: List[str] = []
+    ids: Dict[str, int] = {}
+    row_ids, offsets, lengths = array("I"), array("Q"), array("I")
+    pos = start
+    with path.open("rb") as f:
+        f.seek(start)
+        for raw in f:
+            if pos >= end:
+                break
+            line = raw.rstrip(b"\r\n")
+            if line.strip():
+                pkg = _line_package(line)
+                idx = ids.get(pkg)
+                if idx is None:
+                    idx = ids[pkg] = len(names)
+                    names.append(pkg)
+                row_ids.append(idx)
+                offsets.append(pos)
+                lengths.append(len(line))
+            pos += len(raw)
+    return names, row_ids, offsets, lengths
+
+
+def build_index(path: Path, index_path: Optional[Path] = None, workers: int = BUILD_WORKERS) -> Path:
+    """扫描一遍 dump 建立字节偏移索引并写入 index_path（默认 dump 旁的 .idx），返回索引路径。"""
+    if input_compression(path) is not None:
+        raise SystemExit(f"索引按原始字节偏移随机读取，不支持压缩的 dump：{path}")
+    index_path = index_path or index_path_for(path)
+    source = _source_of(path)
+    if workers > 1:
+        args = [(path, start, end) for start, end in split_line_ranges(path, workers * SHARDS_PER_WORKER)]
+        shards = map_ordered(_index_shard, args, workers, desc="建立字节偏移索引")
+    else:
+        shards = [_index_shard(path, 0, source[0])]
+
+    # 分片按文件顺序排列；先数出每个包的行数，再按包名顺序计数排序，包内保持文件顺序
+    counts: Dict[str, int] = {}
+    for names, row_ids, _, _ in shards:
+        for idx in row_ids:
+            counts[names[idx]] = counts.get(names[idx], 0) + 1
+    sorted_names = sorted(counts)
+    starts = array("Q", [0])
+    slot: Dict[str, int] = {}
+    for name in sorted_names:
+        slot[name] = starts[-1]
+        starts.append(starts[-1] + counts[name])
+
+    total = starts[-1]
+    offsets, lengths = array("Q", bytes(8 * total)), array("I", bytes(4 * total))
+    for names, row_ids, shard_offsets, shard_lengths in shards:
+        for idx, offset, length in zip(row_ids, shard_offsets, shard_lengths):
+            name = names[idx]
+            i = slot[name]
+            offsets[i], lengths[i] = offset, length
+            slot[name] = i + 1
+
+    tmp = index_path.with_name(index_path.name + ".tmp")
+    with tmp.open("wb") as f:
+        marshal.dump(
+            {
+                "source": source,
+                "names": sorted_names,
+                "starts": starts.tobytes(),
+                "offsets": offsets.tobytes(),
+                "lengths": lengths.tobytes(),
+            },
+            f,
+        )
+    os.replace(tmp, index_path)
+    return index_path
+
+
+# ----------- 读取 ----------- #
+
+class DumpIndex:
+    """mmap 读取 dump 的按包索引，可作上下文管理器使用。索引与 dump 不一致时抛 ValueError。"""
+
+    def __init__(self, path: Path, index_path: Optional[Path] = None):
+        index_path = index_path or index_path_for(path)
+        with index_path.open("rb") as f:
+            data = marshal.load(f)
+        if tuple(data["source"]) != _source_of(path):
+            raise ValueError(f"索引已过期：{index_path}（dump 已变化，请重新运行 dump_index.py build）")
+        self.path = path
+        self.names: List[str] = data["names"]
+        self.starts = array("Q")
+        self.starts.frombytes(data["starts"])
+        self.offsets = array("Q")
+        self.offsets.frombytes(data["offsets"])
+        self.lengths = array("I")
+        self.lengths.frombytes(data["lengths"])
+        self._file = path.open("rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets else None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, pkg: str) -> bool:
+        return self._slot(normalize_name(pkg)) is not None
+
+    def _slot(self, pkg: str) -> Optional[int]:
+        i = bisect_left(self.names, pkg)
+        return i if i < len(self.names) and self.names[i] == pkg else None
+
+    def spans(self, pkg: str) -> List[Tuple[int, int]]:
+        """返回包的 [(字节偏移, 长度)]，按文件顺序；不存在时返回空列表。"""
+        i = self._slot(normalize_name(pkg))
+        if i is None:
+            return []
+        lo, hi = self.starts[i], self.starts[i + 1]
+        return list(zip(self.offsets[lo:hi], self.lengths[lo:hi]))
+
+    def rows(self, pkg: str) -> List[str]:
+        """返回包在 dump 中的原始 JSON 行。"""
+        return [self._mm[offset : offset + length].decode("utf-8") for offset, length in self.spans(pkg)]
+
+    def records(self, pkg: str, decode: Callable[[str], Dict] = decode_pypi_row) -> List[Dict]:
+        """返回包在 dump 中的各行解码结果。"""
+        return [decode(line) for line in self.rows(pkg)]
+
+    def select(self, pkgs: Iterable[str]) -> Tuple[array, array]:
+        """一组（已规范化的）包的全部行，按文件偏移排序，返回 (offsets, lengths)。"""
+        spans: List[Tuple[int, int]] = []
+        for pkg in pkgs:
+            i = self._slot(pkg)
+            if i is not None:
+                lo, hi = self.starts[i], self.starts[i + 1]
+                spans.extend(zip(self.offsets[lo:hi], self.lengths[lo:hi]))
+        spans.sort()
+        return array("Q", (s[0] for s in spans)), array("I", (s[1] for s in spans))
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_index(path: Path) -> Optional[DumpIndex]:
+    """dump 旁有最新的索引则打开，没有或已过期返回 None。"""
+    try:
+        return DumpIndex(path)
+    except (OSError, ValueError, EOFError):
+        return None
+
+
+def iter_span_lines(
+    path: Path,
+    offsets: array,
+    lengths: array,
+    start: int = 0,
+    on_boundary: Optional[Callable[[int], None]] = None,
+) -> Iterator[str]:
+    """
+    mmap 读取 dump 中偏移不小于 start 的各行（offsets 需升序）。
+    on_boundary(pos) 与 iter_range_lines 相同：每隔 CHECKPOINT_BYTES 在下一行开始前调用，pos 为该行偏移。
+    """
+    if not offsets:
+        return
+    last = start
+    lines = nbytes = 0
+    try:
+        with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for i in range(bisect_left(offsets, start), len(offsets)):
+                offset = offsets[i]
+                if on_boundary is not None and offset - last >= CHECKPOINT_BYTES:
+                    on_boundary(offset)
+                    last = offset
+                lines += 1
+                nbytes += lengths[i]
+                yield mm[offset : offset + lengths[i]].decode("utf-8")
+    finally:
+        record_input(lines, nbytes)
+
+
+# ----------- 命令行 ----------- #
+
+def main():
+    parser = argparse.ArgumentParser(description="PyPI dump 字节偏移索引")
+    parser.add_argument("--path", type=Path, default=DATA_DIR / "google_sql_with_pyv_pkg.json")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("build", help="扫描 dump 建立索引")
+    show = sub.add_parser("show", help="打印某个包的原始行")
+    show.add_argument("package")
+    args = parser.parse_args()
+
+    if args.cmd == "build":
+        index_path = build_index(args.path)
+        with DumpIndex(args.path, index_path) as index:
+            print(f"索引：{index_path}，包数 {len(index)}，行数 {len(index.offsets)}")
+        return
+
+    with DumpIndex(args.path) as index:
+        for line in index.rows(args.package):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
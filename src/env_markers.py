@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+依赖边环境标记（marker）的预计算：ETL 时把每个不同的 marker 字符串对一组目标环境各求值一次，
+结果存成整数位掩码（REQUIRES / DEPENDS_ON 的 env_mask 列），下游按位判断边在目标环境下是否生效。
+
+- 目标环境矩阵为 TARGET_PYTHONS × TARGET_PLATFORMS（CPython 3.8–3.13 × linux/macos/windows），
+  第 i 个 Python、第 j 个平台对应第 i * len(TARGET_PLATFORMS) + j 位；改动矩阵后需重新跑 ETL；
+- 求值时 extra 为空，只在某个 extra 下才生效的依赖掩码为 0，与原先“跳过 extra ==”的做法一致；
+- 空 marker 与无法解析的 marker 视为在所有环境生效（ALL_ENVS）。
+
+版本的 requires_python 同样预计算成位掩码（package_versions 的 python_mask 列）：第 i 位表示 PYTHON_MINORS[i]
+（2.7、3.5–3.14）可以安装；某个小版本的 x.y.0 或较新补丁满足约束即视为支持，空与无法解析的约束为 ALL_PYTHONS。
+解析器用 python_supported(mask, python) 按位预筛候选版本。
+
+用法：
+    python env_markers.py 'python_version < "3.10" and sys_platform == "win32"'   # 打印各环境的求值结果
+    python env_markers.py --requires-python '>=3.8,!=3.9.*'                        # 打印各小版本是否支持
+"""
+
+import argparse
+import functools
+from typing import Dict, List, Optional, Tuple
+
+from packaging.markers import InvalidMarker, Marker, UndefinedComparison, UndefinedEnvironmentName
+from packaging.specifiers import InvalidSpecifier, SpecifierSet
+
+TARGET_PYTHONS = ["3.8", "3.9", "3.10", "3.11", "3.12", "3.13"]
+TARGET_PLATFORMS = ["linux", "macos", "windows"]
+PYTHON_MINORS = ["2.7", "3.5", "3.6", "3.7", "3.8", "3.9", "3.10", "3.11", "3.12", "3.13", "3.14"]
+
+# python_full_version 取各小版本较新的补丁号（不在表中的取 x.y.0），使 ">= 3.8.1" 一类约束按常见安装求值
+PYTHON_FULL_VERSIONS = {
+    "2.7": "2.7.18", "3.5": "3.5.10", "3.6": "3.6.15", "3.7": "3.7.17",
+    "3.8": "3.8.20", "3.9": "3.9.23", "3.10": "3.10.18", "3.11": "3.11.13", "3.12": "3.12.11", "3.13": "3.13.5",
+}
+
+# 平台相关的 marker 变量
+PLATFORM_ENVIRONMENTS: Dict[str, Dict[str, str]] = {
+    "linux": {"sys_platform": "linux", "platform_system": "Linux", "os_name": "posix", "platform_machine": "x86_64"},
+    "macos": {"sys_platform": "darwin", "platform_system": "Darwin", "os_name": "posix", "platform_machine": "arm64"},
+    "windows": {"sys_platform": "win32", "platform_system": "Windows", "os_name": "nt", "platform_machine": "AMD64"},
+}
+
+ALL_ENVS = (1 << (len(TARGET_PYTHONS) * len(TARGET_PLATFORMS))) - 1
+ALL_PYTHONS = (1 << len(PYTHON_MINORS)) - 1
+
+
+def target_environments() -> List[Tuple[str, str, Dict[str, str]]]:
+    """按位序列出 (python, platform, marker 环境变量)。"""
+    envs = []
+    for python in TARGET_PYTHONS:
+        for platform in TARGET_PLATFORMS:
+            full_version = PYTHON_FULL_VERSIONS.get(python, f"{python}.0")
+            env = {
+                "implementation_name": "cpython",
+                "platform_python_implementation": "CPython",
+                "python_version": python,
+                "python_full_version": full_version,
+                "implementation_version": full_version,
+                "platform_release": "",
+                "platform_version": "",
+                "extra": "",
+                **PLATFORM_ENVIRONMENTS[platform],
+            }
+            envs.append((python, platform, env))
+    return envs
+
+
+_ENVIRONMENTS = target_environments()
+
+
+def env_bit(python: str, platform: str) -> int:
+    """目标环境对应的位；不在矩阵中时返回 0。"""
+    try:
+        return 1 << (TARGET_PYTHONS.index(python) * len(TARGET_PLATFORMS) + TARGET_PLATFORMS.index(platform))
+    except ValueError:
+        return 0
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def marker_mask(marker: str) -> int:
+    """marker 在各目标环境下的求值结果，按位组成整数。"""
+    if not marker:
+        return ALL_ENVS
+    try:
+        parsed = Marker(marker)
+        mask = 0
+        for i, (_, _, env) in enumerate(_ENVIRONMENTS):
+            if parsed.evaluate(env):
+                mask |= 1 << i
+        return mask
+    except (InvalidMarker, UndefinedComparison, UndefinedEnvironmentName):
+        return ALL_ENVS
+
+
+def marker_active(marker: str, mask: Optional[int], python: str, platform: str) -> bool:
+    """
+    依赖边在目标环境下是否生效：有 env_mask 且目标环境在矩阵中时按位判断；
+    否则（旧图谱或矩阵外的环境）沿用原规则，只跳过含 extra == 的依赖。
+    """
+    bit = env_bit(python, platform)
+    if mask is None or not bit:
+        return not (marker and "extra ==" in marker)
+    return bool(mask & bit)
+
+
+# ----------- requires_python ----------- #
+
+@functools.lru_cache(maxsize=1 << 16)
+def python_mask(requires_python: str) -> int:
+    """requires_python 支持的小版本，按 PYTHON_MINORS 的位序组成整数。"""
+    if not requires_python:
+        return ALL_PYTHONS
+    try:
+        specifiers = SpecifierSet(requires_python)
+    except InvalidSpecifier:
+        return ALL_PYTHONS
+    mask = 0
+    for i, minor in enumerate(PYTHON_MINORS):
+        patches = {f"{minor}.0", PYTHON_FULL_VERSIONS.get(minor, f"{minor}.0")}
+        if any(specifiers.contains(v, prereleases=True) for v in patches):
+            mask |= 1 << i
+    return mask
+
+
+def python_supported(mask: Optional[int], python: str) -> bool:
+    """版本能否装在目标解释器上；没有 python_mask（旧图谱）或解释器不在 PYTHON_MINORS 中时不过滤。"""
+    if mask is None or python not in PYTHON_MINORS:
+        return True
+    return bool(mask >> PYTHON_MINORS.index(python) & 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按目标环境矩阵求值 marker / requires_python")
+    parser.add_argument("marker")
+    parser.add_argument("--requires-python", action="store_true", help="把参数当作 requires_python 求值")
+    args = parser.parse_args()
+
+    if args.requires_python:
+        mask = python_mask(args.marker)
+        print(f"python_mask = {mask}")
+        for python in PYTHON_MINORS:
+            print(f"  {python:<5} {'Y' if python_supported(mask, python) else '-'}")
+        return
+
+    mask = marker_mask(args.marker)
+    print(f"env_mask = {mask}")
+    for python, platform, _ in _ENVIRONMENTS:
+        print(f"  {python:<5} {platform:<8} {'Y' if mask & env_bit(python, platform) else '-'}")
+
+
+if __name__ == "__main__":
+    main()
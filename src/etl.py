@@ -1,326 +1,733 @@
-"""
-基于三份数据文件构建 Neo4j 导入所需的 CSV：
-- data/top_packages_by_downloads_10000.json           下载量榜（前 1 万）
-- data/google_sql_with_pyv_pkg.json                   包版本与 requires_dist（>2GB，逐行流式）
-- data/python_repos_requirements_more_info_1w1.jsonl  GitHub 热门仓库 requirements（1w 分片 1）
-- data/python_repos_requirements_more_info_1w2.jsonl  GitHub 热门仓库 requirements（1w 分片 2）
-- (兼容) data/python_repos_requirements_more_info.jsonl  旧版单文件（若 1w 分片不存在则回退）
-
-输出（写入当前目录下 out/）：
-- packages.csv                Package 节点
-- package_versions.csv        PackageVersion 节点
-- package_version_requires.csv PackageVersion -> Package 依赖
-- repos.csv                   Repo 节点
-- repo_depends.csv            Repo -> Package 依赖
-- topics.csv                  Topic 节点
-- repo_topics.csv             Repo -> Topic 关系
-
-导入前请先在 Neo4j 建约束：
-  CREATE CONSTRAINT pkg IF NOT EXISTS FOR (p:Package) REQUIRE p.name IS UNIQUE;
-  CREATE CONSTRAINT pv IF NOT EXISTS FOR (v:PackageVersion) REQUIRE v.name_version IS UNIQUE;
-  CREATE CONSTRAINT repo IF NOT EXISTS FOR (r:Repo) REQUIRE r.full_name IS UNIQUE;
-  CREATE CONSTRAINT topic IF NOT EXISTS FOR (t:Topic) REQUIRE t.name IS UNIQUE;
-"""
-
-import csv
-import json
-import re
-import sys
-from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Set, Tuple
-
-PROJECT_ROOT = Path(__file__).resolve().parents[1]
-DATA_DIR = PROJECT_ROOT / "data"
-OUT_DIR = Path(__file__).resolve().parent / "out"
-
-# ----------- 基础工具 ----------- #
-
-_SPACE_RE = re.compile(r"\s+")
-
-
-def normalize_name(name: str) -> str:
-    """统一包名：小写、下划线转连字符、去空白。"""
-    return _SPACE_RE.sub("-", name.strip().lower().replace("_", "-"))
-
-
-def parse_requirement(req: str) -> Tuple[Optional[str], str, str]:
-    """
-    解析 requires_dist / requirement 行，返回 (包名, 版本约束, marker)。
-    尽量不依赖外部库；若系统已装 packaging.requirements 则优先使用。
-    """
-    req = req.strip()
-    if not req:
-        return None, "", ""
-
-    try:
-        from packaging.requirements import Requirement  # type: ignore
-    except Exception:
-        Requirement = None  # type: ignore
-
-    if Requirement:
-        try:
-            r = Requirement(req)
-            name = normalize_name(r.name)
-            spec = str(r.specifier) if r.specifier else ""
-            marker = str(r.marker) if r.marker else ""
-            return name, spec, marker
-        except Exception:
-            pass  # 回退到简单解析
-
-    # 简易回退：截断 ';' marker 与括号约束
-    marker = ""
-    if ";" in req:
-        req, marker = req.split(";", 1)
-        marker = marker.strip()
-    req = req.strip()
-    name = normalize_name(req.split()[0].split("[", 1)[0].split("(", 1)[0])
-    spec = ""
-    if "(" in req and ")" in req:
-        spec = req[req.find("(") : req.find(")") + 1]
-    return name or None, spec, marker
-
-
-def ensure_out_dir():
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
-
-
-# ----------- 数据读取 ----------- #
-
-def load_top_packages() -> Dict[str, Dict]:
-    """读取下载榜，返回 name -> {downloads, rank, is_top}。"""
-    path = DATA_DIR / "top_packages_by_downloads_10000.json"
-    with path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
-    result = {}
-    for idx, row in enumerate(data, start=1):
-        name = normalize_name(row["project"])
-        result[name] = {
-            "downloads": int(row["download_count"]),
-            "rank": idx,
-            "is_top": True,
-        }
-    return result
-
-
-def first_pass_collect_keep(path: Path, top_set: Set[str]) -> Set[str]:
-    """
-    第一遍扫描超大 jsonl，只关注 top 包，收集它们的依赖包名，返回 keep 集合。
-    仅解析 requires_dist；不存数据。
-    """
-    keep: Set[str] = set(top_set)
-    tqdm = _maybe_tqdm()
-    with path.open("r", encoding="utf-8") as f:
-        iterator = f if tqdm is None else tqdm(f, desc="扫描 top 包依赖", unit="行", mininterval=1.0)
-        for line in iterator:
-            line = line.strip()
-            if not line:
-                continue
-            obj = json.loads(line)
-            pkg = normalize_name(obj.get("package", ""))
-            if pkg not in top_set:
-                continue
-            for req in obj.get("requires_dist") or []:
-                dep, _, _ = parse_requirement(req)
-                if dep:
-                    keep.add(dep)
-    return keep
-
-
-def second_pass_build(
-    path: Path, keep_set: Set[str], top_info: Dict[str, Dict]
-) -> Tuple[Dict[str, Dict], List[Dict], List[Dict]]:
-    """
-    第二遍扫描，生成包/版本/依赖。
-    返回 (packages, versions, requires_edges)。
-    """
-    packages: Dict[str, Dict] = {}
-    versions: List[Dict] = []
-    requires_edges: List[Dict] = []
-
-    tqdm = _maybe_tqdm()
-    with path.open("r", encoding="utf-8") as f:
-        iterator = f if tqdm is None else tqdm(f, desc="生成包/版本/依赖", unit="行", mininterval=1.0)
-        for line in iterator:
-            line = line.strip()
-            if not line:
-                continue
-            obj = json.loads(line)
-            pkg = normalize_name(obj.get("package", ""))
-            if pkg not in keep_set:
-                continue
-
-            packages.setdefault(
-                pkg,
-                {
-                    "name": pkg,
-                    "downloads": top_info.get(pkg, {}).get("downloads"),
-                    "rank": top_info.get(pkg, {}).get("rank"),
-                    "is_top": pkg in top_info,
-                    "noise": pkg not in top_info,
-                },
-            )
-            # 如果多次出现，保留首次标注的 downloads/rank；不覆盖。
-
-            version = str(obj.get("version") or "")
-            name_version = f"{pkg}@{version}"
-            versions.append(
-                {
-                    "name_version": name_version,
-                    "name": pkg,
-                    "version": version,
-                    "requires_python": obj.get("requires_python") or "",
-                    "is_top_pkg": pkg in top_info,
-                }
-            )
-
-            for req in obj.get("requires_dist") or []:
-                dep, spec, marker = parse_requirement(req)
-                if not dep:
-                    continue
-                requires_edges.append(
-                    {
-                        "src": name_version,
-                        "dest": dep,
-                        "spec": spec,
-                        "marker": marker,
-                    }
-                )
-
-    return packages, versions, requires_edges
-
-
-def parse_repo_requirements(
-    keep_packages: Set[str],
-) -> Tuple[List[Dict], List[Dict], List[Dict]]:
-    """
-    解析 GitHub 仓库的 requirements，生成 Repo 节点、Repo->Package 依赖、Topic 关系。
-    仅保留依赖包名在 keep_packages 中的记录，减少噪声。
-    """
-    # 优先使用 1w 分片；不存在则回退旧版单文件
-    repo_paths = [
-        DATA_DIR / "python_repos_requirements_more_info_1w1.jsonl",
-        DATA_DIR / "python_repos_requirements_more_info_1w2.jsonl",
-    ]
-    if not all(p.exists() for p in repo_paths):
-        repo_paths = [DATA_DIR / "python_repos_requirements_more_info.jsonl"]
-
-    repos: List[Dict] = []
-    repo_depends: List[Dict] = []
-    repo_topics: List[Dict] = []
-    seen_full_name: Set[str] = set()
-
-    tqdm = _maybe_tqdm()
-    for repo_path in repo_paths:
-        with repo_path.open("r", encoding="utf-8") as f:
-            desc = f"解析 repo requirements: {repo_path.name}"
-            iterator = f if tqdm is None else tqdm(f, desc=desc, unit="行", mininterval=0.5)
-            for line in iterator:
-                line = line.strip()
-                if not line:
-                    continue
-                obj = json.loads(line)
-                full_name = obj.get("full_name")
-                if not full_name:
-                    continue
-                if full_name in seen_full_name:
-                    continue
-                seen_full_name.add(full_name)
-
-                repos.append(
-                    {
-                        "full_name": full_name,
-                        "stars": obj.get("stargazers_count", 0),
-                        "about": obj.get("about", "") or "",
-                    }
-                )
-
-                topics = obj.get("about_topics") or []
-                for t in topics:
-                    t_norm = t.strip().lower()
-                    if t_norm:
-                        repo_topics.append({"repo": full_name, "topic": t_norm})
-
-                req_text = obj.get("requirements") or ""
-                for raw in req_text.splitlines():
-                    raw = raw.strip()
-                    if not raw or raw.startswith("#"):
-                        continue
-                    pkg, spec, marker = parse_requirement(raw)
-                    if not pkg:
-                        continue
-                    if pkg not in keep_packages:
-                        continue  # 忽略噪声包
-                    repo_depends.append(
-                        {
-                            "repo": full_name,
-                            "pkg": pkg,
-                            "spec": spec,
-                            "marker": marker,
-                        }
-                    )
-
-    return repos, repo_depends, repo_topics
-
-
-# ----------- 写 CSV ----------- #
-
-def write_csv(path: Path, rows: Iterable[Dict]):
-    rows = list(rows)
-    if not rows:
-        return
-    fieldnames = list(rows[0].keys())
-    with path.open("w", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(rows)
-
-
-# ----------- tqdm 兼容 ----------- #
-
-def _maybe_tqdm():
-    """有 tqdm 则返回 tqdm 包装，否则返回 None。"""
-    try:
-        from tqdm.auto import tqdm  # type: ignore
-    except Exception:
-        return None
-    return tqdm
-
-
-# ----------- 主流程 ----------- #
-
-def main():
-    ensure_out_dir()
-
-    print("[1/6] 读取下载榜...")
-    top_info = load_top_packages()
-    top_set = set(top_info.keys())
-
-    google_path = DATA_DIR / "google_sql_with_pyv_pkg.json"
-    print("[2/6] 第一遍扫描，收集 top 包依赖...")
-    keep_set = first_pass_collect_keep(google_path, top_set)
-    print(f"    需保留包数：{len(keep_set)}")
-
-    print("[3/6] 第二遍扫描，生成包/版本/依赖...")
-    packages, versions, requires_edges = second_pass_build(google_path, keep_set, top_info)
-    print(f"    包数：{len(packages)}, 版本数：{len(versions)}, 依赖边：{len(requires_edges)}")
-
-    print("[4/6] 解析 repo requirements...")
-    repos, repo_depends, repo_topics = parse_repo_requirements(set(packages.keys()))
-    print(
-        f"    仓库数：{len(repos)}, 依赖边：{len(repo_depends)}, 主题关系：{len(repo_topics)}"
-    )
-
-    print("[5/6] 写出 CSV...")
-    write_csv(OUT_DIR / "packages.csv", packages.values())
-    write_csv(OUT_DIR / "package_versions.csv", versions)
-    write_csv(OUT_DIR / "package_version_requires.csv", requires_edges)
-    write_csv(OUT_DIR / "repos.csv", repos)
-    write_csv(OUT_DIR / "repo_depends.csv", repo_depends)
-    write_csv(OUT_DIR / "topics.csv", [{"name": t["topic"]} for t in repo_topics])
-    write_csv(OUT_DIR / "repo_topics.csv", repo_topics)
-
-    print("[6/6] 完成。可使用 LOAD CSV / neo4j-admin 导入。")
-
-
-if __name__ == "__main__":
-    main()
+"""
+基于三份数据文件构建 Neo4j 导入所需的 CSV：
+- data/top_packages_by_downloads_10000.json           下载量榜（前 1 万）
+- data/google_sql_with_pyv_pkg.json                   包版本与 requires_dist（>2GB，逐行流式）
+- data/python_repos_requirements_more_info_1w1.jsonl  GitHub 热门仓库 requirements（1w 分片 1）
+- data/python_repos_requirements_more_info_1w2.jsonl  GitHub 热门仓库 requirements（1w 分片 2）
+- (兼容) data/python_repos_requirements_more_info.jsonl  旧版单文件（若 1w 分片不存在则回退）
+以上文件都可以换成 .zst / .gz / .xz 压缩版（原文件不存在时查找加了扩展名的同名文件），边解压边解析。
+
+输出（写入当前目录下 out/）：
+- packages.csv                Package 节点
+- package_versions.csv        PackageVersion 节点（version_ordinal 为包内 PEP 440 稠密序号，packages 的 latest_ordinal 为其最大值；
+                              python_mask 为 requires_python 支持的 Python 小版本位掩码）
+- package_version_requires.csv PackageVersion -> Package 依赖
+- repos.csv                   Repo 节点
+- repo_depends.csv            Repo -> Package 依赖
+- topics.csv                  Topic 节点
+- repo_topics.csv             Repo -> Topic 关系
+装了 pyarrow 时每个 CSV 另有同名 .parquet（列带类型、字典编码），导入脚本优先读取。
+
+默认单遍模式（SINGLE_PASS）：大文件只读一次、每行只 json 解码一次，
+建图字段暂存到 out/work/ 下的 spill 文件，确定 keep 集合后再回放生成 CSV。
+
+大文件的各遍扫描按分片定期写检查点（CHECKPOINT），中断后可用
+  python etl.py --resume
+从上次检查点继续；成功结束后 out/work/ 会被清理。
+
+两遍模式（SINGLE_PASS = False）下，若先运行过 python dump_index.py build，
+第二遍按字节偏移索引只读取 keep 包的行，不再扫描整个 dump。
+
+repo requirements 文件同样按字节区间交给 PARSE_WORKERS 个进程解析，合并时按 full_name 首次出现去重，
+输出与串行一致，并打印各分片的吞吐。
+
+加 --bulk 时另在 out/bulk/ 生成 neo4j-admin database import 文件（见 bulk_export.py），可离线建库。
+
+加 --direct neo4j 时不写七张 CSV，直接导入 import_to_neo4j.py 中配置的库（见 graph_stream.py）：
+包/版本/依赖边在补完版本序号后由后台线程送入导入队列，与 repo requirements 的解析重叠，
+repo 各表边合并边导入，节点先于引用它的关系；--direct memory 用内存替身代替数据库，只统计行数并校验顺序。
+
+每个阶段的墙钟/CPU 时间、读入行数与字节数、产出行数、峰值 RSS 与解析缓存命中率写入 out/etl_metrics.json；
+--profile 1,repo（或 all）让选中的阶段在 cProfile 下运行，统计存到 out/profile/。
+
+main 是 pipeline.py 流水线引擎的一个预设（读取下载榜、repo requirements 与输出阶段与 flash/etl_flash.py 共用），
+结束时打印各阶段的耗时与行数。
+
+导入前请先在 Neo4j 建约束：
+  CREATE CONSTRAINT pkg IF NOT EXISTS FOR (p:Package) REQUIRE p.name IS UNIQUE;
+  CREATE CONSTRAINT pv IF NOT EXISTS FOR (v:PackageVersion) REQUIRE v.name_version IS UNIQUE;
+  CREATE CONSTRAINT repo IF NOT EXISTS FOR (r:Repo) REQUIRE r.full_name IS UNIQUE;
+  CREATE CONSTRAINT topic IF NOT EXISTS FOR (t:Topic) REQUIRE t.name IS UNIQUE;
+"""
+
+import argparse
+import csv
+import marshal
+import os
+import shutil
+import sys
+from bisect import bisect_left
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from etl_common import (
+    CHECKPOINT_BYTES,
+    Checkpoint,
+    CsvStreamWriter,
+    add_dependencies,
+    dependency_closure,
+    format_parse_cache_stats,
+    iter_range_lines,
+    iter_wanted_rows,
+    json_decoder,
+    merge_adjacency,
+    normalize_name,
+    parse_requirement,
+    plan_ranges,
+    prefilter_name,
+    progress,
+    resolve_input,
+    run_shards,
+    verify_prefilter,
+)
+from dump_index import iter_span_lines, open_index
+from env_markers import marker_mask, python_mask
+from graph_stream import GraphImporter, make_sink
+from pipeline import PACKAGE_FIELDS, Pipeline, Stage, emit_stage, feed_tables, load_top_stage, repo_stage
+from spec_intervals import encode_spec, version_key, version_ordinals
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_DIR = PROJECT_ROOT / "data"
+OUT_DIR = Path(__file__).resolve().parent / "out"
+
+SINGLE_PASS = True  # 单遍模式：大文件只读一次，候选记录落盘到 spill，确定 keep 后再从 spill 生成 CSV
+SPILL_CHUNK = 20000  # spill 每批写入的记录数
+PARSE_WORKERS = os.cpu_count() or 1  # 大文件与 repo requirements 的解析进程数；1 为串行
+CHECKPOINT = True  # 大文件扫描时按分片写检查点，支持 --resume 续跑
+CLOSURE_DEPTH: Optional[int] = None  # keep 集合的依赖跳数：None 为完整传递闭包，1 为只含 top 包的直接依赖
+USE_INDEX = True  # 两遍模式下 dump 旁有最新的字节偏移索引（dump_index.py build）时，第二遍只读 keep 包的行
+
+# 各输出 CSV 的固定表头（packages 与 repo 相关表的表头见 pipeline.py）
+VERSION_FIELDS = [
+    "name_version", "name", "version", "requires_python", "is_top_pkg", "version_key", "version_ordinal", "python_mask",
+]
+REQUIRES_FIELDS = ["src", "dest", "spec", "marker", "spec_intervals", "env_mask"]
+
+decode_pypi_row = json_decoder("pypi")
+
+# ----------- 基础工具 ----------- #
+
+def ensure_out_dir():
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+
+
+# ----------- 数据读取 ----------- #
+
+def first_pass_collect_keep(
+    path: Path,
+    top_set: Set[str],
+    ranges: Optional[List[Tuple[int, int]]] = None,
+    workers: int = PARSE_WORKERS,
+    work_dir: Optional[Path] = None,
+) -> Set[str]:
+    """
+    第一遍扫描超大 jsonl，累积 包 -> 依赖并集 的邻接表，再在内存里从 top 包出发求 CLOSURE_DEPTH 跳的
+    依赖闭包，返回 keep 集合。CLOSURE_DEPTH 为 1 时只需 top 包的行（可走预过滤）；否则每行都要解码。
+    仅解析 requires_dist；不存数据。多个分片时多进程扫描；work_dir 非空且 CHECKPOINT 打开时写检查点。
+    """
+    ranges = ranges if ranges is not None else plan_ranges(path, workers)
+    args = [
+        (path, start, end, _adjacency_scope(top_set), _ckpt_path(work_dir, "first", i))
+        for i, (start, end) in enumerate(ranges)
+    ]
+    adjacency: Dict[str, Set[str]] = {}
+    for shard_adjacency in run_shards(_first_pass_shard, args, workers, "扫描依赖"):
+        merge_adjacency(adjacency, shard_adjacency)
+    return dependency_closure(adjacency, top_set, CLOSURE_DEPTH)
+
+
+def _adjacency_scope(top_set: Set[str]) -> Optional[Set[str]]:
+    """需要记录依赖的包：只求一跳时只看 top 包，否则所有包（None）。"""
+    return top_set if CLOSURE_DEPTH == 1 else None
+
+
+def _collect_dependencies(lines: Iterable[str], scope: Optional[Set[str]], adjacency: Dict[str, Set[str]]):
+    for pkg, obj in iter_wanted_rows(lines, scope, decode_pypi_row):
+        add_dependencies(adjacency, pkg, obj.get("requires_dist") or [])
+
+
+def _first_pass_shard(
+    path: Path,
+    start: int,
+    end: int,
+    scope: Optional[Set[str]],
+    ckpt_path: Optional[Path],
+    desc: Optional[str] = None,
+) -> Dict[str, Set[str]]:
+    ckpt = Checkpoint(ckpt_path)
+    state = ckpt.load() or {"pos": start, "adjacency": {}, "done": False}
+    adjacency = {pkg: set(deps) for pkg, deps in state["adjacency"].items()}
+    if state["done"]:
+        return adjacency
+
+    def save(pos: int, done: bool = False):
+        ckpt.save({"pos": pos, "adjacency": {pkg: list(deps) for pkg, deps in adjacency.items()}, "done": done})
+
+    lines = iter_range_lines(path, state["pos"], end, save if ckpt.enabled else None)
+    _collect_dependencies(progress(lines, desc), scope, adjacency)
+    save(end, done=True)
+    return adjacency
+
+
+def second_pass_build(
+    path: Path,
+    keep_set: Set[str],
+    top_info: Dict[str, Dict],
+    ranges: Optional[List[Tuple[int, int]]] = None,
+    workers: int = PARSE_WORKERS,
+    work_dir: Optional[Path] = None,
+    table_dir: Optional[Path] = None,
+) -> Tuple[Dict[str, Dict], int, int]:
+    """
+    第二遍扫描，生成包/版本/依赖：版本与依赖边边解析边写入 table_dir（默认 OUT_DIR）下的 package_versions.csv /
+    package_version_requires.csv，返回 (packages, 版本行数, 依赖行数)，packages 规模仅与 keep 集合相关。
+    多个分片时各分片写 part 文件后按分片顺序拼接，结果与串行逐行一致。
+    USE_INDEX 且有最新索引时按文件偏移顺序只读 keep 包的行，输出不变。
+    """
+    ranges = ranges if ranges is not None else plan_ranges(path, workers)
+    index = open_index(path) if USE_INDEX else None
+    if index is None:
+        sources = [(path, start, end, None) for start, end in ranges]
+    else:
+        with index:
+            offsets, lengths = index.select(keep_set)
+        print(f"    按索引读取 keep 包的 {len(offsets)} 行")
+        sources = []
+        for start, end in ranges:
+            lo, hi = bisect_left(offsets, start), bisect_left(offsets, end)
+            sources.append((path, start, end, (offsets[lo:hi], lengths[lo:hi])))
+    return _build_outputs(
+        _second_pass_shard, sources, keep_set, top_info, workers, work_dir, table_dir, "second", "生成包/版本/依赖"
+    )
+
+
+def _iter_kept_records(lines: Iterable[str], keep_set: Set[str]) -> Iterator[Tuple[str, str, str, List[str]]]:
+    for pkg, obj in iter_wanted_rows(lines, keep_set, decode_pypi_row):
+        yield _dump_record(pkg, obj)
+
+
+def _second_pass_shard(
+    path: Path,
+    start: int,
+    end: int,
+    spans: Optional[Tuple],
+    keep_set: Set[str],
+    top_info: Dict[str, Dict],
+    target: Tuple,
+    desc=None,
+) -> Tuple[Dict[str, Dict], int, int]:
+    def open_records(pos: Optional[int], on_boundary):
+        pos = start if pos is None else pos
+        if spans is None:
+            lines = iter_range_lines(path, pos, end, on_boundary)
+        else:
+            lines = iter_span_lines(path, *spans, pos, on_boundary)
+        return _iter_kept_records(progress(lines, desc), keep_set)
+
+    return _build_part(open_records, keep_set, top_info, *target)
+
+
+def _build_part(
+    open_records: Callable,
+    keep_set: Set[str],
+    top_info: Dict[str, Dict],
+    versions_path: Path,
+    edges_path: Path,
+    header: bool,
+    ckpt_path: Optional[Path],
+) -> Tuple[Dict[str, Dict], int, int]:
+    """
+    构建一个分片：open_records(起始位置, 检查点回调) 返回记录迭代器，版本/依赖写入给定路径。
+    检查点记录 (输入位置, packages, 两个 CSV 的字节数与行数)；续跑时截断 CSV 到记录的位置再继续。
+    返回 (packages, 版本行数, 依赖行数)。
+    """
+    ckpt = Checkpoint(ckpt_path)
+    state = ckpt.load()
+    if state and state["done"]:
+        return state["packages"], state["versions"][1], state["edges"][1]
+    packages: Dict[str, Dict] = state["packages"] if state else {}
+
+    with CsvStreamWriter(versions_path, VERSION_FIELDS, header, resume=state and state["versions"]) as versions_out, \
+            CsvStreamWriter(edges_path, REQUIRES_FIELDS, header, resume=state and state["edges"]) as edges_out:
+
+        def save(pos: Optional[int], done: bool = False):
+            ckpt.save(
+                {
+                    "pos": pos,
+                    "packages": packages,
+                    "versions": versions_out.position(),
+                    "edges": edges_out.position(),
+                    "done": done,
+                }
+            )
+
+        records = open_records(state["pos"] if state else None, save if ckpt.enabled else None)
+        build_from_records(records, keep_set, top_info, versions_out, edges_out, packages)
+        if ckpt.enabled:
+            save(None, done=True)
+    return packages, versions_out.count, edges_out.count
+
+
+def _build_outputs(
+    shard_fn: Callable,
+    sources: List[Tuple],
+    keep_set: Set[str],
+    top_info: Dict[str, Dict],
+    workers: int,
+    work_dir: Optional[Path],
+    table_dir: Optional[Path],
+    phase: str,
+    desc: str,
+) -> Tuple[Dict[str, Dict], int, int]:
+    """
+    执行构建分片，返回 (packages, 版本行数, 依赖行数)。只有一个分片时直接写 table_dir（默认 OUT_DIR）下的最终 CSV；
+    多个分片时各写无表头 part 文件，再按分片顺序合并 packages（以首次出现为准）并拼接。
+    """
+    table_dir = table_dir or OUT_DIR
+    versions_path = table_dir / "package_versions.csv"
+    edges_path = table_dir / "package_version_requires.csv"
+    if len(sources) <= 1:
+        targets = [(versions_path, edges_path, True, _ckpt_path(work_dir, phase, 0))]
+    else:
+        part_dir = work_dir / "parts"
+        part_dir.mkdir(parents=True, exist_ok=True)
+        targets = [
+            (part_dir / f"{phase}-{i:05d}.versions.csv", part_dir / f"{phase}-{i:05d}.requires.csv", False,
+             _ckpt_path(work_dir, phase, i))
+            for i in range(len(sources))
+        ]
+    args = [(*src, keep_set, top_info, target) for src, target in zip(sources, targets)]
+    results = run_shards(shard_fn, args, workers, desc)
+    if len(sources) <= 1:
+        return results[0] if results else ({}, 0, 0)
+
+    packages: Dict[str, Dict] = {}
+    with CsvStreamWriter(versions_path, VERSION_FIELDS) as versions_out, \
+            CsvStreamWriter(edges_path, REQUIRES_FIELDS) as edges_out:
+        for target, (shard_packages, n_versions, n_edges) in zip(targets, results):
+            for name, row in shard_packages.items():
+                packages.setdefault(name, row)
+            versions_out.append_part(target[0], n_versions)
+            edges_out.append_part(target[1], n_edges)
+    return packages, versions_out.count, edges_out.count
+
+
+def _dump_record(pkg: str, obj: Dict) -> Tuple[str, str, str, List[str]]:
+    """从 dump 行中取出建图所需字段：(包名, 版本, requires_python, requires_dist)。"""
+    return (
+        pkg,
+        str(obj.get("version") or ""),
+        obj.get("requires_python") or "",
+        obj.get("requires_dist") or [],
+    )
+
+
+def build_from_records(
+    records: Iterable[Tuple[str, str, str, List[str]]],
+    keep_set: Set[str],
+    top_info: Dict[str, Dict],
+    versions_out: CsvStreamWriter,
+    edges_out: CsvStreamWriter,
+    packages: Optional[Dict[str, Dict]] = None,
+) -> Dict[str, Dict]:
+    """
+    由 (包名, 版本, requires_python, requires_dist) 记录生成包/版本/依赖。
+    版本与依赖边直接写入 versions_out / edges_out，包信息累积到 packages 并返回。
+    """
+    packages = {} if packages is None else packages
+
+    for pkg, version, requires_python, requires_dist in records:
+        if pkg not in keep_set:
+            continue
+
+        packages.setdefault(
+            pkg,
+            {
+                "name": pkg,
+                "downloads": top_info.get(pkg, {}).get("downloads"),
+                "rank": top_info.get(pkg, {}).get("rank"),
+                "is_top": pkg in top_info,
+                "noise": pkg not in top_info,
+            },
+        )
+        # 如果多次出现，保留首次标注的 downloads/rank；不覆盖。
+
+        name_version = f"{pkg}@{version}"
+        versions_out.write(
+            {
+                "name_version": name_version,
+                "name": pkg,
+                "version": version,
+                "requires_python": requires_python,
+                "is_top_pkg": pkg in top_info,
+                "version_key": version_key(version),
+                "python_mask": python_mask(requires_python),
+            }
+        )
+
+        for req in requires_dist:
+            dep, spec, marker = parse_requirement(req)
+            if not dep:
+                continue
+            edges_out.write(
+                {
+                    "src": name_version,
+                    "dest": dep,
+                    "spec": spec,
+                    "marker": marker,
+                    "spec_intervals": encode_spec(spec),
+                    "env_mask": marker_mask(marker),
+                }
+            )
+
+    return packages
+
+
+# ----------- 单遍模式（spill） ----------- #
+
+def single_pass_collect_and_spill(
+    path: Path,
+    top_set: Set[str],
+    work_dir: Path,
+    ranges: Optional[List[Tuple[int, int]]] = None,
+    workers: int = PARSE_WORKERS,
+) -> Tuple[Set[str], List[Path]]:
+    """
+    单遍扫描超大 jsonl：累积依赖邻接表并求闭包得到 keep 集合（同 first_pass_collect_keep），同时把每行的
+    建图字段以 marshal 分批写入 work_dir/spill，后续由 build_from_spill 回放，无需再读原文件。
+    只求一跳且开启预过滤时，非 top 包的行不解码，以 (包名, 原始行) 落盘，回放时仅对 keep 中的包解码。
+    返回 (keep 集合, 按文件顺序排列的 spill 文件列表)；每个分片一个 spill 文件。
+    """
+    ranges = ranges if ranges is not None else plan_ranges(path, workers)
+    spill_dir = work_dir / "spill"
+    spill_dir.mkdir(parents=True, exist_ok=True)
+    spill_paths = [spill_dir / f"records-{i:05d}.spill" for i in range(len(ranges))]
+    args = [
+        (path, start, end, _adjacency_scope(top_set), sp, _ckpt_path(work_dir, "spill", i))
+        for i, ((start, end), sp) in enumerate(zip(ranges, spill_paths))
+    ]
+    adjacency: Dict[str, Set[str]] = {}
+    for shard_adjacency in run_shards(_spill_shard, args, workers, "单遍扫描并落盘"):
+        merge_adjacency(adjacency, shard_adjacency)
+    return dependency_closure(adjacency, top_set, CLOSURE_DEPTH), spill_paths
+
+
+class _SpillWriter:
+    """spill 文件写入：记录攒满 SPILL_CHUNK 条后以一个 marshal 块落盘。"""
+
+    def __init__(self, spill_path: Path, resume_size: int = 0):
+        if resume_size:
+            with spill_path.open("r+b") as f:
+                f.truncate(resume_size)
+            self._f = spill_path.open("ab")
+        else:
+            self._f = spill_path.open("wb")
+        self._buf: List[Tuple] = []
+
+    def add(self, entry: Tuple):
+        self._buf.append(entry)
+        if len(self._buf) >= SPILL_CHUNK:
+            self.flush()
+
+    def flush(self) -> int:
+        """写出缓冲中的记录，返回文件当前字节数。"""
+        if self._buf:
+            marshal.dump(self._buf, self._f)
+            self._buf = []
+        self._f.flush()
+        return self._f.tell()
+
+    def close(self):
+        self.flush()
+        self._f.close()
+
+
+def _spill_lines(
+    lines: Iterable[str], scope: Optional[Set[str]], adjacency: Dict[str, Set[str]], spill: _SpillWriter
+):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        pkg = prefilter_name(line) if scope is not None else None
+        if pkg is not None and pkg not in scope:
+            verify_prefilter(line, pkg, decode=decode_pypi_row)
+            spill.add((pkg, line))
+            continue
+        obj = decode_pypi_row(line)
+        if pkg is not None:
+            verify_prefilter(line, pkg, obj)
+        pkg = normalize_name(obj.get("package", ""))
+        record = _dump_record(pkg, obj)
+        if scope is None or pkg in scope:
+            add_dependencies(adjacency, pkg, record[3])
+        spill.add(record)
+
+
+def _spill_shard(
+    path: Path,
+    start: int,
+    end: int,
+    scope: Optional[Set[str]],
+    spill_path: Path,
+    ckpt_path: Optional[Path],
+    desc: Optional[str] = None,
+) -> Dict[str, Set[str]]:
+    ckpt = Checkpoint(ckpt_path)
+    state = ckpt.load() or {"pos": start, "adjacency": {}, "spill_size": 0, "done": False}
+    adjacency = {pkg: set(deps) for pkg, deps in state["adjacency"].items()}
+    if state["done"]:
+        return adjacency
+
+    spill = _SpillWriter(spill_path, state["spill_size"])
+
+    def save(pos: int, done: bool = False):
+        ckpt.save(
+            {
+                "pos": pos,
+                "adjacency": {pkg: list(deps) for pkg, deps in adjacency.items()},
+                "spill_size": spill.flush(),
+                "done": done,
+            }
+        )
+
+    try:
+        lines = iter_range_lines(path, state["pos"], end, save if ckpt.enabled else None)
+        _spill_lines(progress(lines, desc), scope, adjacency, spill)
+        save(end, done=True)
+    finally:
+        spill.close()
+    return adjacency
+
+
+def iter_spill(
+    spill_path: Path,
+    keep_set: Set[str],
+    start: Optional[int] = None,
+    on_boundary: Optional[Callable[[int], None]] = None,
+) -> Iterator[Tuple[str, str, str, List[str]]]:
+    """
+    按写入顺序回放 spill 中包名在 keep_set 的记录；未解码的 (包名, 原始行) 此时才解码。
+    start 为起始字节（marshal 块边界）；on_boundary(pos) 每隔 CHECKPOINT_BYTES 在块边界调用。
+    """
+    with spill_path.open("rb") as spill:
+        last = start or 0
+        spill.seek(last)
+        while True:
+            pos = spill.tell()
+            if on_boundary is not None and pos - last >= CHECKPOINT_BYTES:
+                on_boundary(pos)
+                last = pos
+            try:
+                chunk = marshal.load(spill)
+            except EOFError:
+                return
+            for entry in chunk:
+                if entry[0] not in keep_set:
+                    continue
+                if len(entry) == 2:
+                    entry = _dump_record(entry[0], decode_pypi_row(entry[1]))
+                yield entry
+
+
+def build_from_spill(
+    spill_paths: List[Path],
+    keep_set: Set[str],
+    top_info: Dict[str, Dict],
+    work_dir: Path,
+    workers: int = PARSE_WORKERS,
+    table_dir: Optional[Path] = None,
+) -> Tuple[Dict[str, Dict], int, int]:
+    """从 spill 生成包/版本/依赖，结果与 second_pass_build 逐行一致。"""
+    sources = [(sp,) for sp in spill_paths]
+    return _build_outputs(
+        _build_spill_shard, sources, keep_set, top_info, workers, work_dir, table_dir, "replay", "回放 spill"
+    )
+
+
+def _build_spill_shard(
+    spill_path: Path, keep_set: Set[str], top_info: Dict[str, Dict], target: Tuple, desc=None
+) -> Tuple[Dict[str, Dict], int, int]:
+    def open_records(pos: Optional[int], on_boundary):
+        return iter_spill(spill_path, keep_set, pos, on_boundary)
+
+    return _build_part(open_records, keep_set, top_info, *target)
+
+
+# ----------- 分片调度与检查点 ----------- #
+
+def _ckpt_path(work_dir: Optional[Path], phase: str, index: int) -> Optional[Path]:
+    if work_dir is None or not CHECKPOINT:
+        return None
+    return work_dir / f"{phase}-{index:05d}.ckpt"
+
+
+def prepare_work_dir(work_dir: Path, path: Path, resume: bool, workers: int = PARSE_WORKERS) -> List[Tuple[int, int]]:
+    """
+    准备中间目录（spill、part 文件与检查点），返回本次运行的分片区间。
+    resume 时复用上次记录的分片与中间文件（输入文件或运行模式变了则拒绝续跑）；否则清空重来。
+    """
+    manifest_path = work_dir / "manifest.marshal"
+    stat = path.stat()
+    source = (str(path), stat.st_size, stat.st_mtime_ns, SINGLE_PASS, CLOSURE_DEPTH)
+    if resume and manifest_path.exists():
+        with manifest_path.open("rb") as f:
+            manifest = marshal.load(f)
+        if tuple(manifest["source"]) != source:
+            raise SystemExit(f"检查点与当前输入/模式不一致，无法续跑：{manifest['source']} != {source}")
+        print(f"    从检查点续跑：{work_dir}")
+        return [tuple(r) for r in manifest["ranges"]]
+    if resume:
+        print("    未找到检查点，从头开始。")
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    work_dir.mkdir(parents=True)
+    ranges = plan_ranges(path, workers)
+    with manifest_path.open("wb") as f:
+        marshal.dump({"source": source, "ranges": ranges}, f)
+    return ranges
+
+
+# ----------- 写 CSV ----------- #
+
+def collect_version_ordinals(versions_path: Path, packages: Dict[str, Dict]) -> Dict[str, Dict[str, int]]:
+    """
+    读一遍版本 CSV，返回 包 -> {版本: 包内 PEP 440 稠密序号}，并把各包的最大序号记到 packages 的 latest_ordinal。
+    序号要看到包的全部版本才能确定，所以在版本 CSV 写完后再读。
+    """
+    by_package: Dict[str, Set[str]] = {}
+    with versions_path.open("r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            by_package.setdefault(row["name"], set()).add(row["version"])
+    ordinals = {pkg: version_ordinals(versions) for pkg, versions in by_package.items()}
+    for pkg, row in packages.items():
+        row["latest_ordinal"] = max(ordinals[pkg].values()) if pkg in ordinals else None
+    return ordinals
+
+
+def iter_version_rows(versions_path: Path, ordinals: Dict[str, Dict[str, int]]) -> Iterator[Dict]:
+    """逐行读取版本 CSV 并补上 version_ordinal 列。"""
+    with versions_path.open("r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            row["version_ordinal"] = ordinals[row["name"]][row["version"]]
+            yield row
+
+
+def iter_csv_rows(path: Path) -> Iterator[Dict]:
+    with path.open("r", encoding="utf-8", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def assign_version_ordinals(versions_path: Path, packages: Dict[str, Dict]):
+    """补写 package_versions.csv 的 version_ordinal 列（写到临时文件后替换），并记下各包的 latest_ordinal。"""
+    ordinals = collect_version_ordinals(versions_path, packages)
+    tmp = versions_path.with_name(versions_path.name + ".tmp")
+    with CsvStreamWriter(tmp, VERSION_FIELDS) as out:
+        for row in iter_version_rows(versions_path, ordinals):
+            out.write(row)
+    os.replace(tmp, versions_path)
+
+
+# ----------- 主流程 ----------- #
+
+def _scan_stage(ctx: Dict) -> Dict[str, int]:
+    """扫描大文件求 keep 集合；单遍模式同时把候选记录落盘到 spill。"""
+    ranges = prepare_work_dir(ctx["work_dir"], ctx["dump_path"], ctx["resume"], ctx["workers"])
+    if SINGLE_PASS:
+        ctx["keep_set"], ctx["spill_paths"] = single_pass_collect_and_spill(
+            ctx["dump_path"], ctx["top_set"], ctx["work_dir"], ranges, ctx["workers"]
+        )
+    else:
+        ctx["keep_set"] = first_pass_collect_keep(
+            ctx["dump_path"], ctx["top_set"], ranges, ctx["workers"], ctx["work_dir"]
+        )
+    ctx["ranges"] = ranges
+    return {"keep": len(ctx["keep_set"])}
+
+
+def _build_stage(ctx: Dict) -> Dict[str, int]:
+    """
+    生成包/版本/依赖（保留全部版本），再补写版本序号。
+    直连模式下版本与依赖边写在 work_dir（序号要等全部版本写完），补序号时逐行读出交给后台导入，不再改写文件。
+    """
+    direct = ctx.get("graph") is not None
+    table_dir = ctx["work_dir"] if direct else ctx["out_dir"]
+    if SINGLE_PASS:
+        packages, n_versions, n_edges = build_from_spill(
+            ctx["spill_paths"], ctx["keep_set"], ctx["top_info"], ctx["work_dir"], ctx["workers"], table_dir
+        )
+    else:
+        packages, n_versions, n_edges = second_pass_build(
+            ctx["dump_path"], ctx["keep_set"], ctx["top_info"], ctx["ranges"], ctx["workers"], ctx["work_dir"],
+            table_dir,
+        )
+    versions_path = table_dir / "package_versions.csv"
+    tables = {"packages": (PACKAGE_FIELDS, packages.values())}
+    if direct:
+        ordinals = collect_version_ordinals(versions_path, packages)
+        tables["package_versions"] = (VERSION_FIELDS, iter_version_rows(versions_path, ordinals))
+        tables["package_version_requires"] = (
+            REQUIRES_FIELDS, iter_csv_rows(table_dir / "package_version_requires.csv")
+        )
+    else:
+        assign_version_ordinals(versions_path, packages)
+    ctx["packages"] = packages
+    feed_tables(ctx, tables)
+    return {"packages": len(packages), "package_versions": n_versions, "package_version_requires": n_edges}
+
+
+def build_pipeline(direct: bool = False) -> Pipeline:
+    """etl.py 预设：完整下载榜 → 依赖闭包 → 全部版本 → CSV / Parquet / bulk；direct 时最后一步为等待直连导入完成。"""
+    if SINGLE_PASS:
+        scan, build = "单遍扫描，收集依赖闭包并落盘候选记录", "从 spill 生成包/版本/依赖"
+    else:
+        scan, build = "第一遍扫描，收集依赖闭包", "第二遍扫描，生成包/版本/依赖"
+    return Pipeline(
+        [
+            Stage("读取下载榜", load_top_stage),
+            Stage(scan, _scan_stage),
+            Stage(build, _build_stage),
+            Stage("解析 repo requirements", repo_stage),
+            Stage("等待导入 Neo4j 完成" if direct else "写出 packages.csv", emit_stage),
+        ]
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> List[Dict]:
+    """运行 etl.py 预设，返回各阶段的耗时与行数。"""
+    parser = argparse.ArgumentParser(description="构建 Neo4j 导入所需的 CSV")
+    parser.add_argument("--resume", action="store_true", help="从 out/work/ 中的检查点继续上次中断的运行")
+    parser.add_argument("--bulk", action="store_true", help="另外生成 neo4j-admin database import 文件到 out/bulk/")
+    parser.add_argument(
+        "--profile", metavar="STAGES", help="在 cProfile 下运行选中的阶段：all，或逗号分隔的阶段序号/阶段名片段"
+    )
+    parser.add_argument(
+        "--direct",
+        choices=["neo4j", "memory"],
+        help="直连模式：不写 CSV，边解析边导入；neo4j 为 import_to_neo4j.py 中配置的库，memory 为内存替身（校验导入顺序）",
+    )
+    args = parser.parse_args(argv)
+    if args.direct and args.bulk:
+        parser.error("--bulk 需要 CSV 输出，不能与 --direct 同时使用")
+    ensure_out_dir()
+    ctx = {
+        "data_dir": DATA_DIR,
+        "out_dir": OUT_DIR,
+        "work_dir": OUT_DIR / "work",  # spill、part 文件与检查点
+        "workers": PARSE_WORKERS,
+        "bulk": args.bulk,
+        "metrics_path": OUT_DIR / "etl_metrics.json",
+        "profile": args.profile,
+        "resume": args.resume,
+        "dump_path": resolve_input(DATA_DIR / "google_sql_with_pyv_pkg.json"),
+        "graph": GraphImporter(make_sink(args.direct, "import_to_neo4j")) if args.direct else None,
+    }
+    reports = build_pipeline(direct=bool(args.direct)).run(ctx)
+    print(f"    {format_parse_cache_stats()}")
+    shutil.rmtree(ctx["work_dir"], ignore_errors=True)
+    print("完成。" if args.direct else "完成。可使用 LOAD CSV / neo4j-admin 导入。")
+    return reports
+
+
+if __name__ == "__main__":
+    main()
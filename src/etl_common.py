@@ -0,0 +1,940 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+etl.py 与 flash/etl_flash.py 共用的 ETL 工具。
+
+- 包名规范化与带缓存的 requirement 解析（同一字符串只解析一次）；
+- 可插拔的 JSON 解码：装了 msgspec 则按字段 schema 只解码用到的字段，其次 orjson，否则标准库 json；
+- 行级预过滤：先从原始行里截取 "package" 值，包名不在目标集合的行不做 JSON 解码；
+- 依赖闭包：扫描时累积 包 -> 各版本依赖并集 的邻接表，在内存里按跳数求 keep 集合；
+- 压缩输入（.gz / .zst / .xz，按魔数或扩展名识别）：后台线程解压并经有界队列交给解析，多帧 zstd 各帧并行解压；
+- 按换行对齐的字节区间切分超大 jsonl，便于多进程分片解析（多帧 zstd 在帧边界附近切分）；
+- 有序的进程池 map：结果按提交顺序返回，合并后与串行结果逐行一致；串行时在本进程执行并显示逐行进度；
+- 运行计数：读入的输入行数/字节数与解析缓存命中数（含子进程），以及峰值 RSS，供流水线按阶段统计；
+- 固定表头、带缓冲的增量 CSV 写出，行边产生边落盘，内存不随行数增长；
+- 分片检查点：按输入字节偏移定期落盘中间状态，中断后可从最近一致的位置续跑；
+- 列式输出：装了 pyarrow 时把各 CSV 另存为带类型、字典编码的 Parquet，导入脚本优先读取。
+"""
+
+import csv
+import functools
+import gzip
+import json
+import lzma
+import marshal
+import os
+import queue
+import re
+import shutil
+import sys
+import threading
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, TypedDict
+
+try:
+    from packaging.requirements import Requirement  # type: ignore
+except Exception:
+    Requirement = None  # type: ignore
+
+try:
+    import msgspec  # type: ignore
+except Exception:
+    msgspec = None  # type: ignore
+
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None  # type: ignore
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.csv as pacsv  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+except Exception:
+    pa = pacsv = pq = None  # type: ignore
+
+try:
+    import zstandard  # type: ignore
+except Exception:
+    zstandard = None  # type: ignore
+
+try:
+    import resource  # type: ignore
+except ImportError:  # Windows
+    resource = None  # type: ignore
+
+CSV_BUFFER = 1 << 20  # CSV 写出缓冲（字节）
+CHECKPOINT_BYTES = 64 << 20  # 每读过这么多输入字节存一次检查点
+SHARDS_PER_WORKER = 4  # 每个进程分到的分片数，分片更细则负载更均衡
+PARSE_CACHE_SIZE = 1 << 18  # requirement 解析缓存上限（条）
+JSON_BACKEND = "auto"  # auto | msgspec | orjson | json；auto 按此顺序选第一个已安装的
+PREFILTER = True  # 解码前先按原始行中的 "package" 值过滤
+PREFILTER_CHECK = False  # 自检：被预过滤跳过的行也完整解码，核对结论与完整解码一致
+COLUMNAR_OUTPUT = True  # 另存一份 .parquet（需 pyarrow，未安装时跳过）
+PARQUET_COMPRESSION = "zstd"
+DECOMPRESS_CHUNK = 1 << 20  # 流式解压每次读取的解压后字节数
+DECOMPRESS_QUEUE = 16  # 解压线程最多领先解析这么多块（有界队列长度）
+ZSTD_THREADS = 4  # 多帧 zstd 并行解压的线程数（zstandard 解压时释放 GIL）
+ZSTD_FRAME_LIMIT = 256 << 20  # 单帧解压后超过这个大小时不按帧并行，改为流式解压
+UNKNOWN_END = sys.maxsize  # 解压后大小未知的输入（gz / xz 等）作为一个分片时的区间终点
+
+# ----------- 包名与 requirement ----------- #
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_name(name: str) -> str:
+    """统一包名：小写、下划线转连字符、去空白。"""
+    return _SPACE_RE.sub("-", name.strip().lower().replace("_", "-"))
+
+
+def parse_requirement(req: str) -> Tuple[Optional[str], str, str]:
+    """
+    解析 requires_dist / requirement 行，返回 (包名, 版本约束, marker)。
+    以原始字符串为键做有界 LRU 缓存，结果字符串经 intern 去重；
+    若系统已装 packaging.requirements 则优先使用，否则简易解析。
+    """
+    return _parse_requirement_cached(req)
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_requirement_cached(req: str) -> Tuple[Optional[str], str, str]:
+    req = req.strip()
+    if not req:
+        return None, "", ""
+
+    if Requirement:
+        try:
+            r = Requirement(req)
+            name = normalize_name(r.name)
+            spec = str(r.specifier) if r.specifier else ""
+            marker = str(r.marker) if r.marker else ""
+            return sys.intern(name), sys.intern(spec), sys.intern(marker)
+        except Exception:
+            pass  # 回退到简单解析
+
+    # 简易回退：截断 ';' marker 与括号约束
+    marker = ""
+    if ";" in req:
+        req, marker = req.split(";", 1)
+        marker = marker.strip()
+    req = req.strip()
+    name = normalize_name(req.split()[0].split("[", 1)[0].split("(", 1)[0])
+    spec = ""
+    if "(" in req and ")" in req:
+        spec = req[req.find("(") : req.find(")") + 1]
+    return (sys.intern(name) if name else None), sys.intern(spec), sys.intern(marker)
+
+
+# 子进程中的命中/未命中由 map_ordered 汇总到这里
+_worker_hits = 0
+_worker_misses = 0
+
+# 读入的输入行数与（解压后）字节数，含 map_ordered 汇总回来的子进程计数
+_input_lines = 0
+_input_bytes = 0
+
+
+def parse_cache_stats() -> Dict[str, float]:
+    """返回 requirement 解析缓存统计（含子进程）：hits / misses / hit_rate / size。"""
+    info = _parse_requirement_cached.cache_info()
+    hits = info.hits + _worker_hits
+    misses = info.misses + _worker_misses
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0.0,
+        "size": info.currsize,
+    }
+
+
+def record_input(lines: int, nbytes: int):
+    """累加读入的输入行数与字节数（逐行读取的迭代器在结束或被关闭时调用一次）。"""
+    global _input_lines, _input_bytes
+    _input_lines += lines
+    _input_bytes += nbytes
+
+
+def input_stats() -> Dict[str, int]:
+    """返回累计读入的输入 lines / bytes（含子进程）。"""
+    return {"lines": _input_lines, "bytes": _input_bytes}
+
+
+def peak_rss_mb(children: bool = False) -> Optional[float]:
+    """
+    本进程的峰值 RSS（MB）；children=True 时为已结束（已回收）的子进程中最大的峰值。
+    没有 resource 模块（Windows）时返回 None。
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024  # macOS 为字节，Linux 为 KB
+
+
+def format_parse_cache_stats() -> str:
+    stats = parse_cache_stats()
+    return (
+        f"requirement 解析缓存：命中 {stats['hits']}，未命中 {stats['misses']}，"
+        f"命中率 {stats['hit_rate']:.1%}"
+    )
+
+
+# ----------- JSON 解码 ----------- #
+
+# 只声明 ETL 用到的字段；msgspec 解码时会跳过其余字段
+class PypiRow(TypedDict, total=False):
+    package: str
+    version: Any
+    requires_dist: Optional[List[str]]
+    requires_python: Optional[str]
+    upload_time: Any
+
+
+class RepoRow(TypedDict, total=False):
+    full_name: Optional[str]
+    stargazers_count: Any
+    about: Optional[str]
+    about_topics: Optional[List[str]]
+    requirements: Optional[str]
+
+
+class TopPackageRow(TypedDict):
+    project: str
+    download_count: Any
+
+
+JSON_SCHEMAS = {
+    "pypi": PypiRow,
+    "repo": RepoRow,
+    "top_packages": List[TopPackageRow],
+}
+
+
+def available_json_backends() -> List[str]:
+    backends = []
+    if msgspec is not None:
+        backends.append("msgspec")
+    if orjson is not None:
+        backends.append("orjson")
+    backends.append("json")
+    return backends
+
+
+def json_decoder(schema: str, backend: str = "") -> Callable[[str], Any]:
+    """
+    返回解码函数 decode(text) -> dict（top_packages 为 list）。
+    schema 取 JSON_SCHEMAS 的键；backend 为空时使用 JSON_BACKEND。
+    msgspec 遇到与 schema 类型不符的行会回退到标准库 json，保证结果一致。
+    """
+    backend = backend or JSON_BACKEND
+    if backend == "auto":
+        backend = available_json_backends()[0]
+    if backend not in available_json_backends():
+        raise ValueError(f"JSON 后端不可用：{backend}（可用：{available_json_backends()}）")
+
+    if backend == "msgspec":
+        typed = msgspec.json.Decoder(JSON_SCHEMAS[schema])
+
+        def decode(text):
+            try:
+                return typed.decode(text)
+            except msgspec.ValidationError:
+                return json.loads(text)
+
+        return decode
+    if backend == "orjson":
+        return orjson.loads
+    return json.loads
+
+
+# ----------- 行级预过滤 ----------- #
+
+# 只匹配不含转义字符的值；含转义或匹配不到时回退到完整解码
+_PACKAGE_RE = re.compile(r'"package"\s*:\s*"([^"\\]*)"')
+
+
+def raw_package(line: str) -> Optional[str]:
+    """从原始 JSON 行截取 "package" 的值（未规范化）；无法可靠截取时返回 None。"""
+    m = _PACKAGE_RE.search(line)
+    return m.group(1) if m else None
+
+
+_normalize_raw = functools.lru_cache(maxsize=1 << 16)(normalize_name)
+
+
+def prefilter_name(line: str) -> Optional[str]:
+    """PREFILTER 打开时返回原始行中规范化后的包名；关闭或无法截取时返回 None，调用方需完整解码。"""
+    if not PREFILTER:
+        return None
+    raw = raw_package(line)
+    return _normalize_raw(raw) if raw is not None else None
+
+
+def verify_prefilter(line: str, pkg: str, obj: Optional[Dict] = None, decode: Optional[Callable] = None):
+    """PREFILTER_CHECK 打开时核对预过滤截取的包名与完整解码一致（obj 为空则用 decode 解码），不一致即报错。"""
+    if not PREFILTER_CHECK:
+        return
+    if obj is None:
+        obj = decode(line)
+    decoded = normalize_name(obj.get("package", ""))
+    if decoded != pkg:
+        raise ValueError(f"预过滤自检失败：截取到 {pkg!r}，完整解码为 {decoded!r}：{line[:200]}")
+
+
+def iter_wanted_rows(
+    lines: Iterable[str], wanted: Optional[Set[str]], decode: Callable[[str], Dict]
+) -> Iterator[Tuple[str, Dict]]:
+    """
+    逐行产出 (规范化包名, 解码结果)，只保留包名在 wanted 中的行；wanted 为 None 时产出所有行。
+    PREFILTER 打开时，原始行中的包名不在 wanted 的行直接跳过、不做 JSON 解码。
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        pkg = prefilter_name(line) if wanted is not None else None
+        if pkg is not None and pkg not in wanted:
+            verify_prefilter(line, pkg, decode=decode)
+            continue
+        obj = decode(line)
+        if pkg is not None:
+            verify_prefilter(line, pkg, obj)
+        pkg = normalize_name(obj.get("package", ""))
+        if wanted is not None and pkg not in wanted:
+            continue
+        yield pkg, obj
+
+
+# ----------- 依赖闭包 ----------- #
+
+def add_dependencies(adjacency: Dict[str, Set[str]], pkg: str, requires_dist: Iterable[str]):
+    """把一行 requires_dist 里的依赖包名并入 adjacency[pkg]（同一包各版本的依赖取并集）。"""
+    deps = adjacency.get(pkg)
+    if deps is None:
+        deps = adjacency[pkg] = set()
+    for req in requires_dist:
+        dep, _, _ = parse_requirement(req)
+        if dep:
+            deps.add(dep)
+
+
+def merge_adjacency(into: Dict[str, Set[str]], other: Dict[str, Iterable[str]]):
+    for pkg, deps in other.items():
+        if pkg in into:
+            into[pkg].update(deps)
+        else:
+            into[pkg] = set(deps)
+
+
+def dependency_closure(
+    adjacency: Dict[str, Iterable[str]], roots: Iterable[str], depth: Optional[int] = None
+) -> Set[str]:
+    """
+    从 roots 出发沿邻接表逐跳扩展直到不再新增（不动点），返回 depth 跳内可达的包（含 roots）。
+    depth 为 None 时求完整传递闭包；depth=1 即 roots 加其直接依赖。
+    """
+    keep = set(roots)
+    frontier = list(keep)
+    hops = 0
+    while frontier and (depth is None or hops < depth):
+        reached = []
+        for pkg in frontier:
+            for dep in adjacency.get(pkg, ()):
+                if dep not in keep:
+                    keep.add(dep)
+                    reached.append(dep)
+        frontier = reached
+        hops += 1
+    return keep
+
+
+# ----------- 压缩输入 ----------- #
+
+INPUT_SUFFIXES = {".zst": "zst", ".gz": "gz", ".xz": "xz"}
+_MAGICS = ((b"\x28\xb5\x2f\xfd", "zst"), (b"\x1f\x8b", "gz"), (b"\xfd7zXZ\x00", "xz"))
+_ZSTD_MAGIC = 0xFD2FB528
+_ZSTD_SKIPPABLE = 0x184D2A50  # 低 4 位任意
+
+
+def input_compression(path: Path) -> Optional[str]:
+    """按文件头魔数识别压缩格式（"zst" / "gz" / "xz"），文件太短读不出魔数时按扩展名；未压缩返回 None。"""
+    with path.open("rb") as f:
+        head = f.read(6)
+    for magic, kind in _MAGICS:
+        if head.startswith(magic):
+            return kind
+    if len(head) >= 4 and int.from_bytes(head[:4], "little") & ~0xF == _ZSTD_SKIPPABLE:
+        return "zst"  # pzstd 等以 skippable 帧开头
+    if len(head) < 4:
+        return INPUT_SUFFIXES.get(path.suffix)
+    return None
+
+
+def resolve_input(path: Path) -> Path:
+    """path 不存在时依次查找同名的 .zst / .gz / .xz 文件，都没有则原样返回（由读取处报错）。"""
+    if path.exists():
+        return path
+    for suffix in INPUT_SUFFIXES:
+        candidate = path.with_name(path.name + suffix)
+        if candidate.exists():
+            return candidate
+    return path
+
+
+def _zstd_frames(path: Path) -> Optional[Tuple[List[Tuple[int, int, int, int]], int]]:
+    """
+    解析 zstd 文件的帧边界，返回 ([(压缩偏移, 压缩长度, 解压后偏移, 解压后长度)], 解压后总大小)，跳过 skippable 帧。
+    有帧的帧头没记录解压后大小时返回 None（只能从头流式解压）。
+    """
+    stat = path.stat()
+    return _zstd_frames_cached(str(path), stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=16)
+def _zstd_frames_cached(path: str, size: int, mtime_ns: int):
+    frames = []
+    pos = out = 0
+    with open(path, "rb") as f:
+        while pos < size:
+            f.seek(pos)
+            head = f.read(18)  # 魔数 4 + 帧头描述 1 + 窗口 1 + 字典 ID 4 + 内容大小 8
+            magic = int.from_bytes(head[:4], "little")
+            if magic & ~0xF == _ZSTD_SKIPPABLE:
+                pos += 8 + int.from_bytes(head[4:8], "little")
+                continue
+            if magic != _ZSTD_MAGIC or len(head) < 6:
+                raise ValueError(f"不是完整的 zstd 文件：{path}（偏移 {pos}）")
+            descriptor = head[4]
+            single_segment = descriptor >> 5 & 1
+            fcs_size = (single_segment, 2, 4, 8)[descriptor >> 6]
+            if fcs_size == 0:
+                return None
+            fcs_at = 5 + (1 - single_segment) + (0, 1, 2, 4)[descriptor & 3]
+            content = int.from_bytes(head[fcs_at : fcs_at + fcs_size], "little") + (256 if fcs_size == 2 else 0)
+            block = pos + fcs_at + fcs_size
+            while True:  # 块头 3 字节：最低位为末块标记，1-2 位为类型（1 = RLE，只占 1 字节），其余为块大小
+                f.seek(block)
+                raw = f.read(3)
+                if len(raw) < 3:
+                    raise ValueError(f"zstd 文件被截断：{path}")
+                header = int.from_bytes(raw, "little")
+                block += 3 + (1 if header >> 1 & 3 == 1 else header >> 3)
+                if header & 1:
+                    break
+            end = block + (4 if descriptor >> 2 & 1 else 0)  # 内容校验和
+            frames.append((pos, end - pos, out, content))
+            out += content
+            pos = end
+    return frames, out
+
+
+def _parallel_frames(path: Path) -> Optional[List[Tuple[int, int, int, int]]]:
+    """可按帧并行解压（多帧、都带大小、单帧不超过 ZSTD_FRAME_LIMIT）时返回帧表，否则 None。"""
+    index = _zstd_frames(path) if input_compression(path) == "zst" else None
+    if index is None or len(index[0]) < 2 or max(frame[3] for frame in index[0]) > ZSTD_FRAME_LIMIT:
+        return None
+    return index[0]
+
+
+def input_size(path: Path) -> Optional[int]:
+    """解压后的字节数：未压缩为文件大小，zstd 各帧都带大小时为其和，其余压缩格式未知（None）。"""
+    kind = input_compression(path)
+    if kind is None:
+        return path.stat().st_size
+    index = _zstd_frames(path) if kind == "zst" else None
+    return index[1] if index is not None else None
+
+
+def _zstd_frame_chunks(path: Path, frames: List[Tuple[int, int, int, int]], start: int, threads: int) -> Iterator[bytes]:
+    """从 start 所在帧起，线程池并行解压后续各帧（最多提前 2 * threads 帧），按帧顺序产出。"""
+
+    def decompress(frame: Tuple[int, int, int, int]) -> bytes:
+        offset, length, _, _ = frame
+        with path.open("rb") as f:
+            f.seek(offset)
+            return zstandard.ZstdDecompressor().decompress(f.read(length))
+
+    first = max(bisect_right([frame[2] for frame in frames], start) - 1, 0)
+    todo = iter(frames[first:])
+    skip = start - frames[first][2]
+    with ThreadPoolExecutor(max_workers=threads) as exe:
+        pending = deque(exe.submit(decompress, frame) for _, frame in zip(range(2 * threads), todo))
+        try:
+            while pending:
+                data = pending.popleft().result()
+                frame = next(todo, None)
+                if frame is not None:
+                    pending.append(exe.submit(decompress, frame))
+                if skip:
+                    data, skip = data[skip:], 0
+                if data:
+                    yield data
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+
+def _decompressed_chunks(path: Path, start: int = 0, threads: int = ZSTD_THREADS) -> Iterator[bytes]:
+    """从解压后偏移 start 起逐块产出压缩输入的内容；流式格式需从头解压并丢弃 start 之前的部分。"""
+    kind = input_compression(path)
+    if kind == "zst":
+        if zstandard is None:
+            raise RuntimeError(f"读取 {path} 需要 zstandard：pip install zstandard")
+        frames = _parallel_frames(path)
+        if frames is not None:
+            yield from _zstd_frame_chunks(path, frames, start, threads)
+            return
+        stream = zstandard.ZstdDecompressor().stream_reader(path.open("rb"), read_across_frames=True)
+    elif kind == "gz":
+        stream = gzip.open(path, "rb")
+    else:
+        stream = lzma.open(path, "rb")
+    skip = start
+    with stream:
+        while True:
+            chunk = stream.read(DECOMPRESS_CHUNK)
+            if not chunk:
+                return
+            if skip >= len(chunk):
+                skip -= len(chunk)
+                continue
+            if skip:
+                chunk, skip = chunk[skip:], 0
+            yield chunk
+
+
+def _prefetch(make_chunks: Callable[[], Iterator[bytes]]) -> Iterator[bytes]:
+    """
+    在后台线程迭代 make_chunks()，经长度为 DECOMPRESS_QUEUE 的有界队列交给调用方，使解压与 JSON 解码重叠。
+    后台线程的异常在调用方重新抛出；调用方提前停止迭代时通知后台线程退出。
+    """
+    chunks: "queue.Queue" = queue.Queue(DECOMPRESS_QUEUE)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for chunk in make_chunks():
+                if not put(chunk):
+                    return
+        except BaseException as exc:
+            put(exc)
+            return
+        put(done)
+
+    thread = threading.Thread(target=produce, name=f"decompress-{os.getpid()}", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _split_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """把字节块切成带换行符的行（末行可能没有），与逐行迭代二进制文件的结果一致。"""
+    rest = b""
+    for chunk in chunks:
+        if rest:
+            chunk = rest + chunk
+        lines = chunk.split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+    if rest:
+        yield rest
+
+
+def _iter_raw_lines(path: Path, start: int) -> Iterator[bytes]:
+    """从（解压后的）字节偏移 start 起逐行读取原始字节。"""
+    if input_compression(path) is None:
+        with path.open("rb") as f:
+            f.seek(start)
+            yield from f
+        return
+    with closing(_prefetch(functools.partial(_decompressed_chunks, path, start))) as chunks:
+        yield from _split_lines(chunks)
+
+
+def read_input_text(path: Path) -> str:
+    """读取整个输入文件的文本，压缩文件先解压。"""
+    if input_compression(path) is None:
+        data = path.read_bytes()
+    else:
+        data = b"".join(_decompressed_chunks(path))
+    record_input(0, len(data))
+    return data.decode("utf-8")
+
+
+# ----------- 分片 ----------- #
+
+def split_line_ranges(path: Path, parts: int) -> List[Tuple[int, int]]:
+    """
+    把文件切成至多 parts 个 [start, end) 字节区间，每个区间都从行首开始、在行尾结束。
+    区间按文件顺序排列，依次拼接即覆盖整个文件。压缩输入的区间以解压后的偏移计，见 _split_compressed_ranges。
+    """
+    if input_compression(path) is not None:
+        return _split_compressed_ranges(path, parts)
+    size = path.stat().st_size
+    if size == 0:
+        return []
+    parts = max(1, parts)
+    step = -(-size // parts)
+    bounds = [0]
+    with path.open("rb") as f:
+        for i in range(1, parts):
+            pos = i * step
+            if pos >= size:
+                break
+            if pos <= bounds[-1]:
+                continue
+            # 从 pos-1 读到行尾：若 pos 恰在行首，只会读到前一行的换行符
+            f.seek(pos - 1)
+            f.readline()
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _split_compressed_ranges(path: Path, parts: int) -> List[Tuple[int, int]]:
+    """
+    压缩输入只能从可独立解压的位置读起：可按帧并行的 zstd 把切点挪到最近的帧起点，再顺延到下一行行首
+    （只需解压该帧开头）；其余格式整体作为一个区间，大小未知时终点为 UNKNOWN_END。
+    """
+    size = input_size(path)
+    if size is None:
+        return [(0, UNKNOWN_END)]
+    frames = _parallel_frames(path)
+    if size == 0 or frames is None:
+        return [(0, size)] if size else []
+    starts = [frame[2] for frame in frames]
+    step = -(-size // max(1, parts))
+    bounds = [0]
+    for i in range(1, max(1, parts)):
+        k = bisect_left(starts, i * step)
+        if k >= len(starts):
+            break
+        # 与未压缩时相同，从帧起点前一个字节找换行：帧恰好从行首开始时切点就是帧起点
+        pos = base = starts[k] - 1
+        with closing(_decompressed_chunks(path, base, threads=1)) as chunks:
+            for chunk in chunks:
+                newline = chunk.find(b"\n")
+                if newline >= 0:
+                    pos += newline + 1
+                    break
+                pos += len(chunk)
+        if pos >= size:
+            break
+        if pos > bounds[-1]:
+            bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def iter_range_lines(
+    path: Path, start: int, end: int, on_boundary: Optional[Callable[[int], None]] = None
+) -> Iterator[str]:
+    """
+    逐行读取 [start, end) 字节区间（start 需位于行首），返回解码后的文本行。
+    压缩输入的偏移按解压后的内容计，由后台线程解压。
+    on_boundary(pos) 每隔 CHECKPOINT_BYTES 在行边界调用一次：此时 pos 之前的行都已被下游处理完，
+    适合在回调里保存检查点。
+    """
+    pos = last = start
+    lines = 0
+    try:
+        with closing(_iter_raw_lines(path, start)) as raw_lines:
+            for raw in raw_lines:
+                if pos >= end:
+                    break
+                if on_boundary is not None and pos - last >= CHECKPOINT_BYTES:
+                    on_boundary(pos)
+                    last = pos
+                pos += len(raw)
+                lines += 1
+                yield raw.decode("utf-8")
+    finally:
+        record_input(lines, pos - start)
+
+
+# ----------- 检查点 ----------- #
+
+class Checkpoint:
+    """
+    单个分片的检查点文件（marshal 编码的 dict），先写临时文件再原子替换，
+    中断在写入过程中也不会留下半个检查点。path 为 None 时不读不写。
+    """
+
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def load(self) -> Optional[Dict]:
+        if self.path is None or not self.path.exists():
+            return None
+        with self.path.open("rb") as f:
+            return marshal.load(f)
+
+    def save(self, state: Dict):
+        if self.path is None:
+            return
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with tmp.open("wb") as f:
+            marshal.dump(state, f)
+        os.replace(tmp, self.path)
+
+
+# ----------- 进程池 ----------- #
+
+def map_ordered(fn: Callable, arg_list: Sequence[Tuple], workers: int, desc: str = "") -> List:
+    """
+    在进程池中执行 fn(*args)，按 arg_list 顺序返回结果（与完成顺序无关）。
+    fn 及参数需可 pickle（模块顶层函数）。
+    """
+    global _worker_hits, _worker_misses, _input_lines, _input_bytes
+    tqdm = _maybe_tqdm()
+    with ProcessPoolExecutor(max_workers=workers) as exe:
+        futures = [exe.submit(_run_counted, fn, args) for args in arg_list]
+        done = as_completed(futures)
+        if tqdm is not None:
+            done = tqdm(done, total=len(futures), desc=desc, unit="片")
+        for fut in done:
+            # 若有异常，立即抛出
+            fut.result()
+        results = []
+        for fut in futures:
+            result, hits, misses, lines, nbytes = fut.result()
+            _worker_hits += hits
+            _worker_misses += misses
+            _input_lines += lines
+            _input_bytes += nbytes
+            results.append(result)
+        return results
+
+
+def _run_counted(fn: Callable, args: Tuple):
+    """在子进程执行 fn，并带回本次调用产生的解析缓存命中/未命中与读入行数/字节数的增量。"""
+    before = _parse_requirement_cached.cache_info()
+    lines, nbytes = _input_lines, _input_bytes
+    result = fn(*args)
+    after = _parse_requirement_cached.cache_info()
+    return result, after.hits - before.hits, after.misses - before.misses, _input_lines - lines, _input_bytes - nbytes
+
+
+def plan_ranges(path: Path, workers: int) -> List[Tuple[int, int]]:
+    """串行时整个文件一个分片；多进程时按 workers * SHARDS_PER_WORKER 切分。"""
+    if workers > 1:
+        return split_line_ranges(path, workers * SHARDS_PER_WORKER)
+    size = input_size(path)
+    if size is None:
+        return [(0, UNKNOWN_END)]
+    return [(0, size)] if size else []
+
+
+def run_shards(fn: Callable, args: List[Tuple], workers: int, desc: str) -> List:
+    """只有一个分片或 workers <= 1 时在本进程依次执行 fn(*args, desc=desc)（带逐行进度条），否则交给进程池。"""
+    if workers > 1 and len(args) > 1:
+        return map_ordered(fn, args, workers, desc=desc)
+    return [fn(*a, desc=desc) for a in args]
+
+
+def progress(lines: Iterable[str], desc: Optional[str]) -> Iterable[str]:
+    """desc 非空且装了 tqdm 时给逐行迭代加进度条。"""
+    tqdm = _maybe_tqdm()
+    if desc is None or tqdm is None:
+        return lines
+    return tqdm(lines, desc=desc, unit="行", mininterval=1.0)
+
+
+# ----------- CSV 写出 ----------- #
+
+class CsvStreamWriter:
+    """
+    按固定表头增量写 CSV，可作上下文管理器使用。
+    header=False 时只写数据行，用作分片的 part 文件，再由 append_part 按顺序拼接到主文件。
+    resume=(字节数, 行数) 时把已有文件截断到该位置后续写（取自 position() 存下的检查点）。
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        fieldnames: Sequence[str],
+        header: bool = True,
+        resume: Optional[Tuple[int, int]] = None,
+    ):
+        self.path = path
+        self.count = 0
+        if resume is not None:
+            size, self.count = resume
+            with path.open("r+b") as f:
+                f.truncate(size)
+            self._f = path.open("a", encoding="utf-8", newline="", buffering=CSV_BUFFER)
+        else:
+            self._f = path.open("w", encoding="utf-8", newline="", buffering=CSV_BUFFER)
+        self._writer = csv.DictWriter(self._f, fieldnames=list(fieldnames))
+        if header and resume is None:
+            self._writer.writeheader()
+
+    def write(self, row: Dict):
+        self._writer.writerow(row)
+        self.count += 1
+
+    def write_values(self, values: Sequence):
+        """写一行按表头顺序排列的值（列式表直接写出，不构造 dict）。"""
+        self._writer.writer.writerow(values)
+        self.count += 1
+
+    def append_part(self, part_path: Path, rows: int):
+        """把无表头的 part 文件原样追加到本文件，rows 为其中的行数。"""
+        with part_path.open("r", encoding="utf-8", newline="") as part:
+            shutil.copyfileobj(part, self._f, CSV_BUFFER)
+        self.count += rows
+
+    def position(self) -> Tuple[int, int]:
+        """刷新缓冲并返回 (已写字节数, 已写行数)，用于检查点。"""
+        self._f.flush()
+        return self._f.buffer.tell(), self.count
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _maybe_tqdm():
+    """有 tqdm 则返回 tqdm 包装，否则返回 None。"""
+    try:
+        from tqdm.auto import tqdm  # type: ignore
+    except Exception:
+        return None
+    return tqdm
+
+
+# ----------- 列式输出（Parquet） ----------- #
+
+# 各输出表的列类型，未列出的列按 str 处理。dict 为字典编码字符串，用于包名、版本约束等重复度高的列。
+TABLE_COLUMNS: Dict[str, Dict[str, str]] = {
+    "packages": {
+        "name": "str", "downloads": "int", "rank": "int", "is_top": "bool", "noise": "bool", "latest_ordinal": "int",
+    },
+    "package_versions": {
+        "name_version": "str",
+        "name": "dict",
+        "version": "dict",
+        "requires_python": "dict",
+        "is_top_pkg": "bool",
+        "upload_time": "float",
+        "version_key": "str",
+        "version_ordinal": "int",
+        "python_mask": "int",
+    },
+    "package_version_requires": {
+        "src": "dict", "dest": "dict", "spec": "dict", "marker": "dict", "spec_intervals": "dict", "env_mask": "int",
+    },
+    "repos": {"full_name": "str", "stars": "int", "about": "str"},
+    "repo_depends": {
+        "repo": "dict", "pkg": "dict", "spec": "dict", "marker": "dict", "spec_intervals": "dict", "env_mask": "int",
+    },
+    "topics": {"name": "str"},
+    "repo_topics": {"repo": "dict", "topic": "dict"},
+}
+
+
+def _arrow_type(kind: str):
+    return {
+        "str": pa.string(),
+        "dict": pa.dictionary(pa.int32(), pa.string()),
+        "int": pa.int64(),
+        "bool": pa.bool_(),
+        "float": pa.float64(),
+    }[kind]
+
+
+def write_parquet(csv_path: Path) -> Optional[Path]:
+    """
+    把写完的 CSV 按 TABLE_COLUMNS 的类型流式转成同名 .parquet，返回其路径；
+    未开启 COLUMNAR_OUTPUT 或未安装 pyarrow 时返回 None。数值列的空串记为 null，字符串列保持空串。
+    """
+    if not COLUMNAR_OUTPUT or pa is None:
+        return None
+    with csv_path.open("r", encoding="utf-8", newline="") as f:
+        header = next(csv.reader(f), None)
+    if not header:
+        return None
+
+    kinds = TABLE_COLUMNS.get(csv_path.stem, {})
+    schema = pa.schema([(col, _arrow_type(kinds.get(col, "str"))) for col in header])
+    reader = pacsv.open_csv(
+        csv_path,
+        read_options=pacsv.ReadOptions(block_size=CSV_BUFFER * 16),
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(
+            column_types=schema,
+            true_values=["True", "true"],
+            false_values=["False", "false"],
+            null_values=[""],
+            strings_can_be_null=False,
+        ),
+    )
+    out_path = csv_path.with_suffix(".parquet")
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    with pq.ParquetWriter(tmp, schema, compression=PARQUET_COMPRESSION) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+    os.replace(tmp, out_path)
+    return out_path
+
+
+def write_parquet_tables(out_dir: Path, names: Iterable[str]) -> List[Path]:
+    """对 out_dir 下的一组 CSV 依次调用 write_parquet，返回实际写出的 .parquet 路径。"""
+    written = []
+    for name in names:
+        path = write_parquet(out_dir / f"{name}.csv")
+        if path is not None:
+            written.append(path)
+    return written
+
+
+def read_table(out_dir: Path, name: str) -> List[Dict]:
+    """
+    读取一张输出表为 dict 列表。有不旧于 CSV 的 .parquet 且装了 pyarrow 时读 Parquet（值带类型），
+    否则读 CSV（值均为字符串）；导入脚本的 Cypher 对两种取值都兼容。
+    """
+    csv_path = out_dir / f"{name}.csv"
+    parquet_path = out_dir / f"{name}.parquet"
+    if pq is not None and parquet_path.exists():
+        if not csv_path.exists() or parquet_path.stat().st_mtime_ns >= csv_path.stat().st_mtime_ns:
+            return pq.read_table(parquet_path).to_pylist()
+    with csv_path.open("r", encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
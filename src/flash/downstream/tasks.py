@@ -15,7 +15,9 @@
 from __future__ import annotations
 
 import functools
+import sys
 from dataclasses import dataclass
+from pathlib import Path
 from typing import Dict, List, Optional, Sequence, Tuple, Set
 
 from neo4j import GraphDatabase
@@ -24,6 +26,13 @@ from packaging.specifiers import SpecifierSet
 from packaging.version import Version, InvalidVersion
 from tqdm.auto import tqdm
 
+# 兼容直接运行，加入 src 路径以导入 env_markers
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+from env_markers import marker_active, python_supported
+
 NEO4J_URI = ""
 NEO4J_USER = "neo4j"
 NEO4J_PASSWORD = ""
@@ -35,6 +44,10 @@ MAX_QUEUE = 2000
 MAX_PACKAGES = 800
 RETRIES = 3
 VERBOSE = True
+# KGClient 默认的目标解释器（如 "3.11"）与平台（linux | macos | windows）；None 为不按环境过滤（依赖仍跳过 extra ==）。
+# 给出解释器时按 python_mask 预筛版本，解释器与平台都给出时按 REQUIRES 上的 env_mask 过滤不生效的依赖
+TARGET_PYTHON: Optional[str] = None
+TARGET_PLATFORM: Optional[str] = None
 
 
 # ----------------------- 数据结构 ----------------------- #
@@ -57,7 +70,21 @@ class ResolutionResult:
 
 
 class KGClient:
-    def __init__(self, uri=NEO4J_URI, user=NEO4J_USER, password=NEO4J_PASSWORD, database=NEO4J_DB):
+    """
+    图谱查询客户端。target_python / target_platform 为解析的目标环境，默认 None 即不按环境过滤
+    （返回全部版本，依赖仍跳过含 extra == 的）；
+    同一个图谱在不同目标环境下的解析结果可能不同。
+    """
+
+    def __init__(
+        self,
+        uri=NEO4J_URI,
+        user=NEO4J_USER,
+        password=NEO4J_PASSWORD,
+        database=NEO4J_DB,
+        target_python: Optional[str] = TARGET_PYTHON,
+        target_platform: Optional[str] = TARGET_PLATFORM,
+    ):
         self.driver = GraphDatabase.driver(
             uri,
             auth=(user, password),
@@ -65,6 +92,8 @@ class KGClient:
             max_connection_lifetime=300,
         )
         self.database = database
+        self.target_python = target_python
+        self.target_platform = target_platform
 
     def close(self):
         self.driver.close()
@@ -93,23 +122,40 @@ class KGClient:
         return []
 
     def get_versions(self, name: str) -> List[str]:
-        """返回指定包的版本列表（字符串），未排序由 Neo4j 返回；在 Python 侧再排序。"""
+        """
+        返回指定包的版本列表（降序，最新在前）。按 ETL 写入的 version_ordinal 在 Neo4j 中排序，
+        旧图谱没有该属性时退回 Python 侧排序；给出 target_python 时，requires_python 不支持它的版本按 python_mask 直接剔除。
+        """
         q = """
         MATCH (p:Package {name:$name})-[:HAS_VERSION]->(v:PackageVersion)
-        RETURN v.version AS ver
+        RETURN v.version AS ver, v.version_ordinal AS ord, v.python_mask AS python_mask
+        ORDER BY ord DESC
         """
         records = self._run_query(q, {"name": name})
+        if self.target_python is not None:
+            records = [r for r in records if python_supported(r["python_mask"], self.target_python)]
         vers = [r["ver"] for r in records]
-        return sort_versions(vers)
+        if any(r["ord"] is None for r in records):
+            return sort_versions(vers)
+        return vers
 
     def get_requires(self, name: str, version: str) -> List[Tuple[str, str, str]]:
-        """给定包与版本，返回依赖列表 (dep_name, spec, marker)。"""
+        """
+        给定包与版本，返回依赖列表 (dep_name, spec, marker)，只含需要解析的依赖：
+        target_python 与 target_platform 都给出时按 env_mask 只保留在该环境下生效的依赖；
+        否则（或旧图谱没有 env_mask）沿用原规则，跳过含 extra == 的依赖。
+        """
         q = """
         MATCH (v:PackageVersion {name_version:$nv})- [r:REQUIRES]->(dep:Package)
-        RETURN dep.name AS dep, r.spec AS spec, r.marker AS marker
+        RETURN dep.name AS dep, r.spec AS spec, r.marker AS marker, r.env_mask AS env_mask
         """
         nv = f"{name}@{version}"
         records = self._run_query(q, {"nv": nv})
+        if self.target_python is not None and self.target_platform is not None:
+            python, platform = self.target_python, self.target_platform
+        else:
+            python = platform = None  # 不在环境矩阵中，marker_active 只跳过 extra ==
+        records = [r for r in records if marker_active(r["marker"] or "", r["env_mask"], python, platform)]
         return [(r["dep"], r["spec"] or "", r["marker"] or "") for r in records]
 
 
@@ -207,9 +253,9 @@ def resolve_plan(
         # 构造候选列表
         if not spec or str(spec) == "":
             # 无约束时优先最新，再尝试更低版本
-            cands = sort_versions(versions)  # 降序，最新在前
+            cands = list(versions)  # get_versions 已是降序，最新在前
         else:
-            cands = [v for v in reversed(sort_versions(versions)) if spec.contains(v, prereleases=True)]  # 升序满足
+            cands = [v for v in reversed(versions) if spec.contains(v, prereleases=True)]  # 升序满足
         if not cands:
             return False, plan_state, [f"{name}: 无法找到满足 {spec} 的版本"]
 
@@ -229,8 +275,6 @@ def resolve_plan(
             new_plan[name] = PackageSelection(name, cand, source)
             deps = kg.get_requires(name, cand)
             for dep_name, dep_spec, marker in deps:
-                if marker and "extra ==" in marker:
-                    continue
                 new_queue.append((normalize_name(dep_name), SpecifierSet(dep_spec or ""), f"dep-of-{name}"))
             ok, p2, conf = dfs(new_queue, new_plan, visited)
             if ok:
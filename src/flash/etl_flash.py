@@ -6,6 +6,7 @@
 - data/top_packages_by_downloads_10000.json
 - data/google_sql_with_pyv_pkg.json        （>2GB，需流式）
 - data/python_repos_requirements_more_info.jsonl
+（都可以换成 .zst / .gz / .xz 压缩版，边解压边解析）
 
 输出目录：./out/
 - packages.csv
@@ -15,292 +16,787 @@
 - repo_depends.csv
 - topics.csv
 - repo_topics.csv
+（装了 pyarrow 时另有同名 .parquet，列带类型、字典编码）
+- manifest.marshal     已输出的版本与每包 upload_ts 水位，供增量模式使用
+
+增量模式：python etl_flash.py --delta 新增行.json
+只读取新增行，与 manifest 合并后在 out/delta/ 下输出版本与依赖边的 *_add / *_remove CSV，并更新 manifest。
+加 --bulk 时另在 out/bulk/ 生成 neo4j-admin database import 文件，可离线建库。
+加 --direct neo4j 时不写七张 CSV，选出的包/版本/依赖边由后台线程直接导入 import_flash.py 中配置的库，
+与 repo requirements 的解析重叠（见 graph_stream.py）；--direct memory 用内存替身校验导入顺序。
+各阶段指标写入 out/etl_metrics.json，--profile 选中的阶段在 cProfile 下运行（统计存到 out/profile/）。
+
+全量与增量都是 pipeline.py 流水线引擎的预设（与 etl.py 共用读取下载榜、repo requirements 与输出阶段），
+结束时打印各阶段的耗时与行数。
 """
 
-import csv
-import json
-import re
+import argparse
+import functools
+import heapq
+import marshal
+import os
+import shutil
+import sys
+from array import array
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Set, Tuple
-
-from tqdm.auto import tqdm
-from packaging.version import Version, InvalidVersion
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+# 兼容直接运行，加入上级路径以导入 etl_common
+SRC_DIR = Path(__file__).resolve().parents[1]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+from etl_common import (
+    add_dependencies,
+    dependency_closure,
+    format_parse_cache_stats,
+    iter_range_lines,
+    iter_wanted_rows,
+    json_decoder,
+    merge_adjacency,
+    parse_requirement,
+    plan_ranges,
+    progress,
+    resolve_input,
+    run_shards,
+)
+from env_markers import marker_mask, python_mask
+from graph_stream import GraphImporter, make_sink
+from pipeline import (
+    LEGACY_REPO_FILE,
+    PACKAGE_FIELDS,
+    Pipeline,
+    Stage,
+    emit_stage,
+    feed_tables,
+    load_top_stage,
+    repo_stage,
+    write_csv,
+)
+from spec_intervals import encode_spec, version_key, version_ordinals
 
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
 DATA_DIR = PROJECT_ROOT / "data"
 OUT_DIR = Path(__file__).resolve().parent / "out"
 
 TOP_N = 500  # 仅保留下载榜前 1000 的包及其依赖
+KEEP_VERSIONS = 30  # 每个包保留的最新版本数
+CLOSURE_DEPTH: Optional[int] = None  # keep 集合的依赖跳数：None 为完整传递闭包，1 为只含 top 包的直接依赖
+PARSE_WORKERS = os.cpu_count() or 1  # 大文件解析进程数；1 为串行
+MANIFEST_NAME = "manifest.marshal"
+
+# 版本与依赖边 CSV 的表头（packages 与 repo 相关表的表头见 pipeline.py）
+VERSION_FIELDS = [
+    "name_version", "name", "version", "requires_python", "is_top_pkg", "upload_time", "version_key",
+    "version_ordinal", "python_mask",
+]
+REQUIRES_FIELDS = ["src", "dest", "spec", "marker", "spec_intervals", "env_mask"]
+
+# 增量输出：表名 -> 表头
+DELTA_FIELDS = {
+    "packages_add": PACKAGE_FIELDS,
+    "packages_update": ["name", "latest_ordinal"],
+    "package_versions_add": VERSION_FIELDS,
+    "package_versions_update": ["name_version", "version_ordinal"],
+    "package_versions_remove": ["name_version"],
+    "package_version_requires_add": REQUIRES_FIELDS,
+    "package_version_requires_remove": ["src", "dest"],
+}
+
+decode_pypi_row = json_decoder("pypi")
 
-_SPACE_RE = re.compile(r"\s+")
 
+def ensure_out_dir():
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
 
-def normalize_name(name: str) -> str:
-    return _SPACE_RE.sub("-", name.strip().lower().replace("_", "-"))
 
+def first_pass_collect_keep(path: Path, roots: Set[str], workers: int = PARSE_WORKERS) -> Set[str]:
+    """
+    扫描一遍 dump 累积 包 -> 依赖并集 的邻接表，在内存里从 roots 出发求 CLOSURE_DEPTH 跳的依赖闭包。
+    CLOSURE_DEPTH 为 1 时只需 roots 的行（可走预过滤）；否则每行都要解码。
+    """
+    scope = roots if CLOSURE_DEPTH == 1 else None
+    args = [(path, start, end, scope) for start, end in plan_ranges(path, workers)]
+    adjacency: Dict[str, Set[str]] = {}
+    for shard_adjacency in run_shards(_first_pass_shard, args, workers, f"扫描 top{TOP_N} 依赖"):
+        merge_adjacency(adjacency, shard_adjacency)
+    return dependency_closure(adjacency, roots, CLOSURE_DEPTH)
 
-def parse_requirement(req: str) -> Tuple[Optional[str], str, str]:
-    req = req.strip()
-    if not req:
-        return None, "", ""
-    try:
-        from packaging.requirements import Requirement  # type: ignore
-    except Exception:
-        Requirement = None  # type: ignore
-
-    if Requirement:
-        try:
-            r = Requirement(req)
-            name = normalize_name(r.name)
-            spec = str(r.specifier) if r.specifier else ""
-            marker = str(r.marker) if r.marker else ""
-            return name, spec, marker
-        except Exception:
-            pass
-
-    marker = ""
-    if ";" in req:
-        req, marker = req.split(";", 1)
-        marker = marker.strip()
-    req = req.strip()
-    name = normalize_name(req.split()[0].split("[", 1)[0].split("(", 1)[0])
-    spec = ""
-    if "(" in req and ")" in req:
-        spec = req[req.find("(") : req.find(")") + 1]
-    return name or None, spec, marker
 
+def _first_pass_shard(
+    path: Path, start: int, end: int, scope: Optional[Set[str]], desc: Optional[str] = None
+) -> Dict[str, Set[str]]:
+    adjacency: Dict[str, Set[str]] = {}
+    for pkg, obj in iter_wanted_rows(progress(iter_range_lines(path, start, end), desc), scope, decode_pypi_row):
+        add_dependencies(adjacency, pkg, obj.get("requires_dist") or [])
+    return adjacency
 
-def ensure_out_dir():
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
 
+def second_pass_build(
+    path: Path,
+    keep_set: Set[str],
+    top_info: Dict[str, Dict],
+    workers: int = PARSE_WORKERS,
+    watermarks: Optional[Dict[str, float]] = None,
+) -> Tuple[Dict[str, Dict], Dict[str, List[Tuple]], Dict[str, float]]:
+    """
+    返回 (packages, 包 -> 最新 KEEP_VERSIONS 个已排序条目, 包 -> 见过的最大 upload_ts)。
+    watermarks 非空时（增量模式）跳过 upload_ts 不晚于该包水位的行。
+    分片结果按文件顺序合并；跨分片的同一包再做一次 top-K 合并。
+    """
+    packages: Dict[str, Dict] = {}
+    selected: Dict[str, List[Tuple]] = {}
+    latest: Dict[str, float] = {}
+    reopened = 0
 
-def load_top_packages() -> Dict[str, Dict]:
-    path = DATA_DIR / "top_packages_by_downloads_10000.json"
-    with path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
-    result = {}
-    for idx, row in enumerate(data[:TOP_N], start=1):
-        name = normalize_name(row["project"])
-        result[name] = {
-            "downloads": int(row["download_count"]),
-            "rank": idx,
-            "is_top": True,
-        }
-    return result
+    ranges = plan_ranges(path, workers)
+    args = [(path, start, end, keep_set, top_info, idx, watermarks) for idx, (start, end) in enumerate(ranges)]
+    for shard_packages, shard_selected, shard_reopened, shard_latest in run_shards(
+        _collect_shard, args, workers, "生成包/版本/依赖"
+    ):
+        for pkg, row in shard_packages.items():
+            packages.setdefault(pkg, row)
+        for pkg, entries in shard_selected.items():
+            if pkg in selected:
+                selected[pkg] = _NewestK(KEEP_VERSIONS, selected[pkg] + entries).sorted()
+            else:
+                selected[pkg] = entries
+        for pkg, ts in shard_latest.items():
+            latest[pkg] = max(ts, latest.get(pkg, ts))
+        reopened += shard_reopened
 
+    if reopened:
+        print(f"    输入未按包名分组（{reopened} 个包被重新打开），已回退为各包堆常驻合并")
+    return packages, selected, latest
 
-def first_pass_collect_keep(path: Path, top_set: Set[str]) -> Set[str]:
-    keep: Set[str] = set(top_set)
-    with path.open("r", encoding="utf-8") as f:
-        for line in tqdm(f, desc=f"扫描 top{TOP_N} 依赖", unit="行", mininterval=1.0):
-            line = line.strip()
-            if not line:
-                continue
-            obj = json.loads(line)
-            pkg = normalize_name(obj.get("package", ""))
-            if pkg not in top_set:
-                continue
-            for req in obj.get("requires_dist") or []:
-                dep, _, _ = parse_requirement(req)
-                if dep:
-                    keep.add(dep)
-    return keep
 
+class _Ranked:
+    """堆元素：rank 越大越先出堆（heapq 是小顶堆，这里反转比较），堆顶即当前最旧的条目。"""
 
-def second_pass_build(
-    path: Path, keep_set: Set[str], top_info: Dict[str, Dict]
-) -> Tuple[Dict[str, Dict], List[Dict], List[Dict]]:
-    packages: Dict[str, Dict] = {}
-    versions_out: List[Dict] = []
-    requires_edges_out: List[Dict] = []
-    versions_map: Dict[str, List[Dict]] = {}
-
-    with path.open("r", encoding="utf-8") as f:
-        for line in tqdm(f, desc="生成包/版本/依赖", unit="行", mininterval=1.0):
-            line = line.strip()
-            if not line:
-                continue
-            obj = json.loads(line)
-            pkg = normalize_name(obj.get("package", ""))
-            if pkg not in keep_set:
-                continue
+    __slots__ = ("rank", "entry")
 
-            packages.setdefault(
-                pkg,
-                {
-                    "name": pkg,
-                    "downloads": top_info.get(pkg, {}).get("downloads"),
-                    "rank": top_info.get(pkg, {}).get("rank"),
-                    "is_top": pkg in top_info,
-                    "noise": pkg not in top_info,
-                },
-            )
+    def __init__(self, rank: Tuple, entry: Tuple):
+        self.rank = rank
+        self.entry = entry
 
-            version = str(obj.get("version") or "")
-            # 解析上传时间为时间戳，便于排序
-            upload_time = obj.get("upload_time")
-            upload_ts = None
-            if upload_time:
-                try:
-                    upload_ts = datetime.fromisoformat(str(upload_time).replace("Z", "+00:00")).timestamp()
-                except Exception:
-                    upload_ts = None
-            # 跳过非 PEP 440 合法版本（忽略所有非标准后缀）
-            try:
-                Version(version)
-            except InvalidVersion:
-                continue
+    def __lt__(self, other: "_Ranked") -> bool:
+        return other.rank < self.rank
 
-            name_version = f"{pkg}@{version}"
-            item = {
-                "name_version": name_version,
-                "name": pkg,
-                "version": version,
-                "requires_python": obj.get("requires_python") or "",
-                "is_top_pkg": pkg in top_info,
-                "requires": [],
-                "upload_ts": upload_ts,
-            }
-            for req in obj.get("requires_dist") or []:
-                dep, spec, marker = parse_requirement(req)
-                if dep:
-                    item["requires"].append({"dest": dep, "spec": spec, "marker": marker})
-            versions_map.setdefault(pkg, []).append(item)
-
-    def version_key(v: str):
-        try:
-            return (0, Version(v))
-        except Exception:
-            return (1, v)
-
-    def item_key(x: Dict):
-        ts = x.get("upload_ts")
-        ts_key = -ts if ts is not None else 0  # 越新越小
-        return (ts_key, version_key(x["version"]))
-
-    for pkg, items in versions_map.items():
-        items_sorted = sorted(items, key=item_key)
-        for item in items_sorted[:30]:  # 保留最新版本（按时间优先，其次语义版本）
-            versions_out.append(
-                {
-                    "name_version": item["name_version"],
-                    "name": item["name"],
-                    "version": item["version"],
-                    "requires_python": item["requires_python"],
-                    "is_top_pkg": item["is_top_pkg"],
-                    "upload_time": item.get("upload_ts"),
-                }
-            )
-            for dep in item["requires"]:
-                requires_edges_out.append(
-                    {
-                        "src": item["name_version"],
-                        "dest": dep["dest"],
-                        "spec": dep["spec"],
-                        "marker": dep["marker"],
-                    }
-                )
 
-    return packages, versions_out, requires_edges_out
+class _NewestK:
+    """
+    单个包的有界堆，只保留排序键最小（最新）的 k 个条目。
+    条目为 (key, seq, item)：key 为 (时间键, 版本键)，seq 为到达序号，键相同时先到者优先，
+    与对全部条目做稳定排序后取前 k 个结果一致。
+    """
+
+    __slots__ = ("k", "heap")
+
+    def __init__(self, k: int, entries: Iterable[Tuple] = ()):
+        self.k = k
+        self.heap: List[_Ranked] = []
+        for key, seq, item in entries:
+            self.push(key, seq, item)
 
+    def accepts(self, key: Tuple, seq: Tuple) -> bool:
+        return len(self.heap) < self.k or (key, seq) < self.heap[0].rank
 
-def parse_repo_requirements(keep_packages: Set[str]):
-    repo_path = DATA_DIR / "python_repos_requirements_more_info.jsonl"
-    repos: List[Dict] = []
-    repo_depends: List[Dict] = []
-    repo_topics: List[Dict] = []
+    def push(self, key: Tuple, seq: Tuple, item: "_VersionItem"):
+        node = _Ranked((key, seq), (key, seq, item))
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, node)
+        elif node.rank < self.heap[0].rank:
+            heapq.heapreplace(self.heap, node)
 
-    with repo_path.open("r", encoding="utf-8") as f:
-        for line in tqdm(f, desc="解析 Repo requirements", unit="行", mininterval=0.5):
-            line = line.strip()
-            if not line:
+    def sorted(self) -> List[Tuple]:
+        return [node.entry for node in sorted(self.heap, key=lambda n: n.rank)]
+
+
+def _rank_key(upload_ts: Optional[float], vkey: str) -> Tuple:
+    """排序键：按时间优先（新者在前），其次语义版本（vkey 为 version_key 的保序键，字符串比较即 PEP 440 顺序）。"""
+    return (-upload_ts if upload_ts is not None else 0, vkey)
+
+
+def parse_upload_ts(upload_time: Any) -> Optional[float]:
+    """upload_time -> 时间戳（"Z" 视作 UTC，不带时区按本地时间），无法解析时返回 None。"""
+    try:
+        return datetime.fromisoformat(str(upload_time).replace("Z", "+00:00")).timestamp()
+    except Exception:
+        return None
+
+
+def _collect_versions(
+    lines: Iterable[str],
+    keep_set: Set[str],
+    top_info: Dict[str, Dict],
+    shard: int = 0,
+    watermarks: Optional[Dict[str, float]] = None,
+) -> Tuple[Dict[str, Dict], Dict[str, List[Tuple]], int, Dict[str, float]]:
+    """
+    流式 group-by：BigQuery 导出按 package 排序，同一包的行连续到达，
+    包名变化时即把上一个包的堆定稿为最新 KEEP_VERSIONS 个条目并释放其余条目。
+    若某个已定稿的包再次出现（输入未排序），用定稿结果重建它的堆，并改为所有包的堆常驻、
+    扫描结束后统一定稿（内存仍以每包 K 条为上限），结果不变。
+    watermarks 非空时跳过 upload_ts 不晚于该包水位的行（已在上次运行处理过）。
+    返回 (packages, 包 -> 已排序条目列表, 重新打开次数, 包 -> 最大 upload_ts)。
+    """
+    packages: Dict[str, Dict] = {}
+    selected: Dict[str, List[Tuple]] = {}  # 按首次出现顺序占位，定稿后填入
+    latest: Dict[str, float] = {}
+    heaps: Dict[str, _NewestK] = {}
+    unsorted = False
+    reopened = 0
+    current_pkg: Optional[str] = None
+    seq = 0
+
+    for pkg, obj in iter_wanted_rows(lines, keep_set, decode_pypi_row):
+        packages.setdefault(
+            pkg,
+            {
+                "name": pkg,
+                "downloads": top_info.get(pkg, {}).get("downloads"),
+                "rank": top_info.get(pkg, {}).get("rank"),
+                "is_top": pkg in top_info,
+                "noise": pkg not in top_info,
+            },
+        )
+
+        version = str(obj.get("version") or "")
+        # 解析上传时间为时间戳，便于排序
+        upload_time = obj.get("upload_time")
+        upload_ts = parse_upload_ts(upload_time) if upload_time else None
+        if watermarks is not None and pkg in watermarks:
+            if upload_ts is None or upload_ts <= watermarks[pkg]:
                 continue
-            obj = json.loads(line)
-            full_name = obj.get("full_name")
-            if not full_name:
+        if upload_ts is not None and (pkg not in latest or upload_ts > latest[pkg]):
+            latest[pkg] = upload_ts
+        # 跳过非 PEP 440 合法版本（忽略所有非标准后缀）；保序键有缓存，校验、堆内排序与写出共用
+        vkey = version_key(version)
+        if not vkey:
+            continue
+
+        if pkg != current_pkg:
+            if current_pkg is not None and not unsorted:
+                selected[current_pkg] = heaps.pop(current_pkg).sorted()
+            current_pkg = pkg
+            if pkg not in heaps:
+                previous = selected.get(pkg)
+                if previous is not None:
+                    unsorted = True
+                    reopened += 1
+                heaps[pkg] = _NewestK(KEEP_VERSIONS, previous or ())
+                selected.setdefault(pkg, [])
+        current = heaps[pkg]
+
+        # 保留最新版本（按时间优先，其次语义版本）；进不了前 K 的行不必解析依赖
+        key = _rank_key(upload_ts, vkey)
+        rank_seq = (shard, seq)
+        seq += 1
+        if not current.accepts(key, rank_seq):
+            continue
+
+        requires: List[str] = []
+        for req in obj.get("requires_dist") or []:
+            dep, spec, marker = parse_requirement(req)
+            if dep:
+                requires += (dep, spec, marker)
+        item = _VersionItem(
+            sys.intern(pkg),
+            sys.intern(version),
+            sys.intern(obj.get("requires_python") or ""),
+            pkg in top_info,
+            upload_ts,
+            tuple(requires),
+        )
+        current.push(key, rank_seq, item)
+
+    for pkg, heap in heaps.items():
+        selected[pkg] = heap.sorted()
+    return packages, selected, reopened, latest
+
+
+def _collect_shard(
+    path: Path,
+    start: int,
+    end: int,
+    keep_set: Set[str],
+    top_info: Dict[str, Dict],
+    shard: int,
+    watermarks: Optional[Dict[str, float]] = None,
+    desc: Optional[str] = None,
+) -> Tuple[Dict[str, Dict], Dict[str, List[Tuple]], int, Dict[str, float]]:
+    return _collect_versions(progress(iter_range_lines(path, start, end), desc), keep_set, top_info, shard, watermarks)
+
+
+def _select_versions(
+    selected: Dict[str, List[Tuple]], ordinals: Optional[Dict[str, Dict[str, int]]] = None
+) -> Tuple["VersionTable", "EdgeTable"]:
+    """
+    已选条目 -> (版本表, 依赖边表)。version_ordinal 取自 ordinals（包 -> {版本: 序号}），
+    未给出时按包内全部条目稠密编号；manifest 还原的旧条目只参与排序、不输出。
+    """
+    versions = VersionTable()
+    edges = EdgeTable(versions)
+    for pkg, entries in selected.items():
+        if ordinals is None:
+            pkg_ordinals = version_ordinals(item.version for _, _, item in entries)
+        else:
+            pkg_ordinals = ordinals[pkg]
+        for _, _, item in entries:
+            if item.seeded:
                 continue
-
-            repos.append(
-                {
-                    "full_name": full_name,
-                    "stars": obj.get("stargazers_count", 0),
-                    "about": obj.get("about", "") or "",
-                }
+            row = versions.append(item, pkg_ordinals[item.version])
+            for dest, spec, marker in item.requirements():
+                edges.append(row, dest, spec, marker)
+    return versions, edges
+
+
+def _set_latest_ordinals(packages: Dict[str, Dict], versions: "VersionTable"):
+    """packages 每行补上 latest_ordinal（该包已输出版本的最大序号，无版本为空）。"""
+    latest = versions.latest_ordinals()
+    for name, row in packages.items():
+        row["latest_ordinal"] = latest.get(name)
+
+
+# ----------- 紧凑存储 ----------- #
+
+class _VersionItem:
+    """
+    一个候选版本。字符串都已驻留（同值共享一个对象），依赖展平为 (dest, spec, marker, dest, ...) 元组，
+    不为每个版本、每条依赖各建一个 dict。seeded 为从 manifest 还原的旧条目：只有依赖包名，只参与排序、不输出。
+    """
+
+    __slots__ = ("name", "version", "requires_python", "is_top_pkg", "upload_ts", "requires", "seeded")
+
+    def __init__(
+        self,
+        name: str,
+        version: str,
+        requires_python: str,
+        is_top_pkg: bool,
+        upload_ts: Optional[float],
+        requires: Tuple[str, ...],
+        seeded: bool = False,
+    ):
+        self.name = name
+        self.version = version
+        self.requires_python = requires_python
+        self.is_top_pkg = is_top_pkg
+        self.upload_ts = upload_ts
+        self.requires = requires
+        self.seeded = seeded
+
+    @property
+    def name_version(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    def requirements(self) -> Iterator[Tuple[str, str, str]]:
+        """逐条 (dest, spec, marker)。"""
+        it = iter(self.requires)
+        return zip(it, it, it)
+
+    def dests(self) -> Tuple[str, ...]:
+        return self.requires[::3]
+
+
+class _StringPool:
+    """字符串 -> 从 0 开始的连续整数 ID，values[id] 取回字符串。"""
+
+    __slots__ = ("ids", "values")
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def id(self, value: str) -> int:
+        idx = self.ids.get(value)
+        if idx is None:
+            idx = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return idx
+
+
+class VersionTable:
+    """
+    已选版本的列式存储：包名、版本、requires_python 为字符串池 ID（array('i')），upload_ts 为 array('d')（NaN 为空）。
+    name_version / version_key / python_mask 在写出时由各列算出（后两者有缓存），不常驻内存。
+    iter_values 按 VERSION_FIELDS 顺序逐行产出值元组，write_csv 直接写出；迭代本身则产出行 dict。
+    """
+
+    fields = VERSION_FIELDS
+
+    def __init__(self):
+        self.pool = _StringPool()
+        self.name = array("i")
+        self.version = array("i")
+        self.requires_python = array("i")
+        self.is_top_pkg = array("b")
+        self.upload_ts = array("d")
+        self.version_ordinal = array("i")
+
+    def append(self, item: _VersionItem, ordinal: int) -> int:
+        """追加一行，返回行号。"""
+        pool = self.pool
+        self.name.append(pool.id(item.name))
+        self.version.append(pool.id(item.version))
+        self.requires_python.append(pool.id(item.requires_python))
+        self.is_top_pkg.append(item.is_top_pkg)
+        self.upload_ts.append(float("nan") if item.upload_ts is None else item.upload_ts)
+        self.version_ordinal.append(ordinal)
+        return len(self.name) - 1
+
+    def __len__(self) -> int:
+        return len(self.name)
+
+    def name_version(self, row: int) -> str:
+        values = self.pool.values
+        return f"{values[self.name[row]]}@{values[self.version[row]]}"
+
+    def latest_ordinals(self) -> Dict[str, int]:
+        """包名 -> 已输出版本的最大序号。"""
+        latest: Dict[int, int] = {}
+        for name, ordinal in zip(self.name, self.version_ordinal):
+            if ordinal > latest.get(name, 0):
+                latest[name] = ordinal
+        return {self.pool.values[name]: ordinal for name, ordinal in latest.items()}
+
+    def iter_values(self) -> Iterator[Tuple]:
+        values = self.pool.values
+        for name, version, requires_python, is_top, ts, ordinal in zip(
+            self.name, self.version, self.requires_python, self.is_top_pkg, self.upload_ts, self.version_ordinal
+        ):
+            name, version, requires_python = values[name], values[version], values[requires_python]
+            yield (
+                f"{name}@{version}", name, version, requires_python, bool(is_top), None if ts != ts else ts,
+                version_key(version), ordinal, python_mask(requires_python),
             )
 
-            topics = obj.get("about_topics") or []
-            for t in topics:
-                t_norm = t.strip().lower()
-                if t_norm:
-                    repo_topics.append({"repo": full_name, "topic": t_norm})
-
-            req_text = obj.get("requirements") or ""
-            for raw in req_text.splitlines():
-                raw = raw.strip()
-                if not raw or raw.startswith("#"):
-                    continue
-                pkg, spec, marker = parse_requirement(raw)
-                if not pkg:
-                    continue
-                if pkg not in keep_packages:
-                    continue
-                repo_depends.append(
-                    {
-                        "repo": full_name,
-                        "pkg": pkg,
-                        "spec": spec,
-                        "marker": marker,
-                    }
+    def __iter__(self) -> Iterator[Dict]:
+        for row in self.iter_values():
+            yield dict(zip(self.fields, row))
+
+
+class EdgeTable:
+    """
+    依赖边的列式存储：src 为 VersionTable 行号，dest / spec / marker 为同一字符串池的 ID（均为 array('i')）；
+    src 的 name_version、spec_intervals 与 env_mask 在写出时算出。
+    """
+
+    fields = REQUIRES_FIELDS
+
+    def __init__(self, versions: VersionTable):
+        self.versions = versions
+        self.src = array("i")
+        self.dest = array("i")
+        self.spec = array("i")
+        self.marker = array("i")
+
+    def append(self, src: int, dest: str, spec: str, marker: str):
+        pool = self.versions.pool
+        self.src.append(src)
+        self.dest.append(pool.id(dest))
+        self.spec.append(pool.id(spec))
+        self.marker.append(pool.id(marker))
+
+    def __len__(self) -> int:
+        return len(self.src)
+
+    def iter_values(self) -> Iterator[Tuple]:
+        values = self.versions.pool.values
+        last_src, src_name = -1, ""
+        for src, dest, spec, marker in zip(self.src, self.dest, self.spec, self.marker):
+            if src != last_src:  # 同一版本的边相邻，name_version 只拼一次
+                last_src, src_name = src, self.versions.name_version(src)
+            spec, marker = values[spec], values[marker]
+            yield src_name, values[dest], spec, marker, encode_spec(spec), marker_mask(marker)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for row in self.iter_values():
+            yield dict(zip(self.fields, row))
+
+
+# ----------- 增量模式 ----------- #
+
+def _manifest_entries(
+    selected: Dict[str, List[Tuple]], ordinals: Optional[Dict[str, Dict[str, int]]] = None
+) -> Dict[str, List[Tuple]]:
+    """
+    已选条目的紧凑形式：包 -> [(name_version, version, upload_ts, 依赖包名元组, version_ordinal)]，按排序顺序。
+    ordinals 与 _select_versions 的含义相同。
+    """
+    result = {}
+    for pkg, entries in selected.items():
+        if ordinals is None:
+            pkg_ordinals = version_ordinals(item.version for _, _, item in entries)
+        else:
+            pkg_ordinals = ordinals[pkg]
+        result[pkg] = [
+            (item.name_version, item.version, item.upload_ts, item.dests(), pkg_ordinals[item.version])
+            for _, _, item in entries
+        ]
+    return result
+
+
+def _emitted_ordinals(emitted: Sequence[Tuple]) -> Dict[str, int]:
+    """manifest 中已输出版本的序号；旧版 manifest 的条目没有记序号，此时按这些版本稠密编号（与当时的输出一致）。"""
+    if all(len(entry) > 4 for entry in emitted):
+        return {entry[1]: entry[4] for entry in emitted}
+    return version_ordinals(entry[1] for entry in emitted)
+
+
+def _stable_ordinals(entries: List[Tuple], emitted: Dict[str, int]) -> Dict[str, int]:
+    """
+    合并后各版本的 version_ordinal：留下的旧版本沿用 emitted 中的序号（挤出最旧的版本不影响其余版本），
+    新版本都排在留下的旧版本之后时，从它们的最大序号往后稠密编号，于是只有新版本需要输出；
+    新版本插在旧版本之间（如给旧分支补发的版本）时才对整个窗口重新稠密编号。
+    """
+    kept = {item.version: emitted[item.version] for _, _, item in entries if item.seeded}
+    fresh = version_ordinals(item.version for _, _, item in entries if item.version not in kept)
+    top_key = max((version_key(version) for version in kept), default="")
+    if all(version_key(version) > top_key for version in fresh):
+        base = max(kept.values(), default=0)
+        kept.update((version, base + ordinal) for version, ordinal in fresh.items())
+        return kept
+    return version_ordinals(item.version for _, _, item in entries)
+
+
+def _seed_entries(pkg: str, emitted: Iterable[Tuple]) -> List[Tuple]:
+    """把 manifest 中 pkg 已输出的条目还原成堆条目；到达序号排在本次新行之前，键相同时旧条目优先。"""
+    entries = []
+    for idx, entry in enumerate(emitted):
+        version, upload_ts, dests = entry[1:4]
+        requires = tuple(value for dest in dests for value in (dest, "", ""))
+        item = _VersionItem(pkg, version, "", False, upload_ts, requires, seeded=True)
+        entries.append((_rank_key(upload_ts, version_key(version)), (-1, idx), item))
+    return entries
+
+
+def build_manifest(
+    top_set: Set[str],
+    keep_set: Set[str],
+    packages: Iterable[str],
+    selected: Dict[str, List[Tuple]],
+    latest: Dict[str, float],
+) -> Dict:
+    """
+    全量运行后的 manifest：已输出的包名、每包已输出的版本（含依赖包名，用于生成删除行）
+    以及每包见过的最大 upload_ts（水位）。增量运行据此只处理水位之后的新行。
+    """
+    return {
+        "top_n": TOP_N,
+        "keep_versions": KEEP_VERSIONS,
+        "closure_depth": CLOSURE_DEPTH,
+        "top": sorted(top_set),
+        "keep": sorted(keep_set),
+        "packages": list(packages),
+        "emitted": _manifest_entries(selected),
+        "watermarks": dict(latest),
+    }
+
+
+def load_manifest(path: Path) -> Dict:
+    if not path.exists():
+        raise SystemExit(f"未找到 {path}，请先全量运行一次 etl_flash.py")
+    with path.open("rb") as f:
+        return marshal.load(f)
+
+
+def save_manifest(path: Path, manifest: Dict):
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        marshal.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+def build_delta(
+    delta_path: Path, top_info: Dict[str, Dict], manifest: Dict, workers: int = PARSE_WORKERS
+) -> Tuple[Dict, Dict[str, List[Dict]]]:
+    """
+    读取只含新增行的 dump，与 manifest 中各包已输出的最新 KEEP_VERSIONS 个版本合并重选，
+    返回 (更新后的 manifest, 增量表名 -> 行)。被挤出的旧版本及其依赖边进 *_remove，新入选的进 *_add，
+    包的 latest_ordinal 变化时进 packages_update。version_ordinal 见 _stable_ordinals：通常只有新版本需要编号，
+    只有新版本插在旧版本之间时，保留的旧版本序号才会变化并进 package_versions_update。
+    对 manifest 中已有的包，版本与依赖边与对“旧 dump + 新增行”全量重建一致；序号的数值可能不同（不再从 1 起），
+    但包内顺序与最新版本一致。
+    新进入 keep 集合的包只能看到新增行里的版本，需要其完整历史时请全量重建。
+    """
+    top_set = set(top_info.keys())
+    config = (manifest["top_n"], manifest["keep_versions"], manifest.get("closure_depth", 1), set(manifest["top"]))
+    if config != (TOP_N, KEEP_VERSIONS, CLOSURE_DEPTH, top_set):
+        raise SystemExit("下载榜或 TOP_N/KEEP_VERSIONS/CLOSURE_DEPTH 与 manifest 不一致，请全量重建")
+
+    # 完整闭包时已保留的包都是闭包成员，其新版本引入的依赖也应保留；有跳数上限时只能从 top 包重新数跳数
+    roots = set(manifest["keep"]) if CLOSURE_DEPTH is None else top_set
+    keep_set = set(manifest["keep"]) | first_pass_collect_keep(delta_path, roots, workers)
+    packages, fresh, latest = second_pass_build(delta_path, keep_set, top_info, workers, manifest["watermarks"])
+
+    emitted = dict(manifest["emitted"])
+    known = set(manifest["packages"])
+    delta: Dict[str, List[Dict]] = {name: [] for name in DELTA_FIELDS}
+    delta["packages_add"] = [row for name, row in packages.items() if name not in known]
+    for pkg, entries in fresh.items():
+        if not entries:
+            continue
+        seed = _seed_entries(pkg, emitted.get(pkg, ()))
+        merged = _NewestK(KEEP_VERSIONS, seed + entries).sorted()
+        before = _emitted_ordinals(emitted.get(pkg, ()))
+        after = _stable_ordinals(merged, before)
+        kept = {item.name_version for _, _, item in merged}
+        for _, _, item in seed:
+            if item.name_version in kept:
+                continue
+            delta["package_versions_remove"].append({"name_version": item.name_version})
+            for dest in item.dests():
+                delta["package_version_requires_remove"].append({"src": item.name_version, "dest": dest})
+        versions_add, edges_add = _select_versions({pkg: merged}, {pkg: after})
+        delta["package_versions_add"].extend(versions_add)
+        delta["package_version_requires_add"].extend(edges_add)
+
+        for _, _, item in merged:  # 只有新版本插在旧版本之间、整个窗口重新编号时才会有
+            if item.seeded and after[item.version] != before[item.version]:
+                delta["package_versions_update"].append(
+                    {"name_version": item.name_version, "version_ordinal": after[item.version]}
                 )
+        latest_ordinal = max(after.values())
+        if pkg not in known:
+            packages[pkg]["latest_ordinal"] = latest_ordinal
+        elif latest_ordinal != max(before.values(), default=None):
+            delta["packages_update"].append({"name": pkg, "latest_ordinal": latest_ordinal})
+        emitted[pkg] = _manifest_entries({pkg: merged}, {pkg: after})[pkg]
+
+    watermarks = dict(manifest["watermarks"])
+    for pkg, ts in latest.items():
+        watermarks[pkg] = max(ts, watermarks.get(pkg, ts))
+    updated = dict(
+        manifest,
+        keep=sorted(keep_set),
+        packages=manifest["packages"] + [row["name"] for row in delta["packages_add"]],
+        emitted=emitted,
+        watermarks=watermarks,
+    )
+    return updated, delta
 
-    return repos, repo_depends, repo_topics
 
+def _load_manifest_stage(ctx: Dict) -> Dict[str, int]:
+    ctx["manifest"] = load_manifest(ctx["out_dir"] / MANIFEST_NAME)
+    return {"packages": len(ctx["manifest"]["packages"])}
 
-def write_csv(path: Path, rows: Iterable[Dict]):
-    rows = list(rows)
-    if not rows:
-        return
-    fieldnames = list(rows[0].keys())
-    with path.open("w", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(rows)
 
+def _delta_stage(ctx: Dict) -> Dict[str, int]:
+    ctx["manifest"], ctx["delta"] = build_delta(ctx["delta_path"], ctx["top_info"], ctx["manifest"], ctx["workers"])
+    return {name: len(rows) for name, rows in ctx["delta"].items()}
 
-def main():
-    ensure_out_dir()
-    print(f"使用下载榜前 {TOP_N} 的包构建精简图谱...")
 
-    print("[1/6] 读取下载榜...")
-    top_info = load_top_packages()
-    top_set = set(top_info.keys())
+def _write_delta_stage(ctx: Dict) -> None:
+    """增量 CSV 写到 out/delta/，再更新 manifest。"""
+    delta_dir = ctx["out_dir"] / "delta"
+    shutil.rmtree(delta_dir, ignore_errors=True)
+    delta_dir.mkdir(parents=True)
+    for name, fields in DELTA_FIELDS.items():
+        write_csv(delta_dir / f"{name}.csv", ctx["delta"][name], fields)
+    save_manifest(ctx["out_dir"] / MANIFEST_NAME, ctx["manifest"])
 
-    google_path = DATA_DIR / "google_sql_with_time_pkg.json"
-    print("[2/6] 扫描依赖（首遍）...")
-    keep_set = first_pass_collect_keep(google_path, top_set)
-    print(f"    保留包数量：{len(keep_set)}")
 
-    print("[3/6] 生成包/版本/依赖...")
-    packages, versions, requires_edges = second_pass_build(google_path, keep_set, top_info)
-    print(f"    包数：{len(packages)}, 版本数：{len(versions)}, 依赖边：{len(requires_edges)}")
+# ----------- 主流程 ----------- #
 
-    print("[4/6] 解析 Repo requirements...")
-    repos, repo_depends, repo_topics = parse_repo_requirements(set(packages.keys()))
-    print(
-        f"    仓库数：{len(repos)}, 依赖边：{len(repo_depends)}, 主题关系：{len(repo_topics)}"
+def _keep_stage(ctx: Dict) -> Dict[str, int]:
+    ctx["keep_set"] = first_pass_collect_keep(ctx["dump_path"], ctx["top_set"], ctx["workers"])
+    return {"keep": len(ctx["keep_set"])}
+
+
+def _select_stage(ctx: Dict) -> Dict[str, int]:
+    """每包保留最新 KEEP_VERSIONS 个合法版本，生成版本与依赖边行。"""
+    packages, selected, latest = second_pass_build(ctx["dump_path"], ctx["keep_set"], ctx["top_info"], ctx["workers"])
+    versions, requires_edges = _select_versions(selected)
+    _set_latest_ordinals(packages, versions)
+    ctx.update(packages=packages, selected=selected, latest=latest)
+    feed_tables(
+        ctx,
+        {
+            "packages": (PACKAGE_FIELDS, packages.values()),
+            "package_versions": (VERSION_FIELDS, versions),
+            "package_version_requires": (REQUIRES_FIELDS, requires_edges),
+        },
+    )
+    return {
+        "packages": len(packages),
+        "package_versions": len(versions),
+        "package_version_requires": len(requires_edges),
+    }
+
+
+def _manifest_stage(ctx: Dict) -> None:
+    manifest = build_manifest(ctx["top_set"], ctx["keep_set"], ctx["packages"], ctx["selected"], ctx["latest"])
+    save_manifest(ctx["out_dir"] / MANIFEST_NAME, manifest)
+
+
+def build_pipeline(delta: bool = False, direct: bool = False) -> Pipeline:
+    """
+    etl_flash.py 预设：下载榜前 TOP_N → 依赖闭包 → 每包最新 KEEP_VERSIONS 个版本 → CSV / Parquet / bulk + manifest；
+    delta 时为增量预设：manifest + 新增行 → out/delta/ 下的增量 CSV；direct 时不写 CSV，等待直连导入完成。
+    """
+    load_top = Stage("读取下载榜", functools.partial(load_top_stage, top_n=TOP_N))
+    if delta:
+        return Pipeline(
+            [
+                load_top,
+                Stage("读取 manifest", _load_manifest_stage),
+                Stage("扫描新增行并与已输出版本合并", _delta_stage),
+                Stage("写出增量 CSV 并更新 manifest", _write_delta_stage),
+            ]
+        )
+    return Pipeline(
+        [
+            load_top,
+            Stage("扫描依赖（首遍）", _keep_stage),
+            Stage("生成包/版本/依赖", _select_stage),
+            Stage("解析 Repo requirements", repo_stage),
+            Stage("等待导入 Neo4j 完成" if direct else "写出 CSV", emit_stage),
+            Stage("写出 manifest", _manifest_stage),
+        ]
     )
 
-    print("[5/6] 写出 CSV...")
-    write_csv(OUT_DIR / "packages.csv", packages.values())
-    write_csv(OUT_DIR / "package_versions.csv", versions)
-    write_csv(OUT_DIR / "package_version_requires.csv", requires_edges)
-    write_csv(OUT_DIR / "repos.csv", repos)
-    write_csv(OUT_DIR / "repo_depends.csv", repo_depends)
-    write_csv(OUT_DIR / "topics.csv", [{"name": t["topic"]} for t in repo_topics])
-    write_csv(OUT_DIR / "repo_topics.csv", repo_topics)
 
-    print("[6/6] 完成。")
+def main(argv: Optional[List[str]] = None) -> List[Dict]:
+    """运行全量或增量预设，返回各阶段的耗时与行数。"""
+    parser = argparse.ArgumentParser(description="生成精简版知识图谱 CSV")
+    parser.add_argument("--delta", type=Path, help="增量模式：只读取这份新增行 dump，输出增量 CSV 到 out/delta/")
+    parser.add_argument("--bulk", action="store_true", help="另外生成 neo4j-admin database import 文件到 out/bulk/")
+    parser.add_argument(
+        "--profile", metavar="STAGES", help="在 cProfile 下运行选中的阶段：all，或逗号分隔的阶段序号/阶段名片段"
+    )
+    parser.add_argument(
+        "--direct",
+        choices=["neo4j", "memory"],
+        help="直连模式：不写 CSV，边解析边导入；neo4j 为 import_flash.py 中配置的库，memory 为内存替身（校验导入顺序）",
+    )
+    args = parser.parse_args(argv)
+    if args.direct and (args.bulk or args.delta):
+        parser.error("--bulk / --delta 需要 CSV 输出，不能与 --direct 同时使用")
+    ensure_out_dir()
+    ctx = {
+        "data_dir": DATA_DIR,
+        "out_dir": OUT_DIR,
+        "work_dir": OUT_DIR / "work",  # repo 分片的 part 文件
+        "workers": PARSE_WORKERS,
+        "bulk": args.bulk,
+        "metrics_path": OUT_DIR / "etl_metrics.json",
+        "profile": args.profile,
+        "dump_path": resolve_input(DATA_DIR / "google_sql_with_time_pkg.json"),
+        "repo_paths": [resolve_input(DATA_DIR / LEGACY_REPO_FILE)],
+        "delta_path": args.delta,
+        "graph": GraphImporter(make_sink(args.direct, "import_flash")) if args.direct else None,
+    }
+    if args.delta:
+        print(f"增量模式：{args.delta}")
+    else:
+        print(f"使用下载榜前 {TOP_N} 的包构建精简图谱...")
+    reports = build_pipeline(delta=bool(args.delta), direct=bool(args.direct)).run(ctx)
+    print(f"    {format_parse_cache_stats()}")
+    shutil.rmtree(ctx["work_dir"], ignore_errors=True)
+    print("完成。")
+    return reports
 
 
 if __name__ == "__main__":
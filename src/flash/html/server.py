@@ -27,12 +27,22 @@ from packaging.specifiers import SpecifierSet
 from packaging.version import Version, InvalidVersion
 from neo4j import GraphDatabase
 
-# 兼容直接运行，加入上级路径以导入 downstream.tasks
+# 兼容直接运行，加入上级路径以导入 downstream.tasks，加入 src 路径以导入 env_markers
 BASE_DIR = Path(__file__).resolve().parents[1]
+SRC_DIR = Path(__file__).resolve().parents[2]
 if str(BASE_DIR) not in sys.path:
     sys.path.insert(0, str(BASE_DIR))
-
-from downstream.tasks import KGClient as TasksKGClient, task3_install_multi_with_upgrade, normalize_name as norm_task
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+from downstream.tasks import (
+    TARGET_PLATFORM,
+    TARGET_PYTHON,
+    KGClient as TasksKGClient,
+    normalize_name as norm_task,
+    task3_install_multi_with_upgrade,
+)
+from env_markers import marker_active
 
 # ------- Neo4j 连接 -------
 NEO4J_URI = ""
@@ -69,28 +79,50 @@ class KG:
     def versions(self, name: str) -> List[str]:
         q = """
         MATCH (p:Package {name:$name})-[:HAS_VERSION]->(v:PackageVersion)
-        RETURN v.version AS ver
+        RETURN v.version AS ver, v.version_ordinal AS ord
+        ORDER BY ord
         """
         try:
             recs = self._run(q, {"name": name})
             vers = [r["ver"] for r in recs]
-            vers_sorted = sorted(vers, key=lambda v: Version(v) if is_valid(v) else Version("0"))
-            return vers_sorted
+            if any(r["ord"] is None for r in recs):  # 旧图谱没有 version_ordinal，退回 Python 侧排序
+                vers = sorted(vers, key=lambda v: Version(v) if is_valid(v) else Version("0"))
+            return vers
         except Exception:
             return []
 
     def deps(self, name: str, version: str) -> List[Tuple[str, str, str]]:
+        """
+        在目标环境（downstream.tasks 的 TARGET_PYTHON / TARGET_PLATFORM）下生效的依赖 (dep, spec, marker)；
+        未设置目标环境（默认）时沿用原规则，只跳过含 extra == 的依赖。
+        """
         q = """
         MATCH (v:PackageVersion {name_version:$nv})-[r:REQUIRES]->(d:Package)
-        RETURN d.name AS dep, r.spec AS spec, r.marker AS marker
+        RETURN d.name AS dep, r.spec AS spec, r.marker AS marker, r.env_mask AS env_mask
         """
         try:
             recs = self._run(q, {"nv": f"{name}@{version}"})
-            return [(r["dep"], r["spec"] or "", r["marker"] or "") for r in recs]
+            return [
+                (r["dep"], r["spec"] or "", r["marker"] or "")
+                for r in recs
+                if marker_active(r["marker"] or "", r["env_mask"], TARGET_PYTHON, TARGET_PLATFORM)
+            ]
         except Exception:
             return []
 
     def latest(self, name: str) -> Optional[str]:
+        q = """
+        MATCH (p:Package {name:$name})-[:HAS_VERSION]->(v:PackageVersion)
+        WHERE v.version_ordinal = p.latest_ordinal
+        RETURN v.version AS ver
+        LIMIT 1
+        """
+        try:
+            recs = self._run(q, {"name": name})
+            if recs:
+                return recs[0]["ver"]
+        except Exception:
+            pass
         vs = self.versions(name)
         return vs[-1] if vs else None  # 升序，取最后 = 最新
 
@@ -176,8 +208,6 @@ def build_graph(packages: List[PackageInput]) -> Dict:
         visited.add(key)
         deps = kg.deps(name, ver)
         for dep, spec, marker in deps:
-            if marker and "extra ==" in marker:
-                continue
             depn = normalize(dep)
             if depn not in nodes:
                 nodes[depn] = {"id": depn, "label": depn}
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ETL 直连导入：不经七张输出 CSV，各阶段把行按批（UNWIND）直接交给导入线程池。
+
+- GRAPH_TABLES：七张表的 UNWIND Cypher 与依赖关系，import_to_neo4j.py / flash/import_flash.py 与直连模式共用；
+- GraphImporter(sink)：每张表一个有界队列（QUEUE_BATCHES 批），队列满时生产者阻塞（反压）；
+  WORKERS 个线程在可执行的批中取最早送出的一批执行（各表公平推进）。
+  节点先于关系由两种依赖保证：
+    after   —— 这些表关闭（close_table）且已提交的批全部完成后，本表的批才执行（如 REQUIRES 要等全部 Package）；
+    follows —— 本表每批只等它送出时这些表已送出的批完成（如 Repo->Topic 只等之前写过的 Repo、Topic），
+               要求引用的节点行先于关系行 put，且由同一线程写入。
+  feed() 在后台线程导入已成形的表，与后续阶段（如解析 repo requirements）重叠；close() 等全部批完成并返回各表行数；
+- Neo4jSink：连接 Neo4j（需要 neo4j 驱动），开始前清空数据库并建约束；
+- MemorySink：内存替身，不连数据库，记录各表行数与节点键，统计 MATCH 落空的关系行，
+  并区分其中端点在导入结束时已存在的行（即违反了节点先于关系的顺序），用于本地验证。
+"""
+
+import csv
+import importlib
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+try:  # 可选依赖：只有直连 Neo4j 时需要
+    from neo4j import GraphDatabase  # type: ignore
+except Exception:  # pragma: no cover
+    GraphDatabase = None
+
+BATCH = 500  # 每批行数
+WORKERS = 4  # 导入线程数
+QUEUE_BATCHES = 8  # 每张表最多排队的批数，满了生产者阻塞
+
+CONSTRAINTS = [
+    "CREATE CONSTRAINT pkg IF NOT EXISTS FOR (p:Package) REQUIRE p.name IS UNIQUE",
+    "CREATE CONSTRAINT pv IF NOT EXISTS FOR (v:PackageVersion) REQUIRE v.name_version IS UNIQUE",
+    "CREATE CONSTRAINT repo IF NOT EXISTS FOR (r:Repo) REQUIRE r.full_name IS UNIQUE",
+    "CREATE CONSTRAINT topic IF NOT EXISTS FOR (t:Topic) REQUIRE t.name IS UNIQUE",
+]
+
+# 表名 -> query；merges / matches 为查询 MERGE / MATCH 的节点（(节点表, 行中的键字段)），供 MemorySink 校验
+GRAPH_TABLES: Dict[str, Dict] = {
+    "packages": {
+        "query": """
+    UNWIND $rows AS row
+    MERGE (p:Package {name: row.name})
+    SET p.downloads = toInteger(row.downloads),
+        p.rank = toInteger(row.rank),
+        p.is_top = coalesce(toBoolean(row.is_top), false),
+        p.noise = coalesce(toBoolean(row.noise), false),
+        p.latest_ordinal = toInteger(row.latest_ordinal)
+    """,
+        "merges": (("packages", "name"),),
+        "matches": (),
+        "after": (),
+        "follows": (),
+    },
+    "repos": {
+        "query": """
+    UNWIND $rows AS row
+    MERGE (r:Repo {full_name: row.full_name})
+    SET r.stars = toInteger(row.stars),
+        r.about = row.about
+    """,
+        "merges": (("repos", "full_name"),),
+        "matches": (),
+        "after": (),
+        "follows": (),
+    },
+    "topics": {
+        "query": """
+    UNWIND $rows AS row
+    MERGE (t:Topic {name: row.name})
+    """,
+        "merges": (("topics", "name"),),
+        "matches": (),
+        "after": (),
+        "follows": (),
+    },
+    "package_versions": {
+        "query": """
+    UNWIND $rows AS row
+    MERGE (p:Package {name: row.name})
+    MERGE (v:PackageVersion {name_version: row.name_version})
+    SET v.version = row.version,
+        v.requires_python = row.requires_python,
+        v.is_top_pkg = coalesce(toBoolean(row.is_top_pkg), false),
+        v.version_key = row.version_key,
+        v.version_ordinal = toInteger(row.version_ordinal),
+        v.python_mask = toInteger(row.python_mask)
+    MERGE (p)-[:HAS_VERSION]->(v)
+    """,
+        "merges": (("packages", "name"), ("package_versions", "name_version")),
+        "matches": (),
+        "after": ("packages",),  # 避免与 Package 的 MERGE 并发
+        "follows": (),
+    },
+    "package_version_requires": {
+        "query": """
+    UNWIND $rows AS row
+    MATCH (src:PackageVersion {name_version: row.src})
+    MATCH (dst:Package {name: row.dest})
+    MERGE (src)-[r:REQUIRES]->(dst)
+    SET r.spec = row.spec,
+        r.marker = row.marker,
+        r.spec_intervals = row.spec_intervals,
+        r.env_mask = toInteger(row.env_mask)
+    """,
+        "merges": (),
+        "matches": (("package_versions", "src"), ("packages", "dest")),
+        "after": ("packages", "package_versions"),
+        "follows": (),
+    },
+    "repo_depends": {
+        "query": """
+    UNWIND $rows AS row
+    MATCH (r:Repo {full_name: row.repo})
+    MATCH (p:Package {name: row.pkg})
+    MERGE (r)-[d:DEPENDS_ON]->(p)
+    SET d.spec = row.spec,
+        d.marker = row.marker,
+        d.spec_intervals = row.spec_intervals,
+        d.env_mask = toInteger(row.env_mask)
+    """,
+        "merges": (),
+        "matches": (("repos", "repo"), ("packages", "pkg")),
+        "after": ("packages",),
+        "follows": ("repos",),
+    },
+    "repo_topics": {
+        "query": """
+    UNWIND $rows AS row
+    MATCH (r:Repo {full_name: row.repo})
+    MATCH (t:Topic {name: row.topic})
+    MERGE (r)-[:TAGGED_AS]->(t)
+    """,
+        "merges": (),
+        "matches": (("repos", "repo"), ("topics", "topic")),
+        "after": (),
+        "follows": ("repos", "topics"),
+    },
+}
+
+
+# ----------- 导入线程池 ----------- #
+
+class GraphImporter:
+    """
+    把各表的行攒成 batch 行一批，放入该表的有界队列，由 workers 个线程按 GRAPH_TABLES 的依赖交给 sink 执行。
+    同一张表只能由一个线程写入；任一批失败后，后续 put / close 抛出该异常。
+    """
+
+    def __init__(self, sink, batch: int = BATCH, workers: int = WORKERS, queue_batches: int = QUEUE_BATCHES):
+        self.sink = sink
+        self.batch = batch
+        self.queue_batches = queue_batches
+        self.counts = {name: 0 for name in GRAPH_TABLES}  # 已导入行数
+        self.blocked_seconds = 0.0  # 生产者等队列空位的累计时间
+        self._buffers: Dict[str, List[Dict]] = {name: [] for name in GRAPH_TABLES}
+        self._pending: Dict[str, deque] = {name: deque() for name in GRAPH_TABLES}  # (全局票号, 序号, 行, follows 水位)
+        self._tickets = 0
+        self._submitted = {name: 0 for name in GRAPH_TABLES}
+        self._done = {name: 0 for name in GRAPH_TABLES}  # 序号连续完成到的位置
+        self._finished: Dict[str, set] = {name: set() for name in GRAPH_TABLES}  # 乱序完成、尚未连上的序号
+        self._closed: set = set()
+        self._error: Optional[BaseException] = None
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._feeders: List[threading.Thread] = []
+        sink.prepare()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"graph-import-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._workers:
+            thread.start()
+
+    def put(self, table: str, row: Dict):
+        buf = self._buffers[table]
+        buf.append(row)
+        if len(buf) >= self.batch:
+            self._submit(table)
+
+    def put_many(self, table: str, rows: Iterable[Dict]):
+        batch = self.batch
+        for row in rows:
+            buf = self._buffers[table]
+            buf.append(row)
+            if len(buf) >= batch:
+                self._submit(table)
+
+    def close_table(self, table: str):
+        """送出剩余的行并标记本表写完（依赖它的 after 表从此可以开始）。"""
+        self._submit(table)
+        with self._cond:
+            self._closed.add(table)
+            self._cond.notify_all()
+
+    def writer(self, table: str, fieldnames: Sequence[str]) -> "TableWriter":
+        return TableWriter(self, table, fieldnames)
+
+    def feed(self, tables: Dict[str, Iterable[Dict]]):
+        """在后台线程按顺序导入并关闭这些表，调用方继续执行后续阶段。"""
+
+        def run():
+            try:
+                for name, rows in tables.items():
+                    self.put_many(name, rows)
+                    self.close_table(name)
+            except BaseException as e:
+                self._fail(e)
+
+        thread = threading.Thread(target=run, name="graph-feed", daemon=True)
+        thread.start()
+        self._feeders.append(thread)
+
+    def close(self) -> Dict[str, int]:
+        """关闭尚未关闭的表，等全部批完成后停止线程，返回各表导入行数。"""
+        try:
+            for thread in self._feeders:
+                thread.join()
+            self._raise_error()
+            for name in GRAPH_TABLES:
+                if name not in self._closed:
+                    self.close_table(name)
+            with self._cond:
+                while self._error is None and any(self._done[t] < self._submitted[t] for t in GRAPH_TABLES):
+                    self._cond.wait()
+                self._stopping = True
+                self._cond.notify_all()
+            for thread in self._workers:
+                thread.join()
+            self._raise_error()
+        finally:
+            self.sink.close()
+        return dict(self.counts)
+
+    def _submit(self, table: str):
+        rows = self._buffers[table]
+        if not rows:
+            return
+        self._buffers[table] = []
+        follows = GRAPH_TABLES[table]["follows"]
+        for dep in follows:
+            self._submit(dep)  # 本批引用的节点行可能还在缓冲里
+        t0 = time.perf_counter()
+        with self._cond:
+            while len(self._pending[table]) >= self.queue_batches and self._error is None:
+                self._cond.wait()
+            self._raise_error()
+            marks = tuple(self._submitted[dep] for dep in follows)
+            self._pending[table].append((self._tickets, self._submitted[table], rows, marks))
+            self._tickets += 1
+            self._submitted[table] += 1
+            self.blocked_seconds += time.perf_counter() - t0
+            self._cond.notify_all()
+
+    def _ready(self, table: str, marks: tuple) -> bool:
+        spec = GRAPH_TABLES[table]
+        for dep in spec["after"]:
+            if dep not in self._closed or self._done[dep] < self._submitted[dep]:
+                return False
+        return all(self._done[dep] >= mark for dep, mark in zip(spec["follows"], marks))
+
+    def _next_batch(self):
+        """在队首可执行的表中取票号最小的一批（同表的 follows 水位单调，只需看队首）。"""
+        best = None
+        for table, pending in self._pending.items():
+            if pending and (best is None or pending[0][0] < self._pending[best][0][0]):
+                if self._ready(table, pending[0][3]):
+                    best = table
+        if best is None:
+            return None
+        _, seq, rows, _ = self._pending[best].popleft()
+        return best, seq, rows
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = None
+                while self._error is None:
+                    job = self._next_batch()
+                    if job is not None or self._stopping:
+                        break
+                    self._cond.wait()
+                if job is None:
+                    return
+                self._cond.notify_all()  # 队列有空位了
+            table, seq, rows = job
+            try:
+                self.sink.run(table, GRAPH_TABLES[table]["query"], rows)
+            except BaseException as e:
+                self._fail(e)
+                return
+            with self._cond:
+                finished = self._finished[table]
+                finished.add(seq)
+                while self._done[table] in finished:
+                    finished.remove(self._done[table])
+                    self._done[table] += 1
+                self.counts[table] += len(rows)
+                self._cond.notify_all()
+
+    def _fail(self, error: BaseException):
+        with self._cond:
+            if self._error is None:
+                self._error = error
+            self._cond.notify_all()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+
+class TableWriter:
+    """与 CsvStreamWriter 接口一致（write / append_part / count），行直接交给 GraphImporter；退出时关闭该表。"""
+
+    def __init__(self, importer: GraphImporter, table: str, fieldnames: Sequence[str]):
+        self.importer = importer
+        self.table = table
+        self.fieldnames = list(fieldnames)
+        self.count = 0
+
+    def write(self, row: Dict):
+        self.importer.put(self.table, row)
+        self.count += 1
+
+    def append_part(self, part_path: Path, rows: int):
+        """逐行读取无表头的 part 文件交给导入线程，rows 为其中的行数。"""
+        with part_path.open("r", encoding="utf-8", newline="") as part:
+            self.importer.put_many(self.table, (dict(zip(self.fieldnames, row)) for row in csv.reader(part)))
+        self.count += rows
+
+    def close(self):
+        self.importer.close_table(self.table)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ----------- 导入目标 ----------- #
+
+class Neo4jSink:
+    """通过驱动逐批执行 UNWIND；prepare 时清空数据库（每批 1000 个节点）并建唯一约束。"""
+
+    def __init__(self, uri: str, username: str, password: str, database: str, attempts: int = 5):
+        if GraphDatabase is None:
+            raise SystemExit("直连 Neo4j 需要 neo4j 驱动：pip install neo4j")
+        self.driver = GraphDatabase.driver(
+            uri, auth=(username, password), connection_timeout=30, max_connection_lifetime=300
+        )
+        self.database = database
+        self.attempts = attempts
+
+    def execute(self, query: str, params: Optional[Dict] = None):
+        """带重试的 execute_query，避免偶发连接断开。"""
+        params = params or {}
+        delay = 2
+        for i in range(self.attempts):
+            try:
+                return self.driver.execute_query(query, **params, database_=self.database)
+            except Exception as e:
+                if i == self.attempts - 1:
+                    raise
+                print(f"  重试 {i+1}/{self.attempts-1} ... ({e})")
+                time.sleep(delay)
+                delay *= 1.5
+
+    def prepare(self):
+        self.driver.verify_connectivity()
+        print("清空数据库 ...")
+        while True:
+            res = self.execute("MATCH (n) WITH n LIMIT 1000 DETACH DELETE n RETURN count(n) AS c")
+            if not res.records or res.records[0]["c"] == 0:
+                break
+        print("创建约束 ...")
+        for query in CONSTRAINTS:
+            self.execute(query)
+
+    def run(self, table: str, query: str, rows: List[Dict]):
+        self.execute(query, {"rows": rows})
+
+    def close(self):
+        self.driver.close()
+
+    def summary(self) -> str:
+        return f"已导入 Neo4j 数据库 {self.database}"
+
+
+class MemorySink:
+    """
+    内存替身：按 GRAPH_TABLES 的 merges / matches 维护各节点表的键集合，不执行 Cypher。
+    MATCH 落空的关系行（真实数据库里会被丢弃）记入 missing；导入结束时端点已存在的落空行计为顺序错误。
+    keep_rows 时另按表保存收到的全部行，便于与 CSV 输出逐行对比。
+    """
+
+    def __init__(self, keep_rows: bool = False):
+        self.keys: Dict[str, set] = {name: set() for name in GRAPH_TABLES}
+        self.rows: Optional[Dict[str, List[Dict]]] = {name: [] for name in GRAPH_TABLES} if keep_rows else None
+        self.missing: Dict[str, List[Dict]] = {name: [] for name in GRAPH_TABLES}
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def prepare(self):
+        pass
+
+    def run(self, table: str, query: str, rows: List[Dict]):
+        spec = GRAPH_TABLES[table]
+        with self._lock:
+            self.batches += 1
+            for row in rows:
+                if any(row[field] not in self.keys[node] for node, field in spec["matches"]):
+                    self.missing[table].append(row)
+                    continue
+                for node, field in spec["merges"]:
+                    self.keys[node].add(row[field])
+            if self.rows is not None:
+                self.rows[table].extend(rows)
+
+    def close(self):
+        pass
+
+    def out_of_order(self) -> Dict[str, int]:
+        """落空时端点缺失、导入结束时端点已存在的关系行数（应全为 0）。"""
+        return {
+            table: sum(
+                all(row[field] in self.keys[node] for node, field in GRAPH_TABLES[table]["matches"]) for row in rows
+            )
+            for table, rows in self.missing.items()
+            if rows
+        }
+
+    def summary(self) -> str:
+        missing = {table: len(rows) for table, rows in self.missing.items() if rows}
+        late = {table: n for table, n in self.out_of_order().items() if n}
+        return (
+            f"内存替身：{self.batches} 批，节点 "
+            + "，".join(f"{name} {len(keys)}" for name, keys in self.keys.items() if keys)
+            + f"；MATCH 落空 {missing or 0}，顺序错误 {late or 0}"
+        )
+
+
+def make_sink(kind: str, config_module: str):
+    """kind 为 "neo4j"（连接配置取自 config_module 的 NEO4J_* 常量，即对应的导入脚本）或 "memory"。"""
+    if kind == "memory":
+        return MemorySink()
+    config = importlib.import_module(config_module)
+    return Neo4jSink(config.NEO4J_URI, config.NEO4J_USERNAME, config.NEO4J_PASSWORD, config.NEO4J_DATABASE)
@@ -10,10 +10,10 @@
 
 注意：
 - 使用 Aura 云库，不支持本地 LOAD CSV，因此通过驱动逐批 UNWIND 上传。
-- 默认使用 ./out/ 目录下的七个 CSV（由 etl.py 生成）。
+- 默认使用 ./out/ 目录下的七张表（由 etl.py 生成）；有同名 .parquet 且装了 pyarrow 时优先读取。
+- Cypher 与约束取自 graph_stream.py（与 etl.py --direct neo4j 的直连模式共用，后者不落 CSV、边解析边导入）。
 """
 
-import csv
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
@@ -23,6 +23,9 @@ from typing import Dict, Iterable, List, Sequence
 from neo4j import GraphDatabase
 from tqdm.auto import tqdm
 
+from etl_common import read_table
+from graph_stream import CONSTRAINTS, GRAPH_TABLES
+
 ROOT = Path(__file__).resolve().parent
 OUT_DIR = ROOT / "out"
 
@@ -38,12 +41,6 @@ WORKERS = 4  # 并行线程数
 
 # ----------- 工具 ----------- #
 
-def read_csv_dicts(path: Path) -> List[Dict[str, str]]:
-    with path.open("r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        return [row for row in reader]
-
-
 def chunked(seq: Sequence[Dict], size: int) -> Iterable[List[Dict]]:
     for i in range(0, len(seq), size):
         yield seq[i : i + size]
@@ -86,13 +83,7 @@ def clear_database(driver):
 
 def create_constraints(driver):
     print("创建约束 ...")
-    queries = [
-        "CREATE CONSTRAINT pkg IF NOT EXISTS FOR (p:Package) REQUIRE p.name IS UNIQUE",
-        "CREATE CONSTRAINT pv IF NOT EXISTS FOR (v:PackageVersion) REQUIRE v.name_version IS UNIQUE",
-        "CREATE CONSTRAINT repo IF NOT EXISTS FOR (r:Repo) REQUIRE r.full_name IS UNIQUE",
-        "CREATE CONSTRAINT topic IF NOT EXISTS FOR (t:Topic) REQUIRE t.name IS UNIQUE",
-    ]
-    for q in queries:
+    for q in CONSTRAINTS:
         execute_query_retry(driver, q)
 
 
@@ -112,87 +103,38 @@ def execute_query_retry(driver, query: str, params: Dict = None, attempts: int =
 
 
 def import_packages(driver):
-    rows = read_csv_dicts(OUT_DIR / "packages.csv")
-    query = """
-    UNWIND $rows AS row
-    MERGE (p:Package {name: row.name})
-    SET p.downloads = toInteger(row.downloads),
-        p.rank = toInteger(row.rank),
-        p.is_top = row.is_top = 'True' OR row.is_top = 'true',
-        p.noise = row.noise = 'True' OR row.noise = 'true'
-    """
-    parallel_import(driver, query, rows, "导入 Package")
+    rows = read_table(OUT_DIR, "packages")
+    parallel_import(driver, GRAPH_TABLES["packages"]["query"], rows, "导入 Package")
 
 
 def import_package_versions(driver):
-    rows = read_csv_dicts(OUT_DIR / "package_versions.csv")
-    query = """
-    UNWIND $rows AS row
-    MERGE (p:Package {name: row.name})
-    MERGE (v:PackageVersion {name_version: row.name_version})
-    SET v.version = row.version,
-        v.requires_python = row.requires_python,
-        v.is_top_pkg = row.is_top_pkg = 'True' OR row.is_top_pkg = 'true'
-    MERGE (p)-[:HAS_VERSION]->(v)
-    """
-    parallel_import(driver, query, rows, "导入 PackageVersion")
+    rows = read_table(OUT_DIR, "package_versions")
+    parallel_import(driver, GRAPH_TABLES["package_versions"]["query"], rows, "导入 PackageVersion")
 
 
 def import_version_requires(driver):
-    rows = read_csv_dicts(OUT_DIR / "package_version_requires.csv")
-    query = """
-    UNWIND $rows AS row
-    MATCH (src:PackageVersion {name_version: row.src})
-    MATCH (dst:Package {name: row.dest})
-    MERGE (src)-[r:REQUIRES]->(dst)
-    SET r.spec = row.spec,
-        r.marker = row.marker
-    """
-    parallel_import(driver, query, rows, "导入 REQUIRES")
+    rows = read_table(OUT_DIR, "package_version_requires")
+    parallel_import(driver, GRAPH_TABLES["package_version_requires"]["query"], rows, "导入 REQUIRES")
 
 
 def import_repos(driver):
-    rows = read_csv_dicts(OUT_DIR / "repos.csv")
-    query = """
-    UNWIND $rows AS row
-    MERGE (r:Repo {full_name: row.full_name})
-    SET r.stars = toInteger(row.stars),
-        r.about = row.about
-    """
-    parallel_import(driver, query, rows, "导入 Repo")
+    rows = read_table(OUT_DIR, "repos")
+    parallel_import(driver, GRAPH_TABLES["repos"]["query"], rows, "导入 Repo")
 
 
 def import_repo_depends(driver):
-    rows = read_csv_dicts(OUT_DIR / "repo_depends.csv")
-    query = """
-    UNWIND $rows AS row
-    MATCH (r:Repo {full_name: row.repo})
-    MATCH (p:Package {name: row.pkg})
-    MERGE (r)-[d:DEPENDS_ON]->(p)
-    SET d.spec = row.spec,
-        d.marker = row.marker
-    """
-    parallel_import(driver, query, rows, "导入 Repo 依赖")
+    rows = read_table(OUT_DIR, "repo_depends")
+    parallel_import(driver, GRAPH_TABLES["repo_depends"]["query"], rows, "导入 Repo 依赖")
 
 
 def import_topics(driver):
-    rows = read_csv_dicts(OUT_DIR / "topics.csv")
-    query = """
-    UNWIND $rows AS row
-    MERGE (t:Topic {name: row.name})
-    """
-    parallel_import(driver, query, rows, "导入 Topic")
+    rows = read_table(OUT_DIR, "topics")
+    parallel_import(driver, GRAPH_TABLES["topics"]["query"], rows, "导入 Topic")
 
 
 def import_repo_topics(driver):
-    rows = read_csv_dicts(OUT_DIR / "repo_topics.csv")
-    query = """
-    UNWIND $rows AS row
-    MATCH (r:Repo {full_name: row.repo})
-    MATCH (t:Topic {name: row.topic})
-    MERGE (r)-[:TAGGED_AS]->(t)
-    """
-    parallel_import(driver, query, rows, "导入 Repo-Topic")
+    rows = read_table(OUT_DIR, "repo_topics")
+    parallel_import(driver, GRAPH_TABLES["repo_topics"]["query"], rows, "导入 Repo-Topic")
 
 
 def main():
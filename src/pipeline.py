@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+etl.py 与 flash/etl_flash.py 共用的流式流水线引擎。
+
+一次运行由一串阶段组成：
+    source → decode → filter（top-N / 依赖闭包）→ version-select（全部 / 最新 K 个）→ emit（CSV / Parquet / bulk）
+source / decode / filter 在每个分片内逐行融合执行（行不落地、先预过滤再解码），由各扫描阶段按分片调度；
+两个入口只是不同的预设：
+- etl.py：完整下载榜，保留全部版本，单遍 spill + 分片检查点（可 --resume）；
+- flash/etl_flash.py：下载榜前 TOP_N，每包只保留最新 KEEP_VERSIONS 个合法 PEP 440 版本，另存 manifest 供增量模式。
+
+- Stage(name, fn)：fn(ctx) 读写共享的 ctx（dict），返回本阶段产出的行数 {名称: 行数}；
+- Pipeline.run(ctx)：依次执行各阶段，自动记录每阶段的墙钟/CPU 时间（CPU 含已结束的解析子进程）、读入行数与字节数、
+  产出行数、峰值 RSS 与 requirement 解析缓存命中率，打印进度与汇总，报告存入 ctx["stage_reports"]；
+  ctx["metrics_path"] 非空时另把整次运行的报告写成 JSON（两个入口都写到 out/etl_metrics.json）；
+  ctx["profile"] 选中的阶段（"all"，或逗号分隔的阶段序号 / 阶段名片段）在 cProfile 下运行，
+  统计存到 out/profile/stage-<序号>.prof 并打印热点函数（只覆盖主进程，分析解析热点时可配合 PARSE_WORKERS = 1）；
+- 共用阶段：load_top_stage（读取下载榜）、repo_stage（仓库 requirements，按分片并行、按 full_name 去重）、
+  emit_stage（写出 ctx["tables"] 中的表，另存 Parquet，--bulk 时生成 neo4j-admin 导入文件）；
+- 直连模式（ctx["graph"] 为 graph_stream.GraphImporter）：不写七张 CSV，feed_tables 把已成形的表交给后台线程导入，
+  与后续阶段重叠，repo_stage 的行边合并边送入导入队列，emit_stage 只等导入完成。
+
+ctx 约定的键：data_dir、out_dir、work_dir、workers、bulk、metrics_path、profile、graph（输入）；top_info、top_set、keep_set、packages、
+tables（表名 -> (表头, 行)）由各阶段依次写入。
+"""
+
+import cProfile
+import csv
+import json
+import os
+import pstats
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+from etl_common import (
+    TABLE_COLUMNS,
+    UNKNOWN_END,
+    CsvStreamWriter,
+    input_stats,
+    iter_range_lines,
+    json_decoder,
+    normalize_name,
+    parse_cache_stats,
+    parse_requirement,
+    peak_rss_mb,
+    plan_ranges,
+    progress,
+    read_input_text,
+    resolve_input,
+    run_shards,
+    write_parquet_tables,
+)
+from bulk_export import write_bulk_import
+from graph_stream import TableWriter
+from env_markers import marker_mask
+from spec_intervals import encode_spec
+
+PACKAGE_FIELDS = ["name", "downloads", "rank", "is_top", "noise", "latest_ordinal"]
+REPO_FIELDS = ["full_name", "stars", "about"]
+REPO_DEPENDS_FIELDS = ["repo", "pkg", "spec", "marker", "spec_intervals", "env_mask"]
+TOPIC_FIELDS = ["name"]
+REPO_TOPIC_FIELDS = ["repo", "topic"]
+
+TOP_PACKAGES_FILE = "top_packages_by_downloads_10000.json"
+REPO_FILES = ["python_repos_requirements_more_info_1w1.jsonl", "python_repos_requirements_more_info_1w2.jsonl"]
+LEGACY_REPO_FILE = "python_repos_requirements_more_info.jsonl"  # 旧版单文件
+
+decode_repo_row = json_decoder("repo")
+decode_top_packages = json_decoder("top_packages")
+
+StageFn = Callable[[Dict], Optional[Dict[str, int]]]
+
+PROFILE_TOP = 25  # 每个被分析阶段打印的热点函数条数（按累计时间）
+
+
+# ----------- 引擎 ----------- #
+
+class Stage:
+    """流水线的一个阶段：fn(ctx) 读写 ctx，返回本阶段产出的行数 {名称: 行数}，没有可报告的行数时返回 None。"""
+
+    __slots__ = ("name", "fn")
+
+    def __init__(self, name: str, fn: StageFn):
+        self.name = name
+        self.fn = fn
+
+
+class Pipeline:
+    """按顺序执行各阶段，每个阶段打印 [i/n] 进度，并记录耗时、读入/产出行数、峰值 RSS 等指标。"""
+
+    def __init__(self, stages: Sequence[Stage]):
+        self.stages = list(stages)
+
+    def run(self, ctx: Dict) -> List[Dict]:
+        reports: List[Dict] = ctx.setdefault("stage_reports", [])
+        total = len(self.stages)
+        started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        run_before = _counters()
+        for i, stage in enumerate(self.stages, start=1):
+            print(f"[{i}/{total}] {stage.name}...")
+            before = _counters()
+            if _profile_selected(ctx.get("profile"), i, stage.name):
+                profile_path = ctx["out_dir"] / "profile" / f"stage-{i}.prof"
+                rows = _run_profiled(stage, ctx, profile_path) or {}
+            else:
+                profile_path = None
+                rows = stage.fn(ctx) or {}
+            report = _stage_report(stage.name, rows, before, _counters())
+            if profile_path is not None:
+                report["profile"] = str(profile_path)
+            reports.append(report)
+            if rows:
+                print(f"    {format_rows(rows)}")
+        print(format_stage_reports(reports))
+        if ctx.get("metrics_path"):
+            write_metrics(ctx["metrics_path"], ctx, started_at, _stage_report("total", {}, run_before, _counters()))
+        return reports
+
+
+def _counters() -> Dict[str, float]:
+    """当前的累计计数：墙钟、CPU（含已回收子进程）、读入行数/字节数、解析缓存命中/未命中。"""
+    times = os.times()
+    cache = parse_cache_stats()
+    inputs = input_stats()
+    return {
+        "wall": time.perf_counter(),
+        "cpu": times.user + times.system + times.children_user + times.children_system,
+        "lines": inputs["lines"],
+        "bytes": inputs["bytes"],
+        "hits": cache["hits"],
+        "misses": cache["misses"],
+    }
+
+
+def _stage_report(name: str, rows: Dict[str, int], before: Dict[str, float], after: Dict[str, float]) -> Dict:
+    """
+    两次计数之差即本阶段的指标。峰值 RSS 是进程启动以来的高水位（阶段结束时读取），
+    peak_rss_workers_mb 为已结束的解析子进程中最大的峰值。
+    """
+    hits, misses = after["hits"] - before["hits"], after["misses"] - before["misses"]
+    return {
+        "stage": name,
+        "seconds": after["wall"] - before["wall"],
+        "cpu_seconds": after["cpu"] - before["cpu"],
+        "rows": dict(rows),
+        "rows_in": after["lines"] - before["lines"],
+        "bytes_in": after["bytes"] - before["bytes"],
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_workers_mb": peak_rss_mb(children=True),
+        "parse_cache_hits": hits,
+        "parse_cache_misses": misses,
+        "parse_cache_hit_rate": hits / (hits + misses) if hits + misses else None,
+    }
+
+
+def _profile_selected(spec: Optional[str], index: int, name: str) -> bool:
+    """spec 为 "all"，或逗号分隔的阶段序号（从 1 起，与 [i/n] 一致）/ 阶段名片段。"""
+    if not spec:
+        return False
+    for item in spec.split(","):
+        item = item.strip()
+        if item == "all" or item == str(index) or (item and not item.isdigit() and item in name):
+            return True
+    return False
+
+
+def _run_profiled(stage: Stage, ctx: Dict, profile_path: Path) -> Optional[Dict[str, int]]:
+    """在 cProfile 下运行一个阶段，统计写入 profile_path，并打印累计时间最多的 PROFILE_TOP 个函数。"""
+    profile_path.parent.mkdir(parents=True, exist_ok=True)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(stage.fn, ctx)
+    finally:
+        profiler.dump_stats(str(profile_path))
+        print(f"    性能分析：{profile_path}")
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(PROFILE_TOP)
+
+
+def write_metrics(path: Path, ctx: Dict, started_at: str, total: Dict):
+    """把本次运行的输入、配置、各阶段报告与总计写成 JSON。"""
+    repo_inputs = ctx.get("repo_paths")
+    metrics = {
+        "started_at": started_at,
+        "argv": sys.argv,
+        "workers": ctx.get("workers"),
+        "inputs": {
+            "dump": str(ctx["dump_path"]) if ctx.get("dump_path") else None,
+            "delta": str(ctx["delta_path"]) if ctx.get("delta_path") else None,
+            "repos": [str(p) for p in repo_inputs] if repo_inputs else None,
+        },
+        "total": total,
+        "stages": ctx["stage_reports"],
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(metrics, f, ensure_ascii=False, indent=2)
+
+
+def format_rows(rows: Dict[str, int]) -> str:
+    return "，".join(f"{name} {count}" for name, count in rows.items())
+
+
+def format_stage_reports(reports: Iterable[Dict]) -> str:
+    lines = ["各阶段耗时与行数："]
+    for report in reports:
+        read = f"读入 {report['rows_in']} 行 / {report['bytes_in'] / (1 << 20):.1f} MB" if report["bytes_in"] else ""
+        lines.append(
+            f"    {report['seconds']:8.2f}s  CPU {report['cpu_seconds']:8.2f}s  {report['stage']}  "
+            f"{read}  {format_rows(report['rows'])}".rstrip()
+        )
+    return "\n".join(lines)
+
+
+# ----------- 下载榜 ----------- #
+
+def load_top_packages(data_dir: Path, top_n: Optional[int] = None) -> Dict[str, Dict]:
+    """读取下载榜（top_n 非空时只取前 top_n 个），返回 name -> {downloads, rank, is_top}。"""
+    data = decode_top_packages(read_input_text(resolve_input(data_dir / TOP_PACKAGES_FILE)))
+    result = {}
+    for idx, row in enumerate(data[:top_n], start=1):
+        name = normalize_name(row["project"])
+        result[name] = {
+            "downloads": int(row["download_count"]),
+            "rank": idx,
+            "is_top": True,
+        }
+    return result
+
+
+def load_top_stage(ctx: Dict, top_n: Optional[int] = None) -> Dict[str, int]:
+    ctx["top_info"] = load_top_packages(ctx["data_dir"], top_n)
+    ctx["top_set"] = set(ctx["top_info"])
+    return {"top": len(ctx["top_info"])}
+
+
+# ----------- 仓库 requirements ----------- #
+
+def repo_paths(data_dir: Path) -> List[Path]:
+    """repo requirements 输入文件：优先使用 1w 分片，不存在则回退旧版单文件（都可以是压缩文件）。"""
+    paths = [resolve_input(data_dir / name) for name in REPO_FILES]
+    if not all(p.exists() for p in paths):
+        paths = [resolve_input(data_dir / LEGACY_REPO_FILE)]
+    return paths
+
+
+def _repo_shard(
+    path: Path,
+    start: int,
+    end: int,
+    keep_packages: Set[str],
+    part_paths: Tuple[Path, Path, Path],
+    desc: Optional[str] = None,
+) -> Dict:
+    """
+    解析 repo 文件的 [start, end) 字节区间，Repo、Repo->Package、Repo->Topic 行分别写入三个无表头 part 文件。
+    分片内按 full_name 去重（首次出现为准），跨分片的去重由合并时完成；
+    返回按出现顺序的 full_name 列表、各 part 行数与吞吐统计。
+    """
+    t0 = time.perf_counter()
+    names: List[str] = []
+    seen_full_name: Set[str] = set()
+    lines = 0
+    repos_path, depends_path, topics_path = part_paths
+    with CsvStreamWriter(repos_path, REPO_FIELDS, header=False) as repos_out, \
+            CsvStreamWriter(depends_path, REPO_DEPENDS_FIELDS, header=False) as repo_depends_out, \
+            CsvStreamWriter(topics_path, REPO_TOPIC_FIELDS, header=False) as repo_topics_out:
+        for line in progress(iter_range_lines(path, start, end), desc):
+            lines += 1
+            line = line.strip()
+            if not line:
+                continue
+            obj = decode_repo_row(line)
+            full_name = obj.get("full_name")
+            if not full_name:
+                continue
+            if full_name in seen_full_name:
+                continue
+            seen_full_name.add(full_name)
+            names.append(full_name)
+
+            repos_out.write(
+                {
+                    "full_name": full_name,
+                    "stars": obj.get("stargazers_count", 0),
+                    "about": obj.get("about", "") or "",
+                }
+            )
+
+            topics = obj.get("about_topics") or []
+            for t in topics:
+                t_norm = t.strip().lower()
+                if t_norm:
+                    repo_topics_out.write({"repo": full_name, "topic": t_norm})
+
+            req_text = obj.get("requirements") or ""
+            for raw in req_text.splitlines():
+                raw = raw.strip()
+                if not raw or raw.startswith("#"):
+                    continue
+                pkg, spec, marker = parse_requirement(raw)
+                if not pkg:
+                    continue
+                if pkg not in keep_packages:
+                    continue  # 忽略噪声包
+                repo_depends_out.write(
+                    {
+                        "repo": full_name,
+                        "pkg": pkg,
+                        "spec": spec,
+                        "marker": marker,
+                        "spec_intervals": encode_spec(spec),
+                        "env_mask": marker_mask(marker),
+                    }
+                )
+    return {
+        "names": names,
+        "repos": repos_out.count,
+        "repo_depends": repo_depends_out.count,
+        "repo_topics": repo_topics_out.count,
+        "lines": lines,
+        "bytes": None if end == UNKNOWN_END else end - start,  # gz / xz 等解压后大小未知
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+def _iter_part_rows(part_path: Path, fieldnames: List[str], drop: Set[str]) -> Iterator[Dict]:
+    """逐行读取无表头 part 文件，跳过首列（仓库名）在 drop 中的行。"""
+    with part_path.open("r", encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if row[0] not in drop:
+                yield dict(zip(fieldnames, row))
+
+
+def parse_repo_requirements(
+    paths: List[Path],
+    keep_packages: Set[str],
+    repos_out: Union[CsvStreamWriter, TableWriter],
+    repo_depends_out: Union[CsvStreamWriter, TableWriter],
+    topics_out: Union[CsvStreamWriter, TableWriter],
+    repo_topics_out: Union[CsvStreamWriter, TableWriter],
+    work_dir: Path,
+    workers: int,
+) -> List[Dict]:
+    """
+    解析 GitHub 仓库的 requirements，生成 Repo 节点、Repo->Package 依赖、Topic 关系，写入各 CSV（直连模式下送入导入队列）。
+    合并时每个分片先写 Repo 行再写它的关系行，Topic 行先于引用它的 Repo->Topic 行。
+    仅保留依赖包名在 keep_packages 中的记录，减少噪声。
+
+    各 repo 文件按行对齐的字节区间切分，由 workers 个进程并行解析（各进程有自己的 requirement 解析缓存），
+    再按文件与区间顺序合并：full_name 重复时以首次出现为准，输出与串行逐行一致。
+    返回每个分片的统计（文件、区间、行数、字节数、耗时）。
+    """
+    sources = [(path, start, end) for path in paths for start, end in plan_ranges(path, workers)]
+    part_dir = work_dir / "parts"
+    part_dir.mkdir(parents=True, exist_ok=True)
+    tables = ("repos", "depends", "topics")
+    args = [
+        (*src, keep_packages, tuple(part_dir / f"repos-{i:05d}.{table}.csv" for table in tables))
+        for i, src in enumerate(sources)
+    ]
+    results = run_shards(_repo_shard, args, workers, "解析 repo requirements")
+
+    seen_full_name: Set[str] = set()
+    for (path, start, end, _, part_paths), stats in zip(args, results):
+        drop = seen_full_name.intersection(stats["names"])  # 已在前面的分片出现过的仓库
+        seen_full_name.update(stats["names"])
+        repos_path, depends_path, topics_path = part_paths
+        if drop:
+            for row in _iter_part_rows(repos_path, REPO_FIELDS, drop):
+                repos_out.write(row)
+            for row in _iter_part_rows(depends_path, REPO_DEPENDS_FIELDS, drop):
+                repo_depends_out.write(row)
+        else:
+            repos_out.append_part(repos_path, stats["repos"])
+            repo_depends_out.append_part(depends_path, stats["repo_depends"])
+        for row in _iter_part_rows(topics_path, REPO_TOPIC_FIELDS, drop):
+            repo_topics_out.write(row)
+            topics_out.write({"name": row["topic"]})
+        stats.update(path=path, start=start, end=end, duplicates=len(drop))
+        del stats["names"]
+    return results
+
+
+def format_shard_throughput(stats: Dict) -> str:
+    seconds = max(stats["seconds"], 1e-9)
+    if stats["bytes"] is None:
+        return (
+            f"{stats['path'].name}（解压后大小未知）：{stats['lines']} 行，{stats['seconds']:.2f}s，"
+            f"{stats['lines'] / seconds:.0f} 行/s，跨分片重复 {stats['duplicates']}"
+        )
+    return (
+        f"{stats['path'].name} [{stats['start']}, {stats['end']})：{stats['lines']} 行，"
+        f"{stats['bytes'] / (1 << 20):.1f} MB，{stats['seconds']:.2f}s，"
+        f"{stats['lines'] / seconds:.0f} 行/s，{stats['bytes'] / (1 << 20) / seconds:.1f} MB/s，"
+        f"跨分片重复 {stats['duplicates']}"
+    )
+
+
+def _table_writer(ctx: Dict, name: str, fieldnames: List[str]) -> Union[CsvStreamWriter, TableWriter]:
+    """直连模式下返回把行送入导入队列的 TableWriter，否则返回 out_dir 下 <name>.csv 的 CsvStreamWriter。"""
+    if ctx.get("graph") is not None:
+        return ctx["graph"].writer(name, fieldnames)
+    return CsvStreamWriter(ctx["out_dir"] / f"{name}.csv", fieldnames)
+
+
+def repo_stage(ctx: Dict) -> Dict[str, int]:
+    """解析 repo requirements，只保留依赖 ctx["packages"] 中包的边，打印各分片吞吐。"""
+    paths = ctx.get("repo_paths") or repo_paths(ctx["data_dir"])
+    with _table_writer(ctx, "repos", REPO_FIELDS) as repos_out, \
+            _table_writer(ctx, "repo_depends", REPO_DEPENDS_FIELDS) as repo_depends_out, \
+            _table_writer(ctx, "topics", TOPIC_FIELDS) as topics_out, \
+            _table_writer(ctx, "repo_topics", REPO_TOPIC_FIELDS) as repo_topics_out:
+        shard_stats = parse_repo_requirements(
+            paths, set(ctx["packages"]), repos_out, repo_depends_out, topics_out, repo_topics_out,
+            ctx["work_dir"], ctx["workers"],
+        )
+    for stats in shard_stats:
+        print(f"    {format_shard_throughput(stats)}")
+    return {"repos": repos_out.count, "repo_depends": repo_depends_out.count, "repo_topics": repo_topics_out.count}
+
+
+# ----------- 输出 ----------- #
+
+def write_csv(path: Path, rows: Iterable[Dict], fieldnames: List[str]) -> int:
+    """
+    按固定表头写出 CSV（没有行时也写表头），返回行数。
+    rows 也可以是列式表（带 fields 与 iter_values()，如 etl_flash 的 VersionTable），按表头顺序直接写出各行的值。
+    """
+    with CsvStreamWriter(path, fieldnames) as writer:
+        if hasattr(rows, "iter_values") and list(rows.fields) == list(fieldnames):
+            for values in rows.iter_values():
+                writer.write_values(values)
+        else:
+            for row in rows:
+                writer.write(row)
+    return writer.count
+
+
+def feed_tables(ctx: Dict, tables: Dict[str, Tuple[List[str], Iterable[Dict]]]):
+    """
+    记下已成形的表（表名 -> (表头, 行)）。直连模式下立即交给后台线程导入，与后续阶段重叠，不再留给 emit_stage；
+    否则存入 ctx["tables"]，由 emit_stage 写出 CSV。
+    """
+    graph = ctx.get("graph")
+    if graph is None:
+        ctx["tables"] = tables
+    else:
+        graph.feed({name: rows for name, (_, rows) in tables.items()})
+        ctx["tables"] = {}
+
+
+def emit_stage(ctx: Dict) -> Dict[str, int]:
+    """
+    写出 ctx["tables"]（表名 -> (表头, 行)），把输出目录中的各 CSV 另存 Parquet，ctx["bulk"] 时生成 neo4j-admin 导入文件。
+    直连模式下改为把剩余的表送入导入队列，等全部批导入完成，返回各表导入的行数。
+    """
+    graph = ctx.get("graph")
+    if graph is not None:
+        for name, (_, rows) in ctx["tables"].items():
+            graph.put_many(name, rows)
+            graph.close_table(name)
+        counts = graph.close()
+        print(f"    {graph.sink.summary()}；生产者等待队列 {graph.blocked_seconds:.2f}s")
+        return counts
+    out_dir = ctx["out_dir"]
+    counts = {name: write_csv(out_dir / f"{name}.csv", rows, fields) for name, (fields, rows) in ctx["tables"].items()}
+    parquet_paths = write_parquet_tables(out_dir, TABLE_COLUMNS)
+    if parquet_paths:
+        print(f"    已另存 {len(parquet_paths)} 个 Parquet 文件")
+    if ctx.get("bulk"):
+        bulk_counts = write_bulk_import(out_dir)
+        print(f"    已生成 neo4j-admin 导入文件：{out_dir / 'bulk'}（{bulk_counts}）")
+    return counts
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+依赖约束的预编译区间：ETL 时把 specifier 归一成半开版本区间，下游只做字符串比较，不再解析 SpecifierSet。
+
+- version_key(v)：版本的保序键，两个键按字符串比较的结果与 packaging.version.Version 的顺序一致
+  （1.0 与 1.0.0 的键相同）；非法版本返回空串；
+- encode_spec(spec)：区间编码 "lo,hi;lo,hi"，每段为 [lo, hi)，lo 为空表示无下界、hi 为空表示无上界；
+  无约束编码为 ","，不可满足编码为 "!"；含 === 或无法解析时为空串，下游需回退到 SpecifierSet；
+- spec_contains(encoded, key)：区间判定，结果等同 SpecifierSet(spec).contains(v, prereleases=True)；
+- version_ordinals(versions)：包内版本的稠密整数序号（PEP 440 顺序），ETL 写入 version_ordinal / latest_ordinal。
+
+区间语义与 packaging 一致：~= 与 ==x.* 展开为 [x.dev0, 下一前缀.dev0)，!= 取补集，
+== / != / <= 不带本地版本时包含 V+local，<V 排除 V 的预发布，>V 排除 V 的后发布与本地版本。
+ETL 把 encode_spec 的结果写入 package_version_requires / repo_depends 的 spec_intervals 列，
+把 version_key 写入 package_versions 的 version_key 列。
+
+用法：
+    python spec_intervals.py check                   # 核对 src/out/：每条约束对其目标包的全部版本
+    python spec_intervals.py check --all             # 每个约束对数据集中的全部版本
+    python spec_intervals.py check --out flash/out
+"""
+
+import argparse
+import functools
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from packaging.specifiers import InvalidSpecifier, SpecifierSet
+from packaging.version import InvalidVersion, Version
+
+from etl_common import PARSE_CACHE_SIZE, read_table
+
+OUT_DIR = Path(__file__).resolve().parent / "out"
+
+ANY = ","  # 无约束
+EMPTY = "!"  # 不可满足
+
+# 键的构成（每一段都是自定界的，因此任何键都不是另一个键的前缀）：
+#   epoch | release 各段（去掉末尾 0）+ "0" | pre | post | dev | local
+# 数字写成 "长度字符 + 十进制"，长度字符按 _LEN 递增，使数值顺序与字符串顺序一致。
+# pre：仅 dev 的版本 "0" < a "1" < b "2" < rc "3" < 无 "4"；post：无 "0" < 有 "1"；
+# dev：有 "0" < 无 "1"；local：无 "0"，有则 "1" + 各段 + "0"，字符串段 "1" + s + "-" 排在数字段 "2" 之前。
+_LEN = "0123456789abcdefghijklmnopqrstuvwxyz"
+_PRE_RANK = {"a": "1", "b": "2", "rc": "3"}
+_SUCC = "+"  # 比键中任何字符都小：key + _SUCC 恰好紧跟在 key 之后，用作包含上界 / 排除下界
+
+Interval = Tuple[str, Optional[str]]  # [lo, hi)，lo == "" 为无下界，hi 为 None 为无上界
+
+
+# ----------- 版本键 ----------- #
+
+def _num(n: int) -> str:
+    s = str(n)
+    if len(s) >= len(_LEN):
+        raise ValueError(f"版本号段过长：{n}")
+    return _LEN[len(s)] + s
+
+
+def _release(epoch: int, release: Tuple[int, ...]) -> str:
+    end = len(release)
+    while end and release[end - 1] == 0:
+        end -= 1
+    return _num(epoch) + "".join("1" + _num(n) for n in release[:end]) + "0"
+
+
+def _pre(pre: Optional[Tuple[str, int]], post: Optional[int], dev: Optional[int]) -> str:
+    if pre is None:
+        return "0" if post is None and dev is not None else "4"
+    return _PRE_RANK[pre[0]] + _num(pre[1])
+
+
+def _public(epoch, release, pre=None, post=None, dev=None) -> str:
+    return (
+        _release(epoch, release)
+        + _pre(pre, post, dev)
+        + ("0" if post is None else "1" + _num(post))
+        + ("1" if dev is None else "0" + _num(dev))
+    )
+
+
+def _public_of(v: Version) -> str:
+    return _public(v.epoch, v.release, v.pre, v.post, v.dev)
+
+
+def _key_of(v: Version) -> str:
+    if v.local is None:
+        return _public_of(v) + "0"
+    parts = ("2" + _num(int(p)) if p.isdigit() else "1" + p + "-" for p in v.local.split("."))
+    return _public_of(v) + "1" + "".join(parts) + "0"
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def version_key(version: str) -> str:
+    """版本字符串的保序键；不是合法 PEP 440 版本时返回空串（不满足任何区间）。"""
+    try:
+        return _key_of(Version(version))
+    except (InvalidVersion, ValueError):
+        return ""
+
+
+def version_ordinals(versions: Iterable[str]) -> Dict[str, int]:
+    """
+    同一包内各版本的稠密序号，从 1 开始按 PEP 440 升序，相等的版本（如 1.0 与 1.0.0）同号；
+    非法版本排在所有合法版本之前，彼此按字符串排序。
+    """
+    keys = {v: (1, version_key(v)) if version_key(v) else (0, v) for v in set(versions)}
+    rank = {key: i for i, key in enumerate(sorted(set(keys.values())), start=1)}
+    return {v: rank[key] for v, key in keys.items()}
+
+
+# ----------- 约束 -> 区间 ----------- #
+
+def _after_locals(v: Version) -> str:
+    """V 与所有 V+local 之后、V.post0 之前的位置。"""
+    return _public_of(v) + "2"
+
+
+def _after_posts(v: Version) -> str:
+    """V、V+local 与所有 V.postN 之后、下一个版本之前的位置（V 无 post/dev）。"""
+    return _release(v.epoch, v.release) + _pre(v.pre, v.post, v.dev) + "2"
+
+
+def _next_prefix_dev0(epoch: int, release: Tuple[int, ...]) -> str:
+    """1.2 -> 1.3.dev0"""
+    return _public(epoch, release[:-1] + (release[-1] + 1,), dev=0) + "0"
+
+
+def _spec_intervals(op: str, ver: str) -> List[Interval]:
+    if ver.endswith(".*"):
+        base = Version(ver[:-2])
+        lo, hi = _public(base.epoch, base.release, dev=0) + "0", _next_prefix_dev0(base.epoch, base.release)
+        return [(lo, hi)] if op == "==" else [("", lo), (hi, None)]
+
+    v = Version(ver)
+    key = _key_of(v)
+    if op == ">=":
+        return [(key, None)]
+    if op == "<=":
+        return [("", _after_locals(v))]
+    if op == ">":
+        if v.dev is not None:
+            return [(_public(v.epoch, v.release, v.pre, v.post, v.dev + 1) + "0", None)]
+        if v.post is not None:
+            return [(_public(v.epoch, v.release, v.pre, v.post + 1, 0) + "0", None)]
+        return [(_after_posts(v), None)]
+    if op == "<":
+        if v.is_prerelease:
+            return [("", key)]
+        return [("", _public(v.epoch, v.release, v.pre, v.post, 0) + "0")]
+    if op == "~=":
+        return [(key, _next_prefix_dev0(v.epoch, v.release[:-1]))]
+
+    upper = key + _SUCC if "+" in ver else _after_locals(v)
+    if op == "==":
+        return [(key, upper)]
+    if op == "!=":
+        return [("", key), (upper, None)]
+    raise ValueError(f"无法预编译的运算符：{op}")
+
+
+def _hi_lt(a: Optional[str], b: Optional[str]) -> bool:
+    return a is not None and (b is None or a < b)
+
+
+def _intersect(left: List[Interval], right: List[Interval]) -> List[Interval]:
+    """两个有序、互不重叠的区间列表求交。"""
+    result: List[Interval] = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        lo = max(left[i][0], right[j][0])
+        hi = right[j][1] if _hi_lt(right[j][1], left[i][1]) else left[i][1]
+        if hi is None or lo < hi:
+            result.append((lo, hi))
+        if _hi_lt(left[i][1], right[j][1]):
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def encode_spec(spec: str) -> str:
+    """把 specifier 字符串编码成区间列表；含 === 或无法解析时返回空串。"""
+    try:
+        specifiers = SpecifierSet(spec)
+        intervals: List[Interval] = [("", None)]
+        for s in specifiers:
+            if s.operator == "===":
+                return ""
+            intervals = _intersect(intervals, _spec_intervals(s.operator, s.version))
+    except (InvalidSpecifier, InvalidVersion, ValueError):
+        return ""
+    if not intervals:
+        return EMPTY
+    return ";".join(f"{lo},{hi or ''}" for lo, hi in intervals)
+
+
+def spec_contains(encoded: str, key: str) -> Optional[bool]:
+    """版本键是否落在 encode_spec 的区间内；encoded 为空（未能预编译）时返回 None。"""
+    if not encoded:
+        return None
+    if encoded == ANY:
+        return True  # 空约束连非法版本也接受，与 SpecifierSet("") 一致
+    if not key or encoded == EMPTY:
+        return False
+    for part in encoded.split(";"):
+        lo, _, hi = part.partition(",")
+        if key < lo:
+            return False
+        if not hi or key < hi:
+            return True
+    return False
+
+
+# ----------- 差分核对 ----------- #
+
+def _check_pairs(pairs: Iterable[Tuple[str, str, str]], versions: Iterable[str]) -> Tuple[int, List[str]]:
+    """pairs 为 (spec, 已存的区间编码, 描述)；逐个版本比对 spec_contains 与 SpecifierSet.contains。"""
+    checked, errors = 0, []
+    versions = list(versions)
+    for spec, stored, where in pairs:
+        if stored != encode_spec(spec):
+            errors.append(f"{where}: 存储的区间 {stored!r} 与重新编码 {encode_spec(spec)!r} 不一致")
+            continue
+        if not stored:
+            continue
+        specifiers = SpecifierSet(spec)
+        for version in versions:
+            checked += 1
+            want = specifiers.contains(version, prereleases=True)
+            if spec_contains(stored, version_key(version)) != want:
+                errors.append(f"{where}: {version!r} 对 {spec!r} 应为 {want}")
+    return checked, errors
+
+
+def differential_check(out_dir: Path, all_versions: bool = False) -> Tuple[int, List[str]]:
+    """
+    用 out_dir 中的数据核对区间编码：默认每个 (目标包, spec) 对该包在数据集中的全部版本，
+    all_versions 时每个 spec 对数据集中出现过的全部版本字符串。返回 (比对次数, 不一致列表)。
+    """
+    checked, errors = 0, []
+    by_package: Dict[str, Set[str]] = {}
+    for row in read_table(out_dir, "package_versions"):
+        by_package.setdefault(row["name"], set()).add(row["version"])
+        if row["version_key"] != version_key(row["version"]):
+            errors.append(f"{row['name_version']}: 存储的 version_key 与重新计算的不一致")
+
+    groups: Dict[Tuple[str, str, str], str] = {}
+    for table, dest_col in (("package_version_requires", "dest"), ("repo_depends", "pkg")):
+        for row in read_table(out_dir, table):
+            groups.setdefault((row[dest_col], row["spec"], row["spec_intervals"]), table)
+
+    if all_versions:
+        everything = set().union(*by_package.values()) if by_package else set()
+        pairs = {(spec, stored, f"{table} spec={spec!r}") for (_, spec, stored), table in groups.items()}
+        checked, errs = _check_pairs(sorted(pairs), sorted(everything))
+        return checked, errors + errs
+
+    for (dest, spec, stored), table in groups.items():
+        n, errs = _check_pairs([(spec, stored, f"{table} {dest} spec={spec!r}")], by_package.get(dest, ()))
+        checked += n
+        errors.extend(errs)
+    return checked, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="依赖约束的预编译区间")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    check = sub.add_parser("check", help="与 SpecifierSet.contains 做差分核对")
+    check.add_argument("--out", type=Path, default=OUT_DIR, help="ETL 输出目录")
+    check.add_argument("--all", action="store_true", help="每个约束对数据集中的全部版本核对")
+    args = parser.parse_args()
+
+    checked, errors = differential_check(args.out, args.all)
+    for line in errors[:50]:
+        print(f"  {line}")
+    print(f"比对 {checked} 次，不一致 {len(errors)} 处")
+    if errors:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+合成数据生成器：在没有 2GB+ 真实 dump 与 BigQuery 权限时，生成与真实数据同形的输入文件，供 ETL 基准与回归使用。
+
+生成的文件（与 data/ 下的真实文件同名、同字段）：
+- google_sql_with_pyv_pkg.json                       PyPI dump，每行一个版本，按包分组输出
+- google_sql_with_time_pkg.json                      同一份 dump（硬链接，失败时复制），flash/etl_flash.py 读取
+- top_packages_by_downloads_10000.json               下载榜，依赖越多的包排名越靠前
+- python_repos_requirements_more_info_1w1.jsonl      GitHub 仓库 requirements（两个分片，少量仓库跨分片重复）
+- python_repos_requirements_more_info_1w2.jsonl
+- python_repos_requirements_more_info.jsonl          旧版单文件（两个分片的拼接）
+- synth_meta.json                                    生成参数与行数，bench_etl.py 据此判断能否复用
+
+分布取自 PyPI 的公开统计（量级近似即可）：每包版本数为截断对数正态（中位数约 4，长尾到上千）；
+约三分之一的版本没有 requires_dist，其余条数为对数正态（中位数约 3）；约 30% 的依赖带 marker，
+其中以 extra == 为主，其次是 python_version 与平台条件；被依赖的包按 Zipf（1/rank）分布，排名靠前的包被依赖得最多。
+整个过程流式写出，内存只与下载榜大小相关，--rows 可从 1 万到 5000 万。
+
+用法：
+    python synth_data.py --rows 100000 --out /tmp/pyharmonykg-bench/data-100000
+    python synth_data.py --rows 50000000 --out /mnt/big/synth --seed 1 --repos 10000
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from etl_common import normalize_name
+
+DUMP_FILE = "google_sql_with_pyv_pkg.json"
+TIME_DUMP_FILE = "google_sql_with_time_pkg.json"
+TOP_FILE = "top_packages_by_downloads_10000.json"
+REPO_SHARD_FILES = ["python_repos_requirements_more_info_1w1.jsonl", "python_repos_requirements_more_info_1w2.jsonl"]
+LEGACY_REPO_FILE = "python_repos_requirements_more_info.jsonl"
+META_FILE = "synth_meta.json"
+
+TOP_N = 10000
+VERSIONS_LOGNORMAL = (1.4, 1.2)  # 每包版本数 ~ lognormal(μ, σ)，中位数约 4
+MAX_VERSIONS = 3000
+NO_REQUIRES_RATE = 0.35  # 没有 requires_dist 的版本占比
+REQUIRES_LOGNORMAL = (1.1, 0.8)  # 有依赖时的条数，中位数约 3
+MAX_REQUIRES = 120
+MARKER_RATE = 0.3  # 带 marker 的依赖占比
+INVALID_VERSION_RATE = 0.003  # 非 PEP 440 版本占比
+REPO_OVERLAP_RATE = 0.01  # 第二个分片里重复第一个分片仓库的比例
+
+# (权重, 取值)
+MARKERS: List[Tuple[float, str]] = [
+    (0.55, 'extra == "{extra}"'),
+    (0.15, 'python_version < "3.{minor}"'),
+    (0.08, 'python_version >= "3.{minor}"'),
+    (0.06, 'sys_platform == "win32"'),
+    (0.04, 'platform_system != "Windows"'),
+    (0.03, 'sys_platform == "darwin"'),
+    (0.04, 'python_version < "3.{minor}" and extra == "{extra}"'),
+    (0.03, 'implementation_name == "cpython"'),
+    (0.02, 'platform_machine == "x86_64" and sys_platform == "linux"'),
+]
+SPECS: List[Tuple[float, str]] = [
+    (0.30, ""),
+    (0.35, ">={a}.{b}"),
+    (0.08, "=={a}.{b}.{c}"),
+    (0.07, ">={a}.{b},<{a2}"),
+    (0.05, "~={a}.{b}"),
+    (0.04, "<{a2}"),
+    (0.03, " (>={a}.{b})"),
+    (0.03, ">={a}.{b},!={a}.{b}.{c}"),
+    (0.03, "=={a}.*"),
+    (0.02, ">={a}.{b}rc1"),
+]
+REQUIRES_PYTHON: List[Tuple[float, Optional[str]]] = [
+    (0.40, None),
+    (0.10, ""),
+    (0.12, ">=3.6"),
+    (0.10, ">=3.7"),
+    (0.08, ">=3.8"),
+    (0.06, ">=3.9"),
+    (0.03, ">=3.10"),
+    (0.05, ">=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*"),
+    (0.03, ">=3.8,<4.0"),
+    (0.02, "~=3.7"),
+    (0.01, ">=3.6.*"),  # 非法约束，真实 dump 中也存在
+]
+EXTRAS = ["dev", "test", "docs", "all", "async", "socks", "security", "yaml", "cli", "aws"]
+SYLLABLES = [
+    "py", "data", "web", "json", "http", "async", "lib", "core", "auto", "fast",
+    "tiny", "cloud", "ml", "sql", "test", "dev", "log", "cache", "task", "net",
+]
+TOPICS = [
+    "python", "machine-learning", "deep-learning", "web", "api", "cli", "data-science", "django",
+    "flask", "automation", "nlp", "computer-vision", "pytorch", "tensorflow", "bot", "scraping",
+]
+INVALID_VERSIONS = ["2004d", "1.0-beta_final", "0.1dev-r123", "latest", "1.2.3.4.5a.b", "v1.0-2023"]
+WORDS = "fast simple tool for data web api client server async parser library python wrapper utils".split()
+
+
+# ----------- 基础 ----------- #
+
+def _weighted(rng: random.Random, table: Sequence[Tuple[float, object]]):
+    x = rng.random() * sum(w for w, _ in table)
+    for weight, value in table:
+        x -= weight
+        if x < 0:
+            return value
+    return table[-1][1]
+
+
+def _lognormal_int(rng: random.Random, params: Tuple[float, float], low: int, high: int) -> int:
+    return max(low, min(high, int(rng.lognormvariate(*params))))
+
+
+def estimated_packages(rows: int) -> int:
+    """按版本数分布的均值估算包数，决定依赖与下载榜的取值范围。"""
+    mean = math.exp(VERSIONS_LOGNORMAL[0] + VERSIONS_LOGNORMAL[1] ** 2 / 2)
+    return max(1, int(rows / mean))
+
+
+def package_name(i: int) -> str:
+    """第 i 个包的展示名：i 越小越热门；约十分之一带大写与下划线，检验包名规范化。"""
+    n = len(SYLLABLES)
+    name = SYLLABLES[i % n] + SYLLABLES[(i // n) % n] + (f"-{i // (n * n)}" if i >= n * n else "")
+    if i % 10 == 3:
+        name = name.capitalize().replace("-", "_")
+    return name
+
+
+def _zipf_rank(rng: random.Random, n: int) -> int:
+    """[0, n) 上 P(r) ∝ 1/(r+1) 的排名（对数均匀采样）。"""
+    return min(n - 1, int(math.exp(rng.random() * math.log(n + 1))) - 1)
+
+
+# ----------- PyPI dump ----------- #
+
+def _versions(rng: random.Random, count: int) -> Iterator[str]:
+    """一个包按发布顺序的版本号：以补丁版本为主，夹杂预发布、post、dev 与少量非法版本。"""
+    major, minor, patch = rng.choice((0, 0, 1, 2)), rng.randint(0, 3), 0
+    seen = set()
+    while len(seen) < count:
+        roll = rng.random()
+        if roll < 0.05:
+            major, minor, patch = major + 1, 0, 0
+        elif roll < 0.30:
+            minor, patch = minor + 1, 0
+        else:
+            patch += 1
+        base = f"{major}.{minor}.{patch}" if rng.random() < 0.8 else f"{major}.{minor}"
+        roll = rng.random()
+        if roll < INVALID_VERSION_RATE:
+            version = rng.choice(INVALID_VERSIONS) + str(len(seen))
+        elif roll < 0.06:
+            version = base + rng.choice(("a", "b", "rc")) + str(rng.randint(1, 3))
+        elif roll < 0.07:
+            version = base + ".post1"
+        elif roll < 0.08:
+            version = base + ".dev0"
+        else:
+            version = base
+        if version not in seen:
+            seen.add(version)
+            yield version
+
+
+def _requirement(rng: random.Random, n_packages: int) -> str:
+    dep = _zipf_rank(rng, n_packages)
+    name = package_name(dep) if rng.random() < 0.5 else normalize_name(package_name(dep))
+    a, b, c = rng.randint(0, 5), rng.randint(0, 20), rng.randint(0, 9)
+    spec = _weighted(rng, SPECS).format(a=a, b=b, c=c, a2=a + 1)
+    extras = f"[{rng.choice(EXTRAS)}]" if rng.random() < 0.03 else ""
+    req = name + extras + spec
+    if rng.random() < MARKER_RATE:
+        marker = _weighted(rng, MARKERS).format(extra=rng.choice(EXTRAS), minor=rng.randint(6, 12))
+        req += "; " + marker
+    return req
+
+
+def dump_rows(rng: random.Random, rows: int) -> Iterator[Dict]:
+    """按包分组产出 rows 行 dump 记录；最后一个包截断到恰好 rows 行。"""
+    n_packages = estimated_packages(rows)
+    emitted = 0
+    i = 0
+    while emitted < rows:
+        count = min(rows - emitted, _lognormal_int(rng, VERSIONS_LOGNORMAL, 1, MAX_VERSIONS))
+        name = package_name(i)
+        uploaded = datetime(2005, 1, 1) + timedelta(days=rng.uniform(0, 7000))
+        requires_python = _weighted(rng, REQUIRES_PYTHON)
+        summary = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 30)))
+        for version in _versions(rng, count):
+            uploaded += timedelta(days=rng.expovariate(1 / 45))
+            if rng.random() < 0.1:
+                requires_python = _weighted(rng, REQUIRES_PYTHON)
+            if rng.random() < NO_REQUIRES_RATE:
+                requires_dist = None if rng.random() < 0.8 else []
+            else:
+                n = _lognormal_int(rng, REQUIRES_LOGNORMAL, 1, MAX_REQUIRES)
+                requires_dist = [_requirement(rng, n_packages) for _ in range(n)]
+            yield {
+                "package": name,
+                "version": version,
+                "summary": summary,
+                "requires_python": requires_python,
+                "requires_dist": requires_dist,
+                "upload_time": uploaded.isoformat(timespec="microseconds" if rng.random() < 0.5 else "seconds"),
+                "packagetype": "bdist_wheel" if rng.random() < 0.7 else "sdist",
+            }
+            emitted += 1
+        i += 1
+
+
+def write_dump(out_dir: Path, rng: random.Random, rows: int) -> int:
+    """写出 PyPI dump 及其 time 版本，返回包数。"""
+    path = out_dir / DUMP_FILE
+    packages, last = 0, None
+    with path.open("w", encoding="utf-8") as f:
+        for row in dump_rows(rng, rows):
+            if row["package"] != last:
+                packages, last = packages + 1, row["package"]
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    time_path = out_dir / TIME_DUMP_FILE
+    time_path.unlink(missing_ok=True)
+    try:
+        os.link(path, time_path)
+    except OSError:
+        shutil.copyfile(path, time_path)
+    return packages
+
+
+# ----------- 下载榜与仓库 ----------- #
+
+def write_top_packages(out_dir: Path, rng: random.Random, rows: int):
+    """下载榜：排名与被依赖的 Zipf 排名一致，下载量按幂律递减并带少量扰动。"""
+    n = min(TOP_N, estimated_packages(rows))
+    top = [
+        {"project": package_name(i), "download_count": int(5e8 / (i + 1) ** 0.9 * rng.uniform(0.9, 1.0))}
+        for i in range(n)
+    ]
+    with (out_dir / TOP_FILE).open("w", encoding="utf-8") as f:
+        json.dump(top, f)
+
+
+def _requirements_txt(rng: random.Random, n_packages: int) -> str:
+    lines = []
+    for _ in range(_lognormal_int(rng, (2.2, 0.9), 0, 300)):
+        roll = rng.random()
+        if roll < 0.05:
+            lines.append("# " + rng.choice(WORDS))
+        elif roll < 0.09:
+            lines.append("")
+        elif roll < 0.10:
+            lines.append(rng.choice(("-e .", "-r requirements-dev.txt", "git+https://github.com/o/r.git#egg=r")))
+        else:
+            name = package_name(_zipf_rank(rng, n_packages))
+            spec = f"=={rng.randint(0, 5)}.{rng.randint(0, 20)}.{rng.randint(0, 9)}" if roll < 0.6 else ""
+            lines.append(name + (spec or _weighted(rng, SPECS[:6]).format(a=1, b=0, c=0, a2=2)))
+    return "\n".join(lines)
+
+
+def write_repos(out_dir: Path, rng: random.Random, rows: int, repos: int):
+    """两个 repo 分片各 repos 个仓库（第二个分片有少量与第一个重复），另写两者拼接的旧版单文件。"""
+    n_packages = estimated_packages(rows)
+    first: List[str] = []
+    serial = 0
+    for shard, name in enumerate(REPO_SHARD_FILES):
+        with (out_dir / name).open("w", encoding="utf-8") as f:
+            for _ in range(repos):
+                if shard and first and rng.random() < REPO_OVERLAP_RATE:
+                    full_name = rng.choice(first)
+                else:
+                    full_name = f"owner{serial % max(1, repos // 3)}/repo{serial}"
+                    serial += 1
+                    if not shard:
+                        first.append(full_name)
+                row = {
+                    "full_name": full_name,
+                    "stargazers_count": int(rng.paretovariate(1.2) * 10),
+                    "about": " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 20))),
+                    "about_topics": rng.sample(TOPICS, rng.randint(0, 6)),
+                    "requirements": _requirements_txt(rng, n_packages),
+                }
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    with (out_dir / LEGACY_REPO_FILE).open("wb") as legacy:
+        for name in REPO_SHARD_FILES:
+            with (out_dir / name).open("rb") as f:
+                shutil.copyfileobj(f, legacy)
+
+
+# ----------- 入口 ----------- #
+
+def generate(out_dir: Path, rows: int, seed: int = 0, repos: Optional[int] = None) -> Dict:
+    """生成全部输入文件，返回写入 synth_meta.json 的元数据。"""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    repos = repos if repos is not None else max(100, min(10000, rows // 100))
+    t0 = time.perf_counter()
+    packages = write_dump(out_dir, random.Random(seed), rows)
+    write_top_packages(out_dir, random.Random(seed + 1), rows)
+    write_repos(out_dir, random.Random(seed + 2), rows, repos)
+    meta = {
+        "rows": rows,
+        "packages": packages,
+        "seed": seed,
+        "repos_per_shard": repos,
+        "dump_bytes": (out_dir / DUMP_FILE).stat().st_size,
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+    with (out_dir / META_FILE).open("w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def load_meta(out_dir: Path) -> Optional[Dict]:
+    path = out_dir / META_FILE
+    if not path.exists():
+        return None
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成与真实数据同形的合成 PyPI dump / 下载榜 / repo requirements")
+    parser.add_argument("--rows", type=int, default=100_000, help="dump 行数（1 万到 5000 万）")
+    parser.add_argument("--out", type=Path, required=True, help="输出目录")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repos", type=int, help="每个 repo 分片的仓库数，默认 rows / 100（100 到 1 万之间）")
+    args = parser.parse_args()
+
+    meta = generate(args.out, args.rows, args.seed, args.repos)
+    print(
+        f"已生成 {meta['rows']} 行 dump（{meta['dump_bytes'] / (1 << 20):.1f} MB）、"
+        f"每分片 {meta['repos_per_shard']} 个仓库，用时 {meta['seconds']:.1f}s：{args.out}"
+    )
+
+
+if __name__ == "__main__":
+    main()
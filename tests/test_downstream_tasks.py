@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+flash/downstream/tasks.py 的解析回归测试：用内存中的假图谱代替 Neo4j 查询。
+
+运行：python -m pytest tests（或 python -m unittest discover tests）
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+sys.path.insert(0, str(SRC_DIR / "flash"))
+sys.path.insert(0, str(SRC_DIR))
+
+try:
+    from downstream import tasks
+except ImportError as e:  # 缺 neo4j / packaging / tqdm 时跳过
+    tasks = None
+    IMPORT_ERROR = str(e)
+
+
+# 假图谱：a@1.0 依赖 b，但只在 extra == "test" 时需要；env_mask 为 None 模拟旧图谱
+VERSIONS = {"a": ["1.0"], "b": ["1.0"]}
+REQUIRES = {
+    "a@1.0": [{"dep": "b", "spec": "", "marker": 'extra == "test"', "env_mask": None}],
+}
+
+
+if tasks is not None:
+
+    class FakeKG(tasks.KGClient):
+        """不连数据库，_run_query 按查询参数从 VERSIONS / REQUIRES 取记录。"""
+
+        def __init__(self, target_python=None, target_platform=None):
+            self.target_python = target_python
+            self.target_platform = target_platform
+
+        def _run_query(self, query, params):
+            if "nv" in params:
+                return REQUIRES.get(params["nv"], [])
+            return [
+                {"ver": v, "ord": i, "python_mask": None}
+                for i, v in reversed(list(enumerate(VERSIONS.get(params["name"], []), 1)))
+            ]
+
+
+@unittest.skipIf(tasks is None, "downstream.tasks 依赖未安装" if tasks is None else "")
+class ExtraDependencyTest(unittest.TestCase):
+    def test_no_target_skips_extra(self):
+        kg = FakeKG()
+        self.assertEqual(kg.get_requires("a", "1.0"), [])
+        res = tasks.resolve_plan(kg, {}, [("a", "", "target")])
+        self.assertTrue(res.ok)
+        self.assertEqual(sorted(res.plan), ["a"])
+
+    def test_target_outside_matrix_skips_extra(self):
+        kg = FakeKG(target_python="2.7", target_platform="linux")
+        res = tasks.resolve_plan(kg, {}, [("a", "", "target")])
+        self.assertEqual(sorted(res.plan), ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()